@@ -0,0 +1,398 @@
+"""
+Deploy tool benchmarks
+
+Run from the repository root:
+    python -m benchmarks.bench [--scale 1] [--repeat 3]
+                               [--save results.json]
+                               [--compare baseline.json]
+
+Throughput is the best of untraced timed runs after a warm-up run,
+peak memory is measured by a separate run under tracemalloc:
+it sees Python allocations only, not libpq and psycopg2 buffers
+
+DB benchmarks start a throwaway PostgreSQL server with initdb/pg_ctl,
+they are skipped if PostgreSQL binaries aren't found
+(PATH or PG_BINDIR environment variable)
+"""
+
+import argparse
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Optional
+from src.deploy_tool.db_postgres import DbPostgres
+from src.deploy_tool.deploy_tool import DeployTool
+from src.deploy_tool.logger import Logger
+from src.deploy_tool.macros import Macros
+
+# Regression threshold for --compare, relative throughput drop
+THRESHOLD: float = 0.2
+
+# Timed runs of each benchmark, --repeat option
+REPEAT: int = 3
+
+MB: int = 1024 * 1024
+
+
+class QuietLogger(Logger):
+    """
+    Logger without messages output
+    """
+
+    def add(self, message) -> None:
+        """ Skip message """
+
+        pass
+
+
+def make_options(count: int) -> dict:
+    """ Options dict with count macroses """
+
+    return {f'option_{i}': f'value_{i}' for i in range(count)}
+
+
+def make_config(path: str, size: int, options: dict, density: int) -> None:
+    """ Config file of size bytes, a macros every density lines """
+
+    names = list(options)
+    with open(path, 'w', encoding='utf-8') as f:
+        written = 0
+        line = 0
+        while written < size:
+            if line % density == 0:
+                text = f'key_{line} = {{{{{names[line % len(names)]}}}}}\n'
+            else:
+                text = f'key_{line} = plain value {line}\n'
+            f.write(text)
+            written += len(text)
+            line += 1
+
+
+def make_dump(path: str, size: int, tables: int) -> None:
+    """ pg_dump like SQL file of size bytes with COPY blocks
+
+        Tables are dropped first, so the dump can be loaded repeatedly
+    """
+
+    rows = max(size // tables // 32, 1)
+    with open(path, 'w', encoding='utf-8') as f:
+        for table in range(tables):
+            f.write(f'DROP TABLE IF EXISTS bench_{table};\n')
+        for table in range(tables):
+            f.write(
+                f'CREATE TABLE bench_{table} '
+                '(id integer, name text, value text);\n'
+            )
+        for table in range(tables):
+            f.write(f'COPY bench_{table} (id, name, value) FROM stdin;\n')
+            for row in range(rows):
+                f.write(f'{row}\tname_{row}\t{{{{option_{row % 10}}}}}\n')
+            f.write('\\.\n')
+        for table in range(tables):
+            f.write(f'CREATE INDEX bench_{table}_id ON bench_{table} (id);\n')
+
+
+def measure(
+    name: str,
+    size: int,
+    function: Callable,
+    repeat: int = REPEAT
+) -> dict:
+    """ Run function, measure throughput and Python peak memory
+
+        tracemalloc slows Python code down several times,
+        so time is measured by untraced runs only
+    """
+
+    # Warm-up run: imports, caches, file system cache
+    function()
+
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+    duration = min(durations)
+
+    tracemalloc.start()
+    try:
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    result = {
+        'name': name,
+        'bytes': size,
+        'runs': repeat,
+        'duration': duration,
+        'throughput_mb_s': size / MB / duration if duration else 0.0,
+        'peak_memory_mb': peak / MB,
+    }
+    print(
+        f'{name:<32} {duration:8.3f} s {result["throughput_mb_s"]:9.1f} MB/s'
+        f' {result["peak_memory_mb"]:8.1f} MB peak'
+    )
+
+    return result
+
+
+def bench_macros(directory: str, scale: float, repeat: int) -> list:
+    """ Macros.replace benchmarks """
+
+    results = []
+    options = make_options(500)
+
+    for density, name in [(1, 'dense'), (50, 'sparse')]:
+        path = os.path.join(directory, f'macros_{name}.conf')
+        make_config(path, int(8 * MB * scale), options, density)
+        with open(path, encoding='utf-8') as f:
+            text = f.read()
+
+        results.append(measure(
+            f'macros_replace_{name}',
+            len(text),
+            lambda: Macros.replace(text, options),
+            repeat
+        ))
+
+    return results
+
+
+def bench_build_config(directory: str, scale: float, repeat: int) -> list:
+    """ DeployTool.build_config benchmarks """
+
+    results = []
+    options = make_options(500)
+    options['mount_dir'] = directory
+
+    for density, name in [(1, 'dense'), (50, 'sparse')]:
+        src = os.path.join(directory, f'build_{name}.conf')
+        make_config(src, int(32 * MB * scale), options, density)
+
+        deploy_tool = DeployTool({'options': options})
+        deploy_tool.logger = QuietLogger()
+        dest = os.path.join(directory, 'out', f'build_{name}.conf')
+
+        results.append(measure(
+            f'build_config_{name}',
+            os.path.getsize(src),
+            lambda: deploy_tool.build_config(src, dest),
+            repeat
+        ))
+
+    return results
+
+
+def bench_query_from_file(
+    directory: str,
+    scale: float,
+    repeat: int
+) -> list:
+    """ DbPostgres.query_from_file benchmarks """
+
+    server = PostgresServer(os.path.join(directory, 'pgdata'))
+    if not server.start():
+        print('query_from_file                  skipped, no PostgreSQL')
+        return []
+
+    results = []
+    try:
+        path = os.path.join(directory, 'dump.sql')
+        make_dump(path, int(64 * MB * scale), 8)
+
+        for workers in [1, 4]:
+            options = make_options(10)
+            options.update(server.options(f'bench_{workers}'))
+
+            db = DbPostgres(options, QuietLogger()).init_db()
+            try:
+                results.append(measure(
+                    f'query_from_file_workers_{workers}',
+                    os.path.getsize(path),
+                    lambda: db.query_from_file(
+                        path,
+                        workers=workers,
+                        defer_indexes=True,
+                        ledger=False
+                    ),
+                    repeat
+                ))
+            finally:
+                db.close()
+    finally:
+        server.stop()
+
+    return results
+
+
+class PostgresServer:
+    """
+    Throwaway local PostgreSQL server
+    """
+
+    def __init__(self, data_dir: str):
+        self.data_dir = data_dir
+        self.port = None
+        self.bindir = os.environ.get('PG_BINDIR') or self.__find_bindir()
+
+    def start(self) -> bool:
+        """ Init and start server, False if PostgreSQL isn't installed """
+
+        if not self.bindir:
+            return False
+
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            self.port = s.getsockname()[1]
+
+        subprocess.run(
+            [
+                os.path.join(self.bindir, 'initdb'),
+                '-D', self.data_dir,
+                '-U', 'postgres',
+                '-A', 'trust',
+            ],
+            check=True,
+            stdout=subprocess.DEVNULL
+        )
+        subprocess.run(
+            [
+                os.path.join(self.bindir, 'pg_ctl'),
+                '-D', self.data_dir,
+                '-o', f'-p {self.port} -k {self.data_dir} -h 127.0.0.1',
+                '-w',
+                'start',
+            ],
+            check=True,
+            stdout=subprocess.DEVNULL
+        )
+
+        return True
+
+    def stop(self) -> None:
+        """ Stop server """
+
+        subprocess.run(
+            [
+                os.path.join(self.bindir, 'pg_ctl'),
+                '-D', self.data_dir,
+                '-m', 'immediate',
+                'stop',
+            ],
+            stdout=subprocess.DEVNULL
+        )
+
+    def options(self, db_name: str) -> dict:
+        """ DbPostgres options """
+
+        return {
+            'db_name': db_name,
+            'db_host': '127.0.0.1',
+            'db_port': str(self.port),
+            'db_user': 'postgres',
+            'db_password': 'postgres',
+        }
+
+    def __find_bindir(self) -> Optional[str]:
+        """ PostgreSQL binaries directory """
+
+        initdb = shutil.which('initdb')
+        if initdb:
+            return os.path.dirname(initdb)
+
+        pg_config = shutil.which('pg_config')
+        if pg_config:
+            bindir = subprocess.run(
+                [pg_config, '--bindir'],
+                stdout=subprocess.PIPE,
+                universal_newlines=True
+            ).stdout.strip()
+            if os.path.isfile(os.path.join(bindir, 'initdb')):
+                return bindir
+
+        return None
+
+
+def compare(results: list, baseline: list) -> bool:
+    """ Print comparison with baseline, False on regressions """
+
+    baseline = {result['name']: result for result in baseline}
+    success = True
+
+    for result in results:
+        base = baseline.get(result['name'])
+        if not base or not base['throughput_mb_s']:
+            continue
+
+        change = result['throughput_mb_s'] / base['throughput_mb_s'] - 1
+        regression = change < -THRESHOLD
+        success = success and not regression
+        print(
+            f'{result["name"]:<32} {change:+8.1%} throughput'
+            f'{"  REGRESSION" if regression else ""}'
+        )
+
+    return success
+
+
+def main() -> int:
+    """ Run benchmarks """
+
+    parser = argparse.ArgumentParser(description='Deploy tool benchmarks')
+    parser.add_argument(
+        '--scale',
+        type=float,
+        default=1.0,
+        help='inputs size multiplier, e.g. 64 for multi-GB dumps'
+    )
+    parser.add_argument(
+        '--repeat',
+        type=int,
+        default=REPEAT,
+        help='timed runs of each benchmark, the best one is reported'
+    )
+    parser.add_argument('--save', help='save results to JSON file')
+    parser.add_argument('--compare', help='compare with saved results')
+    parser.add_argument(
+        '--only',
+        choices=['macros', 'build_config', 'query_from_file'],
+        action='append',
+        help='run only these benchmarks'
+    )
+    args = parser.parse_args()
+    if args.repeat < 1:
+        parser.error('--repeat must be at least 1')
+
+    benchmarks = {
+        'macros': bench_macros,
+        'build_config': bench_build_config,
+        'query_from_file': bench_query_from_file,
+    }
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for name, benchmark in benchmarks.items():
+            if not args.only or name in args.only:
+                results += benchmark(directory, args.scale, args.repeat)
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=1)
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            if not compare(results, json.load(f)):
+                return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
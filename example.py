@@ -45,3 +45,6 @@ dp.build_config(
     '{{config_src_path}}/src.conf',
     '{{config_dest_path}}/dest.conf'
 )
+
+# Close DB connections
+dp.close()
@@ -0,0 +1,89 @@
+import asyncio
+from typing import Iterable, Optional
+from .backend_registry import BackendRegistry
+from .deploy_tool import DeployTool
+
+
+class AsyncDeployTool:
+    """
+    Python deploy tool, asyncio front-end
+
+    DB work runs over psycopg2 async connections,
+    config files are rendered in the executor,
+    so they can run concurrently in one event loop
+    """
+
+    # Async DB backends by db_type, imported on first use
+    DB_BACKENDS: BackendRegistry = BackendRegistry(
+        {'pgsql': '.db_postgres_async:AsyncDbPostgres'},
+        'deploy_tool.async_db_backends'
+    )
+
+    def __init__(self, params: Optional[dict] = None):
+        self.deploy_tool = DeployTool(params)
+        self.logger = self.deploy_tool.logger
+        self.db = None
+
+    async def init_db(self) -> None:
+        """ DB initialisation factory """
+
+        options = self.deploy_tool.get_options()
+
+        try:
+            db = self.__db_factory(options)
+            self.db = await db.init_db()
+        except Exception as e:
+            self.logger.add('Can\'t initialise DB: ' + str(e))
+
+    async def query_from_file(self, path: str = '', **kwargs) -> None:
+        """ Execute DB query from file, kwargs are passed to the DB """
+
+        if not self.db:
+            self.logger.add('DB isn\'t initialised, use init_db() before')
+            return
+
+        try:
+            await self.db.query_from_file(path, **kwargs)
+        except Exception as e:
+            self.logger.add('Can\'t execute query: ' + str(e))
+
+    async def build_config(self, src: str, dest: str) -> bool:
+        """ Build config file """
+
+        loop = asyncio.get_event_loop()
+
+        return await loop.run_in_executor(
+            None,
+            self.deploy_tool.build_config,
+            src,
+            dest
+        )
+
+    async def build_configs(
+        self,
+        configs: Iterable,
+        workers: Optional[int] = None
+    ) -> dict:
+        """ Build config files on a thread pool """
+
+        loop = asyncio.get_event_loop()
+
+        return await loop.run_in_executor(
+            None,
+            self.deploy_tool.build_configs,
+            configs,
+            workers
+        )
+
+    async def close(self) -> None:
+        """ Close DB connections """
+
+        if self.db:
+            await self.db.close()
+
+    def __db_factory(self, options: dict) -> object:
+        """ DB factory """
+
+        backend = self.DB_BACKENDS.load(options['db_type'])
+
+        return backend(options, self.logger)
@@ -0,0 +1,73 @@
+import importlib
+import threading
+
+
+class BackendRegistry:
+    """
+    DB backends registry
+
+    Backends are registered as 'module:Class' targets by db_type
+    and imported only when requested, so drivers aren't loaded
+    by config-only runs. Unknown types are looked up
+    in the entry points group of installed packages
+    """
+
+    def __init__(self, backends: dict, group: str):
+        self.backends = dict(backends)
+        self.group = group
+        self.loaded = {}
+        self.lock = threading.Lock()
+
+    def register(self, db_type: str, target: str) -> None:
+        """ Register backend target ('module:Class') for db_type """
+
+        with self.lock:
+            self.backends[db_type] = target
+            self.loaded.pop(db_type, None)
+
+    def load(self, db_type: str) -> type:
+        """ Get backend class for db_type, importing it if needed """
+
+        with self.lock:
+            if db_type in self.loaded:
+                return self.loaded[db_type]
+
+            target = self.backends.get(db_type)
+            if target:
+                backend = self.__import(target)
+            else:
+                backend = self.__entry_point(db_type)
+
+            if not backend:
+                raise ValueError(f'Unknown DB type: {db_type}')
+
+            self.loaded[db_type] = backend
+
+            return backend
+
+    def __import(self, target: str) -> type:
+        """ Import 'module:Class', relative modules are in this package """
+
+        module, _, name = target.partition(':')
+
+        return getattr(importlib.import_module(module, __package__), name)
+
+    def __entry_point(self, db_type: str) -> object:
+        """ Load backend from the entry points group, None if not found """
+
+        try:
+            from importlib.metadata import entry_points
+        except ImportError:
+            return None
+
+        try:
+            points = entry_points(group=self.group)
+        except TypeError:
+            # Python < 3.10
+            points = entry_points().get(self.group, [])
+
+        for point in points:
+            if point.name == db_type:
+                return point.load()
+
+        return None
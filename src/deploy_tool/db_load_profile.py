@@ -0,0 +1,100 @@
+import re
+from .sql_deferred import SqlDeferred
+from .sql_splitter import CopyBlock
+
+
+class LoadProfile:
+    """
+    Bulk load session profile
+
+    Session settings are applied for the load time and reset after it.
+    With unlogged tables are created UNLOGGED and set LOGGED
+    after the load, with analyze loaded tables are analyzed
+    """
+
+    # Named profiles
+    PROFILES: dict = {
+        'fast': {
+            'settings': {
+                'synchronous_commit': 'off',
+                'maintenance_work_mem': '1GB',
+            },
+            'unlogged': False,
+            'analyze': True,
+        },
+        'fast_unlogged': {
+            'settings': {
+                'synchronous_commit': 'off',
+                'maintenance_work_mem': '1GB',
+            },
+            'unlogged': True,
+            'analyze': True,
+        },
+    }
+
+    CREATE_TABLE = re.compile(
+        r'CREATE\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?'
+        r'(' + SqlDeferred.NAME + ')',
+        re.I
+    )
+    CREATE = re.compile(r'CREATE\s+', re.I)
+    COPY_TABLE = re.compile(r'COPY\s+(' + SqlDeferred.NAME + ')', re.I)
+
+    # Partitioned tables can't be unlogged
+    PARTITION = re.compile(r'\bPARTITION\s+(?:BY|OF)\b', re.I)
+
+    def __init__(self, name: str):
+        if name not in LoadProfile.PROFILES:
+            raise ValueError(f'Unknown load profile: {name}')
+
+        profile = LoadProfile.PROFILES[name]
+        self.name = name
+        self.settings = profile.get('settings', {})
+        self.unlogged = profile.get('unlogged', False)
+        self.analyze = profile.get('analyze', False)
+
+        # Loaded tables (ordered as dict keys) and unlogged tables
+        self.tables = {}
+        self.unlogged_tables = []
+
+    def statement(self, statement: str) -> str:
+        """ Record created table, making it unlogged if needed """
+
+        create = LoadProfile.CREATE_TABLE.match(statement)
+        if not create:
+            return statement
+
+        table = create.group(1)
+        self.__add_table(table)
+
+        if not self.unlogged or LoadProfile.PARTITION.search(statement):
+            return statement
+
+        self.unlogged_tables.append(table)
+
+        return LoadProfile.CREATE.sub('CREATE UNLOGGED ', statement, 1)
+
+    def copy(self, block: CopyBlock) -> None:
+        """ Record table of COPY block """
+
+        copy = LoadProfile.COPY_TABLE.match(block.query)
+        if copy:
+            self.__add_table(copy.group(1))
+
+    def set_query(self) -> str:
+        """ Session settings query """
+
+        return ';\n'.join(
+            f"SET {setting} = '{value}'"
+            for setting, value in self.settings.items()
+        )
+
+    def reset_query(self) -> str:
+        """ Session settings reset query """
+
+        return ';\n'.join(f'RESET {setting}' for setting in self.settings)
+
+    def __add_table(self, table: str) -> None:
+        """ Record loaded table """
+
+        self.tables[table] = True
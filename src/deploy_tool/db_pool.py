@@ -0,0 +1,107 @@
+import contextlib
+import threading
+import time
+from typing import Callable, Iterator
+
+
+class ConnectionPool:
+    """
+    DB connections pool
+
+    Keeps up to size idle connections for reuse,
+    idle connections are health checked before reuse
+    """
+
+    # Idle connections are checked after this time (in seconds)
+    CHECK_INTERVAL: float = 30.0
+
+    # Health check query
+    CHECK_QUERY: str = 'SELECT 1'
+
+    def __init__(self, connect: Callable, size: int):
+        self.connect = connect
+        self.size = size
+        self.idle = []
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def acquire(self) -> object:
+        """ Get idle connection or open new one """
+
+        while True:
+            with self.lock:
+                if not self.idle:
+                    break
+                connection, released_at = self.idle.pop()
+
+            if self.__is_healthy(connection, released_at):
+                return connection
+            self.__close(connection)
+
+        return self.connect()
+
+    def release(self, connection: object) -> None:
+        """ Return connection to the pool """
+
+        if not connection.closed and self.__reset(connection):
+            with self.lock:
+                if not self.closed and len(self.idle) < self.size:
+                    self.idle.append((connection, time.monotonic()))
+                    return
+
+        self.__close(connection)
+
+    @contextlib.contextmanager
+    def connection(self) -> Iterator:
+        """ Connection context """
+
+        connection = self.acquire()
+        try:
+            yield connection
+        finally:
+            self.release(connection)
+
+    def close(self) -> None:
+        """ Close all idle connections """
+
+        with self.lock:
+            self.closed = True
+            idle, self.idle = self.idle, []
+
+        for connection, _ in idle:
+            self.__close(connection)
+
+    def __is_healthy(self, connection: object, released_at: float) -> bool:
+        """ Check idle connection """
+
+        if connection.closed:
+            return False
+
+        if time.monotonic() - released_at < self.CHECK_INTERVAL:
+            return True
+
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(self.CHECK_QUERY)
+        except Exception:
+            return False
+
+        return True
+
+    def __reset(self, connection: object) -> bool:
+        """ Rollback unfinished transaction """
+
+        try:
+            connection.rollback()
+        except Exception:
+            return False
+
+        return True
+
+    def __close(self, connection: object) -> None:
+        """ Close connection, ignoring errors """
+
+        try:
+            connection.close()
+        except Exception:
+            pass
@@ -1,7 +1,24 @@
+import contextlib
+import hashlib
+import importlib
 import psycopg2
+import psycopg2.extras
 import os.path
-from .logger import Logger
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from psycopg2.extensions import AsIs
+from typing import Callable, Iterable, Iterator, Optional, Union
+from .db_pool import ConnectionPool
+from .db_load_profile import LoadProfile
+from .db_session import SessionState
+from .db_transaction import Transaction
+from .logger import Logger, Span
 from .macros import Macros
+from .manifest import Manifest
+from .sql_deferred import SqlDeferred
+from .sql_inserts import InsertBlock, SqlInserts
+from .sql_profiler import SqlProfiler
+from .sql_splitter import CopyBlock, CopyStream, SqlSplitter
 
 
 class DbPostgres:
@@ -12,84 +29,1024 @@ class DbPostgres:
     # Default queries
     DEFAULT_DB_CREATE: str = "CREATE DATABASE {{db_name}} WITH ENCODING 'UTF8'"
     DEFAULT_SQL_FILE: str = "{{mount_dir}}/deploy/db/dump.sql"
+    DB_EXISTS: str = 'SELECT 1 FROM pg_database WHERE datname = %s'
+
+    # Loaded dumps snapshots, template DBs named by dump hashes
+    SNAPSHOT_PREFIX: str = 'deploy_tool_snapshot_'
+    SNAPSHOT_CREATE: str = (
+        'CREATE DATABASE {{snapshot}} TEMPLATE {{db_name}} IS_TEMPLATE true'
+    )
+    SNAPSHOT_DB_CREATE: str = (
+        'CREATE DATABASE {{db_name}} TEMPLATE {{snapshot}}'
+    )
+
+    # Applied dump files ledger, schema qualified:
+    # dumps can clear search_path of the session (pg_dump does)
+    LEDGER_TABLE: str = 'public.deploy_tool_ledger'
+    LEDGER_CREATE: str = (
+        'CREATE TABLE IF NOT EXISTS {{ledger_table}} ('
+        'content_hash text NOT NULL, '
+        'options_hash text NOT NULL, '
+        'rendered_hash text NOT NULL, '
+        'path text NOT NULL, '
+        'applied_at timestamptz NOT NULL DEFAULT now(), '
+        'PRIMARY KEY (content_hash, options_hash, rendered_hash))'
+    )
+    LEDGER_SELECT_OPTIONS: str = (
+        'SELECT 1 FROM {{ledger_table}} '
+        'WHERE content_hash = %s AND options_hash = %s LIMIT 1'
+    )
+    LEDGER_SELECT: str = (
+        'SELECT 1 FROM {{ledger_table}} '
+        'WHERE content_hash = %s AND rendered_hash = %s LIMIT 1'
+    )
+    LEDGER_SELECT_CONTENT: str = (
+        'SELECT 1 FROM {{ledger_table}} WHERE content_hash = %s LIMIT 1'
+    )
+    LEDGER_INSERT: str = (
+        'INSERT INTO {{ledger_table}} '
+        '(content_hash, options_hash, rendered_hash, path) '
+        'VALUES (%s, %s, %s, %s) '
+        'ON CONFLICT (content_hash, options_hash, rendered_hash) '
+        'DO UPDATE SET path = EXCLUDED.path, applied_at = now()'
+    )
+    LEDGER_SAVEPOINT: str = 'deploy_tool_ledger_record'
+
+    # Dump files are read by chunks of this size (in chars)
+    CHUNK_SIZE: int = 1024 * 1024
+
+    # COPY data is sent to the server by blocks of this size
+    COPY_SIZE: int = 1024 * 1024
+
+    # Compressed dumps modules by file extension
+    COMPRESSIONS: dict = {
+        '.gz': 'gzip',
+        '.bz2': 'bz2',
+        '.xz': 'lzma',
+    }
+
+    # Compressed dumps modules by file magic bytes
+    COMPRESSIONS_MAGIC: dict = {
+        b'\x1f\x8b': 'gzip',
+        b'BZh': 'bz2',
+        b'\xfd7zXZ\x00': 'lzma',
+    }
+
+    # Server connections DB, 'db_maintenance_name' option
+    DEFAULT_MAINTENANCE_DB: str = 'postgres'
+
+    # Idle connections kept for reuse, 'db_pool_size' option
+    DEFAULT_POOL_SIZE: int = 4
 
     def __init__(self, options: dict, logger: Logger):
         self.options = options
         self.logger = logger
         self.connection = None
         self.cursor = None
+        self.pools = {}
+        self.connection_pool = None
+        self.transaction = None
+        self.load_profile = None
+        self.profiler = None
+        self.session = SessionState()
+        self.content_hashes = {}
+        self.rendered_hashes = {}
 
-    def init_db(self) -> psycopg2.extensions.cursor:
+    def init_db(self, dump: str = '') -> psycopg2.extensions.cursor:
         """  PostgreSQL DB initialisation
 
              If db exists, returns it
-             If not, create new db
+             If not, create new db,
+             from the dump snapshot if it's saved (see query_from_file)
+
+             DB existence is checked in pg_database over
+             a server connection (to the maintenance DB),
+             it's kept in the pool for reuse
+        """
+
+        self.__check_options()
+
+        self.__connect(False)
+        self.cursor.execute(DbPostgres.DB_EXISTS, (self.options['db_name'],))
+        if self.cursor.fetchone() is None:
+            snapshot = self.__find_snapshot(dump) if dump else None
+            if snapshot:
+                self.logger.add(f'Use DB snapshot {snapshot}')
+                self.__create(self.__snapshot_query(
+                    DbPostgres.SNAPSHOT_DB_CREATE,
+                    snapshot
+                ))
+            else:
+                self.__create()
+
+        self.__connect()
+
+        return self
+
+    def dsn(self, to_db: bool = True) -> str:
+        """ PostgreSQL connection string, to DB or to server
+
+            Server connections go to the maintenance DB
+            ('db_maintenance_name' option, postgres by default)
         """
 
         self.__check_options()
 
+        dsn = [
+            f'user={self.options["db_user"]}',
+            f'password={self.options["db_password"]}',
+            f'host={self.options["db_host"]}',
+            f'port={self.options["db_port"]}',
+        ]
+        if to_db:
+            dsn += [f'dbname={self.options["db_name"]}']
+        else:
+            maintenance_db = self.options.get('db_maintenance_name') \
+                or DbPostgres.DEFAULT_MAINTENANCE_DB
+            dsn += [f'dbname={maintenance_db}']
+
+        return ' '.join(dsn)
+
+    def close(self) -> None:
+        """ Close all PostgreSQL connections """
+
+        self.__release()
+
+        for pool in self.pools.values():
+            pool.close()
+        self.pools = {}
+
+    def query_from_file(
+        self,
+        path: str = '',
+        batch_size: int = 1,
+        workers: int = 1,
+        defer_indexes: bool = False,
+        force: bool = False,
+        snapshot: bool = False,
+        transaction: str = '',
+        commit_every: int = 0,
+        commit_bytes: int = 0,
+        profile: str = '',
+        insert_page_size: int = 0,
+        slowest: int = 0,
+        explain: bool = False,
+        ledger: bool = True
+    ) -> None:
+        """ Execute PostgreSQL DB query from file
+
+            Statements are read lazily and executed one by one,
+            or by batch_size statements in one query.
+            COPY ... FROM stdin data is streamed with COPY protocol
+            straight from the dump, with workers > 1 tables data
+            is spooled and loaded in parallel over separate connections.
+            With defer_indexes indexes and constraints are built
+            after all data is loaded, in parallel with workers > 1.
+            Applied files are recorded in the DB ledger and skipped
+            next time, unless force is set. Ledger errors are logged,
+            they don't fail the load, ledger = False turns it off.
+            With snapshot the loaded DB is saved as a template DB,
+            init_db(dump) creates new DBs from it instead of loading.
+            transaction mode ('file', 'commit', 'savepoint', see Transaction)
+            runs statements in transactions instead of autocommit,
+            'commit' mode commits every commit_every statements
+            or commit_bytes bytes. It needs workers = 1.
+            In 'savepoint' mode the rest of the dump is committed
+            after failed batches, then RuntimeError is raised.
+            profile is a bulk load session profile (see LoadProfile),
+            time of its phases is logged, unlogged tables are set logged
+            after failed loads too.
+            With insert_page_size consecutive single-row INSERTs
+            into the same table are sent as multi-row INSERTs
+            of up to insert_page_size rows.
+            With slowest = N the N slowest statements (or batches)
+            are reported with their offsets in the rendered dump,
+            explain adds EXPLAIN plans of the slowest single DML statements
+        """
+
+        if transaction and workers > 1:
+            raise ValueError('Transaction modes need workers = 1')
+
+        load_profile = LoadProfile(profile) if profile else None
+        profiler = SqlProfiler(slowest) if slowest else None
+
+        path = self.__dump_path(path)
+        if not path:
+            return
+
+        with self.logger.span('query_from_file', path=path) as span:
+            if ledger and not force and self.__is_applied(path):
+                self.logger.add(f'Dump file {path} is already applied')
+                span.set('skipped', True)
+                return
+
+            self.logger.add(f'Execute PostgreSQL query from {path}')
+
+            if transaction:
+                self.transaction = Transaction(
+                    self.connection,
+                    transaction,
+                    self.logger,
+                    commit_every,
+                    commit_bytes
+                )
+
+            phases = {}
+            try:
+                if load_profile:
+                    with self.__phase('settings', phases):
+                        self.cursor.execute(load_profile.set_query())
+                    self.load_profile = load_profile
+                self.profiler = profiler
+
+                with self.__phase('load', phases), \
+                        self.transaction or contextlib.ExitStack():
+                    rendered = hashlib.sha256()
+                    with self.open_dump(path) as (f, raw):
+                        chunks = iter(lambda: f.read(self.CHUNK_SIZE), '')
+                        chunks = Macros.replace_stream(chunks, self.options)
+                        chunks = self.__hash_chunks(chunks, rendered)
+                        # Serial loads read COPY data from the dump stream
+                        splitter = SqlSplitter(stream_copy=workers == 1)
+                        statements = splitter.split(chunks)
+                        if profiler:
+                            statements = profiler.track(statements, splitter)
+                        if insert_page_size:
+                            statements = SqlInserts(
+                                insert_page_size
+                            ).coalesce(statements)
+                        deferred = SqlDeferred() if defer_indexes else None
+                        self.__execute(
+                            statements,
+                            batch_size,
+                            workers,
+                            deferred,
+                            span
+                        )
+
+                        span.set('bytes_read', raw.tell())
+
+                    if ledger or snapshot:
+                        hashes = (
+                            self.__content_hash(path),
+                            self.__save_rendered_hash(
+                                path,
+                                rendered.hexdigest()
+                            )
+                        )
+                    failed = self.transaction.failed if transaction else 0
+                    if failed:
+                        # Partially applied file isn't recorded
+                        span.set('failed_batches', failed)
+                    elif ledger:
+                        self.__set_applied(hashes, path)
+
+                if load_profile and load_profile.unlogged_tables:
+                    with self.__phase('set_logged', phases):
+                        self.__set_logged(load_profile.unlogged_tables)
+
+                if load_profile and load_profile.analyze:
+                    with self.__phase('analyze', phases):
+                        self.__analyze(load_profile.tables)
+            finally:
+                self.transaction = None
+                self.load_profile = None
+                self.profiler = None
+                if load_profile and load_profile.unlogged_tables \
+                        and 'set_logged' not in phases:
+                    # Tables of a failed load aren't left unlogged
+                    with self.__phase('set_logged', phases):
+                        self.__set_logged(load_profile.unlogged_tables)
+                if load_profile:
+                    with self.__phase('reset', phases):
+                        self.cursor.execute(load_profile.reset_query())
+
+            if load_profile:
+                self.logger.add(
+                    f'Load profile {profile} phases: ' + ', '.join(
+                        f'{phase} {duration:.3f} s'
+                        for phase, duration in phases.items()
+                    )
+                )
+
+            if profiler:
+                self.__report_slowest(profiler, path, explain, span)
+
+            if failed:
+                raise RuntimeError(
+                    f'Dump file {path} is applied with {failed} failed batches'
+                )
+
+        if snapshot:
+            self.__save_snapshot(hashes)
+
+    @contextlib.contextmanager
+    def __phase(self, name: str, phases: dict) -> Iterator:
+        """ Timed load phase, its duration is saved in phases """
+
+        start = time.perf_counter()
         try:
-            self.__connect()
-        except psycopg2.OperationalError:
-            # Init new db
-            self.logger.add(f'Can\'t connect to DB: {self.options["db_name"]}')
+            with self.logger.span('load_phase', phase=name):
+                yield
+        finally:
+            phases[name] = time.perf_counter() - start
 
-            # Create db
-            self.__create()
+    def __report_slowest(
+        self,
+        profiler: SqlProfiler,
+        path: str,
+        explain: bool,
+        span: Span
+    ) -> None:
+        """ Report the slowest statements, with their plans if explain """
 
-            # Connect to a new db
-            self.__connect()
+        if explain:
+            profiler.capture_plans(self.cursor)
 
-        return self
+        report = profiler.report()
+        span.set('slowest', report)
+
+        lines = [f'Slowest statements of {path}:']
+        for entry in report:
+            count = entry['statements']
+            lines.append(
+                f'  {entry["duration"]:.3f} s'
+                + (f', {count} statements' if count > 1 else '')
+                + f' at offset {entry["offset"]}: {entry["excerpt"]}'
+            )
+            if entry['plan']:
+                lines += ['    ' + line for line in entry['plan'].split('\n')]
+
+        self.logger.add('\n'.join(lines))
+
+    def __set_logged(self, tables: list) -> None:
+        """ Set unlogged tables logged
+
+            Tables referencing unlogged tables can't be set logged,
+            so failed tables are retried while others succeed
+        """
+
+        while tables:
+            failed = []
+            for table in tables:
+                try:
+                    self.cursor.execute(f'ALTER TABLE {table} SET LOGGED')
+                except psycopg2.Error as e:
+                    failed.append((table, e))
+
+            if len(failed) == len(tables):
+                for table, e in failed:
+                    self.logger.add(
+                        f'Can\'t set table {table} logged: ' + str(e).strip()
+                    )
+                return
+
+            tables = [table for table, _ in failed]
+
+    def __analyze(self, tables: list) -> None:
+        """ Analyze loaded tables
+
+            Tables can be dropped by the dump after the load
+            (e.g. staging tables), errors are logged
+        """
+
+        for table in tables:
+            try:
+                self.cursor.execute(f'ANALYZE {table}')
+            except psycopg2.Error as e:
+                self.logger.add(
+                    f'Can\'t analyze table {table}: ' + str(e).strip()
+                )
+
+    def find_dump(self, path: str) -> Optional[str]:
+        """ Dump file path, or its compressed version if only it exists """
+
+        for candidate in [path] + [path + ext for ext in self.COMPRESSIONS]:
+            if os.path.isfile(candidate):
+                return candidate
+
+        return None
+
+    @contextlib.contextmanager
+    def open_dump(self, path: str) -> Iterator[tuple]:
+        """ Open dump file as text stream, decompressing it if needed
+
+            Compression is detected by extension or magic bytes,
+            yields (text file, raw file) to track read bytes
+        """
+
+        module = self.COMPRESSIONS.get(os.path.splitext(path)[1])
+        if not module:
+            with open(path, 'rb') as f:
+                magic = f.read(max(map(len, self.COMPRESSIONS_MAGIC)))
+            for prefix, name in self.COMPRESSIONS_MAGIC.items():
+                if magic[:len(prefix)] == prefix:
+                    module = name
+
+        if not module:
+            with open(path) as f:
+                yield f, f.buffer
+            return
 
-    def query_from_file(self, path: str = '') -> None:
-        """ Execute PostgreSQL DB query from file """
+        with open(path, 'rb') as raw:
+            decompress = importlib.import_module(module)
+            with decompress.open(raw, 'rt') as f:
+                yield f, raw
+
+    def __dump_path(self, path: str) -> Optional[str]:
+        """ Existing dump file path, None if it isn't exists """
 
         if not path:
             path = DbPostgres.DEFAULT_SQL_FILE
 
         path = Macros.replace(path, self.options)
 
-        if not os.path.isfile(path):
+        dump = self.find_dump(path)
+        if not dump:
             self.logger.add(f'Dump file {path} isn\'t exists')
+
+        return dump
+
+    def __find_snapshot(self, dump: str) -> Optional[str]:
+        """ Saved snapshot of the dump file, over server connection """
+
+        path = self.__dump_path(dump)
+        if not path:
+            return None
+
+        snapshot = self.__snapshot_name(self.__hash_file(path))
+        self.cursor.execute(DbPostgres.DB_EXISTS, (snapshot,))
+
+        return snapshot if self.cursor.fetchone() else None
+
+    def __save_snapshot(self, hashes: tuple) -> None:
+        """ Save DB as a template DB of the dump file
+
+            The dump is already loaded, so failed snapshot is only logged,
+            the DB connection is restored anyway
+        """
+
+        snapshot = self.__snapshot_name(hashes)
+
+        with self.logger.span('snapshot', snapshot=snapshot) as span:
+            # Template DB can't have other connections
+            self.__release()
+            if True in self.pools:
+                self.pools.pop(True).close()
+
+            try:
+                self.__connect(False)
+                self.cursor.execute(DbPostgres.DB_EXISTS, (snapshot,))
+                if self.cursor.fetchone() is None:
+                    self.logger.add(f'Save DB snapshot {snapshot}')
+                    query = self.__snapshot_query(
+                        DbPostgres.SNAPSHOT_CREATE,
+                        snapshot
+                    )
+                    self.cursor.execute(Macros.replace(query, self.options))
+            except psycopg2.Error as e:
+                self.logger.add(
+                    f'Can\'t save DB snapshot {snapshot}: ' + str(e).strip()
+                )
+                span.set('failed', True)
+            finally:
+                self.__connect()
+
+    def __snapshot_name(self, hashes: tuple) -> str:
+        """ Snapshot DB name by dump content and rendered hashes """
+
+        key = hashlib.sha256(''.join(hashes).encode('utf-8')).hexdigest()
+
+        return DbPostgres.SNAPSHOT_PREFIX + key[:32]
+
+    def __snapshot_query(self, query: str, snapshot: str) -> str:
+        """ Query with snapshot DB name """
+
+        return Macros.replace(query, {'snapshot': snapshot})
+
+    def __hash_file(self, path: str) -> tuple:
+        """ Dump file content and rendered content hashes """
+
+        return self.__content_hash(path), self.__rendered_hash(path)
+
+    def __content_hash(self, path: str) -> str:
+        """ Dump file hash, recalculated only if file stat changed """
+
+        stat = os.stat(path)
+        stat = [stat.st_size, stat.st_mtime_ns]
+
+        cached = self.content_hashes.get(path)
+        if cached and cached[0] == stat:
+            return cached[1]
+
+        content_hash = Manifest.hash_file(path)
+        self.content_hashes[path] = (stat, content_hash)
+
+        return content_hash
+
+    def __rendered_hash(
+        self,
+        path: str,
+        cached_only: bool = False
+    ) -> Optional[str]:
+        """ Rendered dump hash with current options
+
+            Rendered hashes are saved by executions
+            by content and options hashes, if it isn't saved
+            the dump is rendered, or None is returned if cached_only
+        """
+
+        key = (self.__content_hash(path), Manifest.hash_options(self.options))
+        rendered_hash = self.rendered_hashes.get(key)
+        if rendered_hash or cached_only:
+            return rendered_hash
+
+        digest = hashlib.sha256()
+        with self.open_dump(path) as (f, _):
+            chunks = iter(lambda: f.read(self.CHUNK_SIZE), '')
+            for chunk in Macros.replace_stream(chunks, self.options):
+                digest.update(chunk.encode('utf-8'))
+
+        return self.__save_rendered_hash(path, digest.hexdigest())
+
+    def __save_rendered_hash(self, path: str, rendered_hash: str) -> str:
+        """ Save rendered dump hash with current options """
+
+        key = (self.__content_hash(path), Manifest.hash_options(self.options))
+        self.rendered_hashes[key] = rendered_hash
+
+        return rendered_hash
+
+    def __hash_chunks(self, chunks: Iterable[str], digest) -> Iterator[str]:
+        """ Pass chunks through, updating digest """
+
+        for chunk in chunks:
+            digest.update(chunk.encode('utf-8'))
+            yield chunk
+
+    def __is_applied(self, path: str) -> bool:
+        """ Is dump file recorded in the ledger
+
+            Files applied with the same options are found by content
+            and options hashes. Otherwise the dump is rendered for
+            the check only if its content is recorded (with other options)
+            and its rendered hash isn't known.
+            Ledger errors are logged, the file is taken for not applied
+        """
+
+        try:
+            return self.__find_applied(path)
+        except psycopg2.Error as e:
+            self.logger.add(
+                f'Can\'t check dump file {path} in the ledger: '
+                + str(e).strip()
+            )
+            return False
+
+    def __find_applied(self, path: str) -> bool:
+        """ Look dump file up in the ledger """
+
+        self.cursor.execute(self.__ledger_query(DbPostgres.LEDGER_CREATE))
+
+        content_hash = self.__content_hash(path)
+        self.cursor.execute(
+            self.__ledger_query(DbPostgres.LEDGER_SELECT_OPTIONS),
+            (content_hash, Manifest.hash_options(self.options))
+        )
+        if self.cursor.fetchone() is not None:
+            return True
+
+        rendered_hash = self.__rendered_hash(path, True)
+        if not rendered_hash:
+            self.cursor.execute(
+                self.__ledger_query(DbPostgres.LEDGER_SELECT_CONTENT),
+                (content_hash,)
+            )
+            if self.cursor.fetchone() is None:
+                return False
+            rendered_hash = self.__rendered_hash(path)
+
+        self.cursor.execute(
+            self.__ledger_query(DbPostgres.LEDGER_SELECT),
+            (content_hash, rendered_hash)
+        )
+        if self.cursor.fetchone() is None:
+            return False
+
+        # Same rendered dump, recorded for current options not to render it
+        self.__set_applied((content_hash, rendered_hash), path)
+
+        return True
+
+    def __set_applied(self, hashes: tuple, path: str) -> None:
+        """ Record dump file in the ledger
+
+            The ledger is created if it's missing (forced loads
+            don't check it). Errors are logged, in transactions
+            they're rolled back to a savepoint, not to fail the load
+        """
+
+        if self.transaction:
+            self.cursor.execute(f'SAVEPOINT {DbPostgres.LEDGER_SAVEPOINT}')
+
+        try:
+            self.cursor.execute(self.__ledger_query(DbPostgres.LEDGER_CREATE))
+            self.cursor.execute(
+                self.__ledger_query(DbPostgres.LEDGER_INSERT),
+                (
+                    hashes[0],
+                    Manifest.hash_options(self.options),
+                    hashes[1],
+                    path
+                )
+            )
+        except psycopg2.Error as e:
+            if self.transaction:
+                self.cursor.execute(
+                    f'ROLLBACK TO SAVEPOINT {DbPostgres.LEDGER_SAVEPOINT}'
+                )
+            self.logger.add(
+                f'Can\'t record dump file {path} in the ledger: '
+                + str(e).strip()
+            )
             return
 
-        with open(path) as f:
-            query = f.read()
+        if self.transaction:
+            self.cursor.execute(
+                f'RELEASE SAVEPOINT {DbPostgres.LEDGER_SAVEPOINT}'
+            )
+
+    def __ledger_query(self, query: str) -> str:
+        """ Ledger query with table name """
+
+        return Macros.replace(query, {'ledger_table': self.LEDGER_TABLE})
+
+    def __execute(
+        self,
+        statements: Iterable,
+        batch_size: int,
+        workers: int,
+        deferred: Optional[SqlDeferred],
+        span: Span
+    ) -> None:
+        """ Execute statements by batches """
+
+        executor = None
+        if workers > 1:
+            # Workers pool is created before threads start
+            self.__pool()
+            executor = ThreadPoolExecutor(workers)
+
+        loads = []
+        batch = []
+        batch_offset = None
+        offset = None
+
+        try:
+            for statement in statements:
+                if self.profiler:
+                    offset = self.profiler.offset(statement)
+
+                if self.load_profile:
+                    statement = self.__profile_statement(statement)
+
+                if isinstance(statement, CopyBlock):
+                    self.__execute_batch(batch, span, batch_offset)
+                    batch = []
+                    copy = self.__timed(self.__copy, statement, offset)
+                    if not executor:
+                        if isinstance(statement.data, CopyStream):
+                            # Streamed data size is known after the load
+                            size = statement.data.tell
+                        else:
+                            size = statement.data.seek(0, os.SEEK_END)
+                            statement.data.seek(0)
+                        self.__run(
+                            copy,
+                            self.cursor,
+                            statement,
+                            span,
+                            size=size
+                        )
+                        continue
+
+                    # Limit loads in progress, their data is kept spooled
+                    loads = self.__wait(loads, workers * 2)
+                    loads.append(executor.submit(
+                        self.__on_worker,
+                        copy,
+                        self.session.queries(),
+                        statement,
+                        span
+                    ))
+                    continue
+
+                if isinstance(statement, InsertBlock):
+                    self.__execute_batch(batch, span, batch_offset)
+                    batch = []
+                    loads = self.__wait(loads, 0)
+                    self.__run(
+                        self.__timed(
+                            self.__insert,
+                            statement,
+                            offset,
+                            len(statement.rows)
+                        ),
+                        statement,
+                        span,
+                        statements=len(statement.rows),
+                        size=sum(map(len, statement.rows))
+                    )
+                    continue
+
+                if deferred is not None and deferred.add(statement):
+                    if self.profiler:
+                        self.profiler.defer(statement, offset)
+                    continue
+
+                # Statements after data wait for all loads
+                loads = self.__wait(loads, 0)
+
+                # Session settings are replayed on worker connections
+                self.session.add(statement)
+
+                if not batch:
+                    batch_offset = offset
+                batch.append(statement)
+                if len(batch) >= batch_size:
+                    self.__execute_batch(batch, span, batch_offset)
+                    batch = []
+
+            self.__execute_batch(batch, span, batch_offset)
+            loads = self.__wait(loads, 0)
+
+            if deferred:
+                self.__execute_deferred(deferred, executor, span)
+        finally:
+            if executor:
+                for load in loads:
+                    load.cancel()
+                executor.shutdown()
+
+    def __execute_batch(
+        self,
+        batch: list,
+        span: Span,
+        offset: Optional[int] = None
+    ) -> None:
+        """ Execute statements in one query """
+
+        if batch:
+            query = ';\n'.join(batch)
+            self.__run(
+                self.__timed(self.cursor.execute, query, offset, len(batch)),
+                query,
+                statements=len(batch),
+                size=len(query)
+            )
+            span.add('statements', len(batch))
+
+    def __run(
+        self,
+        method: Callable,
+        *args,
+        statements: int = 1,
+        size: Union[int, Callable[[], int]] = 0
+    ) -> None:
+        """ Call method(*args) in the current transaction, if any """
+
+        if self.transaction:
+            self.transaction.run(
+                method,
+                *args,
+                statements=statements,
+                size=size
+            )
+        else:
+            method(*args)
+
+    def __timed(
+        self,
+        method: Callable,
+        statement: object,
+        offset: Optional[int],
+        statements: int = 1
+    ) -> Callable:
+        """ method timed by the statements profiler, if it's enabled """
 
-        query = Macros.replace(query, self.options)
-        self.logger.add(f'Execute PostgreSQL query from {path}')
-        self.cursor.execute(query)
+        if not self.profiler:
+            return method
+
+        profiler = self.profiler
+
+        def timed(*args) -> None:
+            start = time.perf_counter()
+            method(*args)
+            profiler.add(
+                time.perf_counter() - start,
+                statement,
+                offset,
+                statements
+            )
+
+        return timed
+
+    def __wait(self, loads: list, limit: int) -> list:
+        """ Wait until no more than limit loads are in progress """
+
+        while len(loads) > limit:
+            done, pending = wait(loads, return_when=FIRST_COMPLETED)
+            for load in done:
+                load.result()
+            loads = [load for load in loads if load in pending]
+
+        return loads
+
+    def __copy(
+        self,
+        cursor: psycopg2.extensions.cursor,
+        block: CopyBlock,
+        span: Span
+    ) -> None:
+        """ Load COPY block data """
+
+        with block.data:
+            cursor.copy_expert(block.query, block.data, self.COPY_SIZE)
+
+        span.add('statements')
+        if isinstance(cursor.rowcount, int) and cursor.rowcount > 0:
+            span.add('rows', cursor.rowcount)
+
+    def __insert(self, block: InsertBlock, span: Span) -> None:
+        """ Execute coalesced INSERTs as one multi-row INSERT """
+
+        psycopg2.extras.execute_values(
+            self.cursor,
+            block.query.replace('%', '%%') + ' %s',
+            [(AsIs(row),) for row in block.rows],
+            template='%s',
+            page_size=len(block.rows)
+        )
+
+        span.add('statements', len(block.rows))
+        span.add('rows', len(block.rows))
+
+    def __execute_deferred(
+        self,
+        deferred: SqlDeferred,
+        executor: Optional[ThreadPoolExecutor],
+        span: Span
+    ) -> None:
+        """ Execute deferred statements stage by stage """
+
+        self.logger.add(
+            f'Build {len(deferred)} deferred indexes and constraints'
+        )
+
+        for stage in deferred.stages():
+            if not executor:
+                for statement in stage:
+                    self.__run(
+                        self.__timed_deferred(statement),
+                        self.cursor,
+                        statement,
+                        span,
+                        size=len(statement)
+                    )
+                continue
+
+            builds = [
+                executor.submit(
+                    self.__on_worker,
+                    self.__timed_deferred(statement),
+                    self.session.queries(),
+                    statement,
+                    span
+                )
+                for statement in stage
+            ]
+            self.__wait(builds, 0)
+
+    def __timed_deferred(self, statement: str) -> Callable:
+        """ Deferred statement execution, timed by the profiler """
+
+        offset = self.profiler.deferred_offset(statement) \
+            if self.profiler else None
+
+        return self.__timed(self.__execute_on, statement, offset)
+
+    def __execute_on(
+        self,
+        cursor: psycopg2.extensions.cursor,
+        statement: str,
+        span: Span
+    ) -> None:
+        """ Execute statement with cursor """
+
+        cursor.execute(statement)
+        span.add('statements')
+
+    def __on_worker(
+        self,
+        method: Callable,
+        session: list,
+        *args
+    ) -> None:
+        """ Call method(cursor, *args) over a pooled worker connection
+
+            Session settings of the main connection (session queries)
+            and the load profile are applied for the call time
+        """
+
+        queries = list(session)
+        if self.load_profile:
+            queries.insert(0, self.load_profile.set_query())
+
+        with self.__pool().connection() as connection:
+            with connection.cursor() as cursor:
+                if not queries:
+                    method(cursor, *args)
+                    return
+
+                cursor.execute(';\n'.join(queries))
+                try:
+                    method(cursor, *args)
+                finally:
+                    cursor.execute(
+                        SessionState.RESET if session
+                        else self.load_profile.reset_query()
+                    )
+
+    def __profile_statement(self, statement: object) -> object:
+        """ Pass statement through the load profile """
+
+        if isinstance(statement, CopyBlock):
+            self.load_profile.copy(statement)
+            return statement
+
+        if isinstance(statement, InsertBlock):
+            return statement
+
+        return self.load_profile.statement(statement)
 
     def __create(self, query: str = '') -> None:
-        """ Create PostgreSQL DB """
+        """ Create PostgreSQL DB over the current server connection """
 
         if not query:
             query = DbPostgres.DEFAULT_DB_CREATE
 
         self.logger.add(f'Creating new Postgres DB: {self.options["db_name"]}')
 
-        self.__connect(False)
-        query = Macros.replace(query, self.options)
+        with self.logger.span('create', db_name=self.options['db_name']):
+            query = Macros.replace(query, self.options)
 
-        self.cursor.execute(query)
+            self.cursor.execute(query)
 
     def __connect(self, to_db: bool = True) -> None:
         """ Connect to PostgreSQL DB """
 
-        dsn = [
-            f'user={self.options["db_user"]}',
-            f'password={self.options["db_password"]}',
-            f'host={self.options["db_host"]}',
-            f'port={self.options["db_port"]}',
-        ]
-        if to_db:
-            dsn += [f'dbname={self.options["db_name"]}']
+        self.__release()
+
+        with self.logger.span('connect', to_db=to_db):
+            pool = self.__pool(to_db)
+            self.connection = pool.acquire()
+            self.connection_pool = pool
+            self.cursor = self.connection.cursor()
+            self.session = SessionState()
+
+    def __release(self) -> None:
+        """ Return current connection to its pool """
+
+        if self.connection_pool:
+            self.connection_pool.release(self.connection)
+
+        self.connection = None
+        self.connection_pool = None
+        self.cursor = None
+
+    def __pool(self, to_db: bool = True) -> ConnectionPool:
+        """ Connections pool, to DB or to server """
+
+        if to_db not in self.pools:
+            size = self.options.get('db_pool_size')
+            size = int(size) if size else DbPostgres.DEFAULT_POOL_SIZE
+            self.pools[to_db] = ConnectionPool(
+                lambda: self.__new_connection(to_db),
+                size
+            )
+
+        return self.pools[to_db]
+
+    def __new_connection(
+        self,
+        to_db: bool = True
+    ) -> psycopg2.extensions.connection:
+        """ Open new PostgreSQL connection """
 
-        self.connection = psycopg2.connect(' '.join(dsn))
-        self.connection.autocommit = True
+        connection = psycopg2.connect(self.dsn(to_db))
+        connection.autocommit = True
 
-        self.cursor = self.connection.cursor()
+        return connection
 
     def __check_options(self) -> None:
         """ Check options """
@@ -0,0 +1,213 @@
+import asyncio
+import psycopg2
+import psycopg2.extensions
+from typing import Iterator, Optional
+from .db_postgres import DbPostgres
+from .db_session import SessionState
+from .logger import Logger
+from .macros import Macros
+from .sql_splitter import CopyBlock, SqlSplitter
+
+
+async def wait(connection: psycopg2.extensions.connection) -> None:
+    """ Wait for psycopg2 async connection without blocking the loop """
+
+    loop = asyncio.get_event_loop()
+
+    while True:
+        state = connection.poll()
+        if state == psycopg2.extensions.POLL_OK:
+            return
+
+        future = loop.create_future()
+        fd = connection.fileno()
+        if state == psycopg2.extensions.POLL_READ:
+            loop.add_reader(fd, future.set_result, None)
+            remove = loop.remove_reader
+        elif state == psycopg2.extensions.POLL_WRITE:
+            loop.add_writer(fd, future.set_result, None)
+            remove = loop.remove_writer
+        else:
+            raise psycopg2.OperationalError(f'Bad poll state: {state}')
+
+        try:
+            await future
+        finally:
+            remove(fd)
+
+
+class AsyncDbPostgres:
+    """
+    PostgreSQL DB over psycopg2 async connections
+    """
+
+    def __init__(self, options: dict, logger: Logger):
+        self.options = options
+        self.logger = logger
+        self.db = DbPostgres(options, logger)
+        self.connection = None
+        self.copy_connection = None
+        self.session = SessionState()
+
+    async def init_db(self) -> 'AsyncDbPostgres':
+        """  PostgreSQL DB initialisation
+
+             If db exists, returns it
+             If not, create new db
+        """
+
+        connection = await self.__connect(False)
+        try:
+            cursor = connection.cursor()
+            cursor.execute(DbPostgres.DB_EXISTS, (self.options['db_name'],))
+            await wait(connection)
+            if cursor.fetchone() is None:
+                await self.__create(connection)
+        finally:
+            connection.close()
+
+        self.connection = await self.__connect()
+        self.session = SessionState()
+
+        return self
+
+    async def query_from_file(
+        self,
+        path: str = '',
+        batch_size: int = 1
+    ) -> None:
+        """ Execute PostgreSQL DB query from file
+
+            Statements are executed over the async connection,
+            file reading and COPY data loading run in the executor
+        """
+
+        if not path:
+            path = DbPostgres.DEFAULT_SQL_FILE
+
+        path = Macros.replace(path, self.options)
+
+        dump = self.db.find_dump(path)
+        if not dump:
+            self.logger.add(f'Dump file {path} isn\'t exists')
+            return
+        path = dump
+
+        self.logger.add(f'Execute PostgreSQL query from {path}')
+
+        loop = asyncio.get_event_loop()
+        with self.db.open_dump(path) as (f, _):
+            chunks = iter(lambda: f.read(self.db.CHUNK_SIZE), '')
+            chunks = Macros.replace_stream(chunks, self.options)
+            # COPY data is read from the dump stream
+            statements = SqlSplitter(stream_copy=True).split(chunks)
+
+            while True:
+                batch = await loop.run_in_executor(
+                    None,
+                    self.__read_batch,
+                    statements,
+                    batch_size
+                )
+                if not batch:
+                    break
+
+                # Session settings are replayed on the COPY connection
+                for statement in batch:
+                    if isinstance(statement, str):
+                        self.session.add(statement)
+
+                if isinstance(batch[-1], CopyBlock):
+                    block = batch.pop()
+                    await self.__execute(';\n'.join(batch))
+                    await loop.run_in_executor(
+                        None,
+                        self.__copy,
+                        block,
+                        self.session.queries()
+                    )
+                    continue
+
+                await self.__execute(';\n'.join(batch))
+
+    async def close(self) -> None:
+        """ Close all PostgreSQL connections """
+
+        for connection in [self.connection, self.copy_connection]:
+            if connection:
+                connection.close()
+
+        self.connection = None
+        self.copy_connection = None
+
+    def __read_batch(self, statements: Iterator, batch_size: int) -> list:
+        """ Read up to batch_size statements, a COPY block ends a batch """
+
+        batch = []
+        for statement in statements:
+            batch.append(statement)
+            if isinstance(statement, CopyBlock) or len(batch) >= batch_size:
+                break
+
+        return batch
+
+    def __copy(self, block: CopyBlock, session: list) -> None:
+        """ Load COPY block data, async connections don't support COPY
+
+            Session settings of the main connection (session queries)
+            are applied for the load time
+        """
+
+        if not self.copy_connection:
+            self.copy_connection = psycopg2.connect(self.db.dsn())
+            self.copy_connection.autocommit = True
+
+        with block.data, self.copy_connection.cursor() as cursor:
+            if not session:
+                cursor.copy_expert(block.query, block.data, self.db.COPY_SIZE)
+                return
+
+            cursor.execute(';\n'.join(session))
+            try:
+                cursor.copy_expert(block.query, block.data, self.db.COPY_SIZE)
+            finally:
+                cursor.execute(SessionState.RESET)
+
+    async def __create(
+        self,
+        connection: psycopg2.extensions.connection,
+        query: str = ''
+    ) -> None:
+        """ Create PostgreSQL DB over server connection """
+
+        if not query:
+            query = DbPostgres.DEFAULT_DB_CREATE
+
+        self.logger.add(f'Creating new Postgres DB: {self.options["db_name"]}')
+
+        await self.__execute(Macros.replace(query, self.options), connection)
+
+    async def __execute(
+        self,
+        query: str,
+        connection: Optional[psycopg2.extensions.connection] = None
+    ) -> None:
+        """ Execute query over async connection """
+
+        if not query:
+            return
+
+        cursor = (connection or self.connection).cursor()
+        cursor.execute(query)
+        await wait(cursor.connection)
+
+    async def __connect(
+        self,
+        to_db: bool = True
+    ) -> psycopg2.extensions.connection:
+        """ Open async PostgreSQL connection """
+
+        connection = psycopg2.connect(self.db.dsn(to_db), async_=True)
+        await wait(connection)
+
+        return connection
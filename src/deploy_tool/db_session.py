@@ -0,0 +1,73 @@
+import re
+
+
+class SessionState:
+    """
+    Session settings set by dump statements
+
+    Session-level SET and set_config(..., false) statements
+    are recorded in order to be replayed on other connections
+    (parallel workers), the last statement of each setting is kept
+    """
+
+    SET = re.compile(
+        r'SET\s+(?:SESSION\s+(?!AUTHORIZATION\b))?'
+        r'(?!LOCAL\b|CONSTRAINTS\b|TRANSACTION\b)'
+        r'(SESSION\s+AUTHORIZATION|ROLE|TIME\s+ZONE|[\w.]+)\b',
+        re.I
+    )
+    SET_CONFIG = re.compile(
+        r"SELECT\s+(?:pg_catalog\.)?set_config\s*\(\s*'([^']+)'"
+        r"\s*,\s*(?:'(?:[^']|'')*'|NULL)\s*,\s*false\s*\)$",
+        re.I
+    )
+    RESET_SETTING = re.compile(
+        r'RESET\s+(SESSION\s+AUTHORIZATION|ROLE|TIME\s+ZONE|[\w.]+)\b',
+        re.I
+    )
+
+    # Settings kept by RESET ALL
+    ROLES: tuple = ('role', 'session authorization')
+
+    # Replayed settings reset, pooled connections are reused
+    RESET: str = 'DISCARD ALL'
+
+    def __init__(self):
+        self.settings = {}
+
+    def add(self, statement: str) -> bool:
+        """ Record statement if it sets or resets a session setting """
+
+        reset = SessionState.RESET_SETTING.match(statement)
+        if reset:
+            name = SessionState.__name(reset.group(1))
+            if name == 'all':
+                # RESET ALL keeps the role and session authorization
+                self.settings = {
+                    key: value for key, value in self.settings.items()
+                    if key in SessionState.ROLES
+                }
+            else:
+                self.settings.pop(name, None)
+            return True
+
+        match = SessionState.SET.match(statement) \
+            or SessionState.SET_CONFIG.match(statement)
+        if not match:
+            return False
+
+        name = SessionState.__name(match.group(1))
+        self.settings.pop(name, None)
+        self.settings[name] = statement
+
+        return True
+
+    def queries(self) -> list:
+        """ Statements restoring the recorded settings """
+
+        return list(self.settings.values())
+
+    def __name(name: str) -> str:
+        """ Setting key by its name """
+
+        return ' '.join(name.lower().split())
@@ -0,0 +1,119 @@
+import psycopg2
+from typing import Callable, Union
+from .logger import Logger
+
+
+class Transaction:
+    """
+    Dump execution transaction
+
+    Modes:
+    - file: all statements in one transaction
+    - commit: commit every commit_every statements or commit_bytes bytes
+    - savepoint: one transaction, a failed batch is rolled back
+      to its savepoint and execution goes on
+
+    Used as a context manager, the connection is switched
+    from autocommit for its time, on errors the rest is rolled back
+    """
+
+    FILE: str = 'file'
+    COMMIT: str = 'commit'
+    SAVEPOINT: str = 'savepoint'
+
+    # Statements per commit in commit mode, if no limits are set
+    DEFAULT_COMMIT_EVERY: int = 1000
+
+    SAVEPOINT_NAME: str = 'deploy_tool_batch'
+
+    def __init__(
+        self,
+        connection: psycopg2.extensions.connection,
+        mode: str,
+        logger: Logger,
+        commit_every: int = 0,
+        commit_bytes: int = 0
+    ):
+        if mode not in (Transaction.FILE, Transaction.COMMIT,
+                        Transaction.SAVEPOINT):
+            raise ValueError(f'Unknown transaction mode: {mode}')
+
+        if mode == Transaction.COMMIT and not commit_every \
+                and not commit_bytes:
+            commit_every = Transaction.DEFAULT_COMMIT_EVERY
+
+        self.connection = connection
+        self.mode = mode
+        self.logger = logger
+        self.commit_every = commit_every
+        self.commit_bytes = commit_bytes
+        self.statements = 0
+        self.size = 0
+        self.commits = 0
+        self.failed = 0
+
+    def __enter__(self) -> 'Transaction':
+        self.connection.autocommit = False
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        try:
+            if exc_type:
+                self.connection.rollback()
+            else:
+                self.commit()
+        finally:
+            self.connection.autocommit = True
+
+    def run(
+        self,
+        method: Callable,
+        *args,
+        statements: int = 1,
+        size: Union[int, Callable[[], int]] = 0
+    ) -> None:
+        """ Call method(*args) executing statements of size bytes
+
+            size can be a callable giving it after the call
+        """
+
+        if self.mode == Transaction.SAVEPOINT:
+            self.__run_savepoint(method, *args)
+            return
+
+        method(*args)
+
+        if self.mode != Transaction.COMMIT:
+            return
+
+        self.statements += statements
+        self.size += size() if callable(size) else size
+        if (self.commit_every and self.statements >= self.commit_every) \
+                or (self.commit_bytes and self.size >= self.commit_bytes):
+            self.commit()
+
+    def commit(self) -> None:
+        """ Commit current transaction """
+
+        self.connection.commit()
+        self.commits += 1
+        self.statements = 0
+        self.size = 0
+
+    def __run_savepoint(self, method: Callable, *args) -> None:
+        """ Call method(*args) after a savepoint, rolling back to it """
+
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'SAVEPOINT {Transaction.SAVEPOINT_NAME}')
+            try:
+                method(*args)
+            except psycopg2.Error as e:
+                cursor.execute(
+                    f'ROLLBACK TO SAVEPOINT {Transaction.SAVEPOINT_NAME}'
+                )
+                self.failed += 1
+                self.logger.add('Batch is rolled back: ' + str(e).strip())
+                return
+
+            cursor.execute(f'RELEASE SAVEPOINT {Transaction.SAVEPOINT_NAME}')
@@ -0,0 +1,212 @@
+import json
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Optional
+
+
+class DeployPlan:
+    """
+    Deploy plan: steps with dependencies
+
+    Independent steps run concurrently, steps after a failed
+    (or skipped) step are skipped. Plan file example (JSON or TOML):
+    {
+        "workers": 4,
+        "steps": [
+            {"name": "db", "action": "init_db"},
+            {"name": "schema", "action": "query_from_file",
+             "path": "{{mount_dir}}/schema.sql", "after": ["db"]},
+            {"name": "nginx", "action": "build_config",
+             "src": "nginx.conf", "dest": "/etc/nginx/nginx.conf"}
+        ]
+    }
+    Step keys other than name, action and after are action arguments
+    """
+
+    # DeployTool methods available as step actions
+    ACTIONS: list = [
+        'init_db',
+        'query_from_file',
+        'build_config',
+        'build_configs',
+    ]
+
+    # Actions sharing the DeployTool DB connection, run one at a time
+    DB_ACTIONS: list = [
+        'init_db',
+        'query_from_file',
+    ]
+
+    # Step statuses
+    OK: str = 'ok'
+    FAILED: str = 'failed'
+    SKIPPED: str = 'skipped'
+
+    def __init__(self, steps: list, workers: Optional[int] = None):
+        self.steps = steps
+        self.by_name = {step.get('name'): step for step in steps}
+        self.workers = workers
+        self.durations = {}
+        self.critical_path = []
+        self.db_lock = threading.Lock()
+
+        self.order = self.__sort()
+
+    def load(path: str) -> 'DeployPlan':
+        """ Load plan from JSON or TOML (.toml) file """
+
+        if path.endswith('.toml'):
+            try:
+                import tomllib
+            except ImportError:
+                import tomli as tomllib
+
+            with open(path, 'rb') as f:
+                data = tomllib.load(f)
+        else:
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+
+        return DeployPlan(data.get('steps', []), data.get('workers'))
+
+    def run(self, deploy_tool: object, workers: Optional[int] = None) -> dict:
+        """ Run plan steps on deploy_tool, returns {step: status} """
+
+        status = {}
+        pending = {step['name']: step for step in self.steps}
+        running = {}
+        self.durations = {}
+
+        with ThreadPoolExecutor(workers or self.workers) as executor:
+            while pending or running:
+                for name, step in list(pending.items()):
+                    after = step.get('after', [])
+
+                    if any(status.get(dep) in (self.FAILED, self.SKIPPED)
+                           for dep in after):
+                        del pending[name]
+                        status[name] = self.SKIPPED
+                        deploy_tool.logger.add(
+                            f'Plan step {name} is skipped, '
+                            'its dependency failed'
+                        )
+                    elif all(status.get(dep) == self.OK for dep in after):
+                        del pending[name]
+                        future = executor.submit(
+                            self.__run_step,
+                            deploy_tool,
+                            step
+                        )
+                        running[future] = name
+
+                if not running:
+                    continue
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    status[name] = self.OK if future.result() else self.FAILED
+
+        self.__report(deploy_tool, status)
+
+        return {step['name']: status[step['name']] for step in self.steps}
+
+    def __run_step(self, deploy_tool: object, step: dict) -> bool:
+        """ Run plan step, returns success """
+
+        name = step['name']
+        action = step['action']
+        kwargs = {
+            key: value for key, value in step.items()
+            if key not in ('name', 'action', 'after')
+        }
+
+        span = deploy_tool.logger.span('plan_step', step=name, action=action)
+        start = time.perf_counter()
+        try:
+            with span:
+                if action in self.DB_ACTIONS:
+                    with self.db_lock:
+                        result = getattr(deploy_tool, action)(**kwargs)
+                else:
+                    result = getattr(deploy_tool, action)(**kwargs)
+        except Exception as e:
+            deploy_tool.logger.add(f'Plan step {name} failed: ' + str(e))
+            return False
+        finally:
+            self.durations[name] = time.perf_counter() - start
+
+        if isinstance(result, dict):
+            result = all(result.values())
+
+        if not result:
+            deploy_tool.logger.add(f'Plan step {name} failed')
+
+        return bool(result)
+
+    def __report(self, deploy_tool: object, status: dict) -> None:
+        """ Report plan result and its critical path """
+
+        finish = {}
+        previous = {}
+        for name in self.order:
+            after = self.by_name[name].get('after', [])
+            previous[name] = max(after, key=finish.get, default=None)
+            start = finish[previous[name]] if previous[name] else 0.0
+            finish[name] = start + self.durations.get(name, 0.0)
+
+        path = []
+        name = max(finish, key=finish.get, default=None)
+        while name:
+            path.insert(0, name)
+            name = previous[name]
+        self.critical_path = path
+
+        done = sum(1 for value in status.values() if value == self.OK)
+        length = finish[path[-1]] if path else 0.0
+        deploy_tool.logger.add(
+            f'Plan: {done} of {len(status)} steps done, '
+            f'critical path {length:.3f} s '
+            f'of {sum(self.durations.values()):.3f} s steps time: '
+            + ' -> '.join(path)
+        )
+
+    def __sort(self) -> list:
+        """ Check steps, returns step names in dependency order """
+
+        names = [step.get('name') for step in self.steps]
+        if len(self.by_name) != len(names) or not all(names):
+            raise ValueError('Plan steps must have unique names')
+
+        for step in self.steps:
+            if step.get('action') not in self.ACTIONS:
+                raise ValueError(
+                    f'Unknown plan step action: {step.get("action")}'
+                )
+            for dep in step.get('after', []):
+                if dep not in self.by_name:
+                    raise ValueError(
+                        f'Unknown plan step {dep} in {step["name"]}'
+                    )
+
+        order = []
+        visited = set()
+        visiting = set()
+
+        def visit(name: str) -> None:
+            if name in visited:
+                return
+            if name in visiting:
+                raise ValueError(f'Plan steps cycle at {name}')
+            visiting.add(name)
+            for dep in self.by_name[name].get('after', []):
+                visit(dep)
+            visiting.discard(name)
+            visited.add(name)
+            order.append(name)
+
+        for name in names:
+            visit(name)
+
+        return order
@@ -1,10 +1,20 @@
 import argparse
+import contextlib
 import copy
+import fnmatch
+import glob
+import hashlib
+import mmap
 import os
-from typing import Optional
-from .db_postgres import DbPostgres
-from .logger import Logger
-from .macros import Macros
+import re
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Iterator, Optional, Pattern
+from .backend_registry import BackendRegistry
+from .deploy_plan import DeployPlan
+from .logger import Logger, Span
+from .macros import Macros, Template
+from .manifest import Manifest
 
 
 class DeployTool:
@@ -23,39 +33,81 @@ class DeployTool:
         'mount_dir',
     ]
 
+    # DB backends by db_type, imported on first use
+    DB_BACKENDS: BackendRegistry = BackendRegistry(
+        {'pgsql': '.db_postgres:DbPostgres'},
+        'deploy_tool.db_backends'
+    )
+
     ENCODING: str = 'utf-8'
 
+    # Config files are rendered by chunks of this size (in chars)
+    CHUNK_SIZE: int = 1024 * 1024
+
+    # Max bytes per kernel copy call for config files without macros
+    COPY_SIZE: int = 1024 * 1024 * 1024
+
+    # Source bytes that need rendering: macros and CR (newlines translation)
+    RENDER_BYTES: Pattern = re.compile(rb'\{\{|\r')
+
     def __init__(self, params: Optional[dict] = None):
         self.db = None
-        self.logger = Logger()
+        self.logger = Logger(params.get('timing_log') if params else None)
+        self.manifest = None
+        self.manifest_path = params.get('manifest') if params else None
 
         # Options initialisation
         self.__init_options(params)
 
-    def init_db(self) -> None:
-        """ DB initialisation factory """
+    def init_db(self, **kwargs) -> bool:
+        """ DB initialisation factory, kwargs are passed to the DB """
 
         options = self.__get_options()
 
         try:
-            db = self.__db_factory(options)
-            self.db = db.init_db()
+            with self.logger.span('init_db', db_type=options['db_type']):
+                db = self.__db_factory(options)
+                self.db = db.init_db(**kwargs)
         except Exception as e:
             self.logger.add('Can\'t initialise DB: ' + str(e))
+            return False
+
+        return True
+
+    def get_options(self) -> dict:
+        """ Get options, parsing them from CLI if needed """
+
+        return self.__get_options()
+
+    def close(self) -> None:
+        """ Close DB connections """
 
-    def query_from_file(self, path: str = '') -> None:
-        """ Execute DB query from file """
+        if self.db:
+            self.db.close()
+
+    def query_from_file(self, path: str = '', **kwargs) -> bool:
+        """ Execute DB query from file, kwargs are passed to the DB """
 
         if not self.db:
             self.logger.add('DB isn\'t initialised, use init_db() before')
-            return
+            return False
 
         try:
-            self.db.query_from_file(path)
+            self.db.query_from_file(path, **kwargs)
         except Exception as e:
             self.logger.add('Can\'t execute query: ' + str(e))
+            return False
+
+        return True
+
+    def run_plan(self, path: str, workers: Optional[int] = None) -> dict:
+        """ Run deploy plan file, returns {step: status} """
 
-    def build_config(self, src: str, dest: str) -> None:
+        plan = DeployPlan.load(Macros.replace(path, self.__get_options()))
+
+        return plan.run(self, workers)
+
+    def build_config(self, src: str, dest: str) -> bool:
         """ Build config file """
 
         options = self.__get_options()
@@ -63,20 +115,288 @@ class DeployTool:
         src = Macros.replace(src, options)
         dest = Macros.replace(dest, options)
 
+        result = self.__build_config_file(src, dest)
+        self.__save_manifest()
+
+        return result
+
+    def build_configs(
+        self,
+        configs: Iterable,
+        workers: Optional[int] = None
+    ) -> dict:
+        """ Build config files on a thread pool
+
+            configs are (src, dest) pairs, src can be a glob pattern,
+            then dest is a directory for the matched files.
+            Returns {dest: success}
+        """
+
+        options = self.__get_options()
+
+        files = []
+        for src, dest in configs:
+            src = Macros.replace(src, options)
+            dest = Macros.replace(dest, options)
+
+            if not any(char in src for char in '*?['):
+                files.append((src, dest))
+                continue
+
+            for path in sorted(glob.glob(src)):
+                if os.path.isfile(path):
+                    files.append(
+                        (path, os.path.join(dest, os.path.basename(path)))
+                    )
+
+        return self.__build_config_files(files, workers)
+
+    def build_config_tree(
+        self,
+        src_dir: str,
+        dest_dir: str,
+        include: Optional[list] = None,
+        exclude: Optional[list] = None,
+        workers: Optional[int] = None
+    ) -> dict:
+        """ Build config files tree on a thread pool
+
+            Files of src_dir tree are built to the same paths in dest_dir,
+            macros in paths are replaced. include and exclude are
+            glob patterns of paths relative to src_dir
+            (e.g. '*.conf', 'nginx/*'), excluded directories are skipped.
+            Returns {dest: success}
+        """
+
+        options = self.__get_options()
+
+        src_dir = Macros.replace(src_dir, options)
+        dest_dir = Macros.replace(dest_dir, options)
+
+        files = []
+        dirs = set()
+        try:
+            for src, path in self.__scan_tree(src_dir, include, exclude):
+                dest = os.path.join(dest_dir, Macros.replace(path, options))
+                files.append((src, dest))
+                dirs.add(os.path.dirname(dest))
+
+            # Directories are created once, before threads start
+            for directory in sorted(dirs):
+                os.makedirs(directory, exist_ok=True)
+        except OSError as e:
+            self.logger.add(f'Can\'t build config tree {src_dir}: ' + str(e))
+            return {}
+
+        return self.__build_config_files(files, workers, False)
+
+    def build_config_variants(
+        self,
+        src: str,
+        dest: str,
+        variants: Iterable[dict],
+        workers: int = 1
+    ) -> dict:
+        """ Build config file variants from one template
+
+            Source is read and compiled once, then rendered with each
+            variant options (over DeployTool options), dest is a path
+            pattern with macros, e.g. '/etc/{{tenant}}/app.conf'.
+            Variants are rendered on a thread pool with workers > 1.
+            Returns {dest: success}
+        """
+
+        options = self.__get_options()
+        src = Macros.replace(src, options)
+
+        files = []
+        for variant in variants:
+            variant_options = dict(options, **variant)
+            files.append(
+                (Macros.replace(dest, variant_options), variant_options)
+            )
+
+        self.logger.add(f'Build {len(files)} variants of {src}')
+
+        try:
+            with self.logger.span('build_config_variants', src=src) as span:
+                with open(src, encoding=self.ENCODING) as f:
+                    template = Template(f.read())
+                span.set('variants', len(files))
+        except Exception as e:
+            self.logger.add(f'Can\'t read template {src}: ' + str(e))
+            return {dest: False for dest, _ in files}
+
+        manifest = self.__get_manifest()
+        source_hash = manifest.source_hash(src) if manifest else None
+
+        # Directories are created once, before threads start,
+        # variants of failed directories aren't built
+        failed_dirs = set()
+        for directory in sorted({os.path.dirname(dest) for dest, _ in files}):
+            try:
+                os.makedirs(directory, exist_ok=True)
+            except OSError as e:
+                self.logger.add(
+                    f'Can\'t create config directory {directory}: ' + str(e)
+                )
+                failed_dirs.add(directory)
+
+        def build(file: tuple) -> bool:
+            if os.path.dirname(file[0]) in failed_dirs:
+                return False
+
+            return self.__build_config_variant(
+                template,
+                src,
+                *file,
+                source_hash
+            )
+
+        if workers > 1:
+            with ThreadPoolExecutor(workers) as executor:
+                results = list(executor.map(build, files))
+        else:
+            results = [build(file) for file in files]
+        results = dict(zip([dest for dest, _ in files], results))
+
+        self.__save_manifest()
+
+        built = sum(results.values())
+        self.logger.add(f'Built {built} of {len(results)} config files')
+
+        return results
+
+    def __build_config_variant(
+        self,
+        template: Template,
+        src: str,
+        dest: str,
+        options: dict,
+        source_hash: Optional[str]
+    ) -> bool:
+        """ Render config file variant, reporting result to the log """
+
+        try:
+            with self.logger.span('build_config', src=src, dest=dest) as span:
+                manifest = self.__get_manifest()
+                options_hash = Manifest.hash_options(options)
+                if manifest \
+                        and manifest.is_fresh(dest, source_hash, options_hash):
+                    span.set('skipped', True)
+                    return True
+
+                data = template.render(options).encode(self.ENCODING)
+                span.set('bytes_written', len(data))
+
+                output_hash = hashlib.sha256(data).hexdigest() \
+                    if manifest else None
+                if output_hash and manifest.output_hash(dest) == output_hash:
+                    span.set('unchanged', True)
+                else:
+                    with self.__replace_file(dest) as temp:
+                        with open(temp, 'xb') as f:
+                            f.write(data)
+
+                if manifest:
+                    manifest.update(
+                        dest,
+                        source_hash,
+                        options_hash,
+                        output_hash
+                    )
+        except Exception as e:
+            self.logger.add(f'Can\'t build config {dest}: ' + str(e))
+            return False
+
+        return True
+
+    def __scan_tree(
+        self,
+        src_dir: str,
+        include: Optional[list],
+        exclude: Optional[list]
+    ) -> Iterator[tuple]:
+        """ Walk src_dir tree, yields (file path, relative path)
+
+            Directory symlinks are followed, unless they point
+            to an ancestor directory (symlink loops)
+        """
+
+        stat = os.stat(src_dir)
+        stack = [('', frozenset([(stat.st_dev, stat.st_ino)]))]
+        while stack:
+            directory, ancestors = stack.pop()
+            with os.scandir(os.path.join(src_dir, directory)) as entries:
+                entries = sorted(entries, key=lambda entry: entry.name)
+
+            for entry in reversed(entries):
+                path = os.path.join(directory, entry.name)
+                if exclude and any(
+                    fnmatch.fnmatch(path, pattern) for pattern in exclude
+                ):
+                    continue
+
+                if entry.is_dir():
+                    stat = entry.stat()
+                    key = (stat.st_dev, stat.st_ino)
+                    if key not in ancestors:
+                        stack.append((path, ancestors | {key}))
+                elif not include or any(
+                    fnmatch.fnmatch(path, pattern) for pattern in include
+                ):
+                    yield entry.path, path
+
+    def __build_config_files(
+        self,
+        files: list,
+        workers: Optional[int],
+        make_dirs: bool = True
+    ) -> dict:
+        """ Build (src, dest) config files on a thread pool """
+
+        # Manifest is loaded before threads start
+        self.__get_manifest()
+
+        with ThreadPoolExecutor(workers) as executor:
+            results = executor.map(
+                lambda file: self.__build_config_file(*file, make_dirs),
+                files
+            )
+            results = dict(zip([dest for _, dest in files], results))
+
+        self.__save_manifest()
+
+        built = sum(results.values())
+        self.logger.add(f'Built {built} of {len(results)} config files')
+
+        return results
+
+    def __build_config_file(
+        self,
+        src: str,
+        dest: str,
+        make_dirs: bool = True
+    ) -> bool:
+        """ Build config file, reporting result to the log """
+
         self.logger.add(f'Build file: {dest}')
 
         try:
-            self.__make_config_file(src, dest)
+            with self.logger.span('build_config', src=src, dest=dest) as span:
+                self.__make_config_file(src, dest, span, make_dirs)
         except Exception as e:
             self.logger.add(f'Can\'t build config {dest}: ' + str(e))
+            return False
+
+        return True
 
     def __db_factory(self, options: dict) -> object:
         """ DB factory """
 
-        if options['db_type'] == 'pgsql':
-            return DbPostgres(options, self.logger)
+        backend = self.DB_BACKENDS.load(options['db_type'])
 
-        raise ValueError(f'Unknown DB type: {options["db_type"]}')
+        return backend(options, self.logger)
 
     def __init_options(self, params: Optional[dict] = None) -> None:
         """ Options initialisation """
@@ -118,14 +438,214 @@ class DeployTool:
 
         return options
 
-    def __make_config_file(self, src: str, dest: str) -> None:
-        """ Make config file """
+    def __get_manifest(self) -> Optional[Manifest]:
+        """ Get built config files manifest, if incremental mode is on """
+
+        if self.manifest_path and not self.manifest:
+            path = Macros.replace(self.manifest_path, self.__get_options())
+            self.manifest = Manifest(path)
+
+        return self.manifest
 
-        with open(src, encoding=self.ENCODING) as file_src:
-            source_content = Macros.replace(file_src.read(), self.options)
+    def __save_manifest(self) -> None:
+        """ Save built config files manifest """
 
-            # Create directories
+        if not self.manifest:
+            return
+
+        try:
+            self.manifest.save()
+        except Exception as e:
+            self.logger.add(
+                f'Can\'t save manifest {self.manifest.path}: ' + str(e)
+            )
+
+    def __make_config_file(
+        self,
+        src: str,
+        dest: str,
+        span: Optional[Span] = None,
+        make_dirs: bool = True
+    ) -> None:
+        """ Make config file, streaming it by chunks """
+
+        span = span or Span('build_config', {})
+
+        manifest = self.__get_manifest()
+        if manifest:
+            self.__make_config_file_incremental(
+                src,
+                dest,
+                manifest,
+                span,
+                make_dirs
+            )
+            return
+
+        # Create directories
+        if make_dirs:
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+
+        with self.__replace_file(dest) as temp:
+            if self.__is_plain(src):
+                self.__copy_config_file(src, temp, 'xb', span)
+                return
+
+            with open(src, encoding=self.ENCODING) as file_src, \
+                    open(temp, 'x', encoding=self.ENCODING) as file_dest:
+                chunks = iter(lambda: file_src.read(self.CHUNK_SIZE), '')
+                for chunk in Macros.replace_stream(chunks, self.options):
+                    file_dest.write(chunk)
+
+                span.set('bytes_read', file_src.buffer.tell())
+                span.set('bytes_written', file_dest.tell())
+
+    @contextlib.contextmanager
+    def __replace_file(self, dest: str) -> Iterator[str]:
+        """ Temp file path replacing dest when it's written
+
+            Symlinked dest is resolved, so the link target is replaced.
+            On errors the temp file is removed and dest is left intact
+        """
+
+        dest = os.path.realpath(dest)
+        temp = Manifest.temp_path(dest)
+        try:
+            yield temp
+            self.__replace(temp, dest)
+        except BaseException:
+            if os.path.exists(temp):
+                os.remove(temp)
+            raise
+
+    def __replace(self, temp: str, dest: str) -> None:
+        """ Replace dest with temp file, keeping dest mode and owner """
+
+        if os.path.isfile(dest):
+            shutil.copymode(dest, temp)
+            stat = os.stat(dest)
+            owner = (stat.st_uid, stat.st_gid)
+            stat = os.stat(temp)
+            if hasattr(os, 'chown') and owner != (stat.st_uid, stat.st_gid):
+                try:
+                    os.chown(temp, *owner)
+                except PermissionError:
+                    self.logger.add(f'Can\'t keep owner of config {dest}')
+
+        os.replace(temp, dest)
+
+    def __make_config_file_incremental(
+        self,
+        src: str,
+        dest: str,
+        manifest: Manifest,
+        span: Span,
+        make_dirs: bool = True
+    ) -> None:
+        """ Make config file only if its source or options changed
+
+            Output is written to a temp file and replaces dest
+            only if the content changed
+        """
+
+        source_hash = manifest.source_hash(src)
+        options_hash = Manifest.hash_options(self.options)
+        if manifest.is_fresh(dest, source_hash, options_hash):
+            self.logger.add(f'Config {dest} is up to date')
+            span.set('skipped', True)
+            return
+
+        # Create directories
+        if make_dirs:
             os.makedirs(os.path.dirname(dest), exist_ok=True)
 
-            with open(dest, 'w', encoding=self.ENCODING) as file_dest:
-                file_dest.write(source_content)
+        temp = Manifest.temp_path(os.path.realpath(dest))
+        digest = hashlib.sha256()
+        try:
+            if self.__is_plain(src):
+                self.__copy_config_file(src, temp, 'xb', span)
+                output_hash = source_hash
+            else:
+                with open(src, encoding=self.ENCODING) as file_src, \
+                        open(temp, 'x', encoding=self.ENCODING) as file_dest:
+                    chunks = iter(lambda: file_src.read(self.CHUNK_SIZE), '')
+                    for chunk in Macros.replace_stream(chunks, self.options):
+                        digest.update(chunk.encode(self.ENCODING))
+                        file_dest.write(chunk)
+
+                    span.set('bytes_read', file_src.buffer.tell())
+                    span.set('bytes_written', file_dest.tell())
+
+                output_hash = digest.hexdigest()
+
+            if manifest.output_hash(dest) == output_hash:
+                os.remove(temp)
+                span.set('unchanged', True)
+            else:
+                self.__replace(temp, os.path.realpath(dest))
+        except BaseException:
+            if os.path.exists(temp):
+                os.remove(temp)
+            raise
+
+        manifest.update(dest, source_hash, options_hash, output_hash)
+
+    def __is_plain(self, src: str) -> bool:
+        """ Can source be copied as is: no macros, no newlines translation
+
+            Checked by one scan of the memory-mapped file
+        """
+
+        if self.ENCODING != 'utf-8' or os.linesep != '\n':
+            return False
+
+        with open(src, 'rb') as f:
+            if not os.fstat(f.fileno()).st_size:
+                return True
+
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                return not self.RENDER_BYTES.search(data)
+
+    def __copy_config_file(
+        self,
+        src: str,
+        dest: str,
+        mode: str,
+        span: Span
+    ) -> None:
+        """ Copy config file without macros in the kernel
+
+            Files are unbuffered, so each copy method
+            continues from the current file positions
+        """
+
+        with open(src, 'rb', buffering=0) as file_src, \
+                open(dest, mode, buffering=0) as file_dest:
+            self.__copy_file(file_src.fileno(), file_dest.fileno())
+            shutil.copyfileobj(file_src, file_dest, self.CHUNK_SIZE)
+
+            span.set('bytes_read', file_src.tell())
+            span.set('bytes_written', file_dest.tell())
+            span.set('copied', True)
+
+    def __copy_file(self, fd_src: int, fd_dest: int) -> None:
+        """ Copy file data with copy_file_range or sendfile, if available
+
+            On errors the next method goes on, the rest is copied by caller
+        """
+
+        methods = []
+        if hasattr(os, 'copy_file_range'):
+            methods.append(os.copy_file_range)
+        if hasattr(os, 'sendfile'):
+            methods.append(
+                lambda src, dest, count: os.sendfile(dest, src, None, count)
+            )
+
+        for method in methods:
+            try:
+                while method(fd_src, fd_dest, self.COPY_SIZE):
+                    pass
+                return
+            except OSError:
+                continue
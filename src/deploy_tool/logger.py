@@ -1,9 +1,82 @@
+import contextlib
+import json
+import threading
+import time
+from typing import Iterator, Optional
+
+
+class Span:
+    """
+    Timed span fields and counters
+    """
+
+    def __init__(self, name: str, fields: dict):
+        self.name = name
+        self.fields = dict(fields)
+        self.lock = threading.Lock()
+
+    def add(self, counter: str, value: int = 1) -> None:
+        """ Increase counter """
+
+        with self.lock:
+            self.fields[counter] = self.fields.get(counter, 0) + value
+
+    def set(self, field: str, value: object) -> None:
+        """ Set field value """
+
+        with self.lock:
+            self.fields[field] = value
+
+
 class Logger:
     """
     Deplot tool logger
     """
 
+    # Timing log writes lock
+    LOCK = threading.Lock()
+
+    def __init__(self, timing_path: Optional[str] = None):
+        self.timing_path = timing_path
+
     def add(self, message) -> None:
         """ Add message to log """
 
         print(message)
+
+    @contextlib.contextmanager
+    def span(self, name: str, **fields) -> Iterator[Span]:
+        """
+        Timed span, written as a JSON line to timing_path on exit
+        Example: {"span": "connect", "duration": 0.01, "status": "ok"}
+        """
+
+        span = Span(name, fields)
+        start = time.time()
+        counter = time.perf_counter()
+        status = 'ok'
+
+        try:
+            yield span
+        except BaseException as e:
+            status = 'error'
+            span.set('error', str(e))
+            raise
+        finally:
+            if self.timing_path:
+                record = {
+                    'span': name,
+                    'start': start,
+                    'duration': time.perf_counter() - counter,
+                    'status': status,
+                }
+                record.update(span.fields)
+                self.__write(record)
+
+    def __write(self, record: dict) -> None:
+        """ Append record to the timing log """
+
+        line = json.dumps(record, default=str) + '\n'
+        with Logger.LOCK:
+            with open(self.timing_path, 'a', encoding='utf-8') as f:
+                f.write(line)
@@ -1,18 +1,133 @@
+import functools
+import re
+from typing import Iterable, Iterator
+
+
+class Template:
+    """
+    Compiled macros template
+    """
+
+    # Macros placeholder: {{name}}, name can't contain braces
+    PATTERN = re.compile(r'\{\{([^{}]*)\}\}')
+
+    def __init__(self, text: str):
+        self.text = text
+
+        # Literal parts and macros names, parts[i] goes before names[i]
+        self.parts = []
+        self.names = []
+
+        position = 0
+        for match in Template.PATTERN.finditer(text):
+            self.parts.append(text[position:match.start()])
+            self.names.append(match.group(1))
+            position = match.end()
+        self.parts.append(text[position:])
+
+    def render(self, dictionary: dict) -> str:
+        """ Render template in a single pass """
+
+        if not self.names:
+            return self.text
+
+        return self.substitute(Macros.resolve(dictionary))
+
+    def substitute(self, values: dict) -> str:
+        """ Substitute already resolved values """
+
+        if not self.names:
+            return self.text
+
+        result = []
+        for part, name in zip(self.parts, self.names):
+            result.append(part)
+            if name in values:
+                result.append(values[name])
+            else:
+                result.append(''.join(['{{', name, '}}']))
+        result.append(self.parts[-1])
+
+        return ''.join(result)
+
+
 class Macros:
     """
     Deploy tool macros replacer
     """
 
+    # Compiled templates cache size
+    CACHE_SIZE: int = 128
+
     def replace(text: str, dictionary: dict) -> str:
         """
         Replace macroses in string
         Example: {{macros}} => macros_value
         """
 
-        for macros in dictionary:
-            text = text.replace(
-                ''.join(['{{', macros,  '}}']),
-                dictionary[macros]
-            )
+        return Macros.compile(text).render(dictionary)
+
+    @functools.lru_cache(maxsize=CACHE_SIZE)
+    def compile(text: str) -> Template:
+        """ Compile template, cached by source content """
+
+        return Template(text)
+
+    def replace_stream(chunks: Iterable[str], dictionary: dict) -> Iterator:
+        """
+        Replace macroses in a stream of text chunks
+
+        A macros split between chunks is held back until it's complete,
+        so only an unfinished {{...}} tail is kept in memory
+        """
+
+        values = Macros.resolve(dictionary)
+        max_tail = max([len(macros) for macros in values] + [0]) + 4
+
+        tail = ''
+        for chunk in chunks:
+            text = tail + chunk
+            cut = Macros.__stream_cut(text, max_tail)
+            tail = text[cut:]
+            if cut:
+                yield Template(text[:cut]).substitute(values)
+
+        if tail:
+            yield Template(tail).substitute(values)
+
+    def __stream_cut(text: str, max_tail: int) -> int:
+        """ Position before an unfinished macros at the end of text """
+
+        start = text.rfind('{{')
+        if start != -1 \
+                and text.find('}}', start) == -1 \
+                and len(text) - start <= max_tail:
+            return start
+
+        if text.endswith('{'):
+            return len(text) - 1
+
+        return len(text)
+
+    def resolve(dictionary: dict) -> dict:
+        """
+        Resolve macroses inside of values
+
+        Values are replaced one by one in dictionary order, so a value
+        can use macroses defined after it: {'a': '{{b}}', 'b': 'x'}
+        """
+
+        if not any(
+            isinstance(value, str) and '{{' in value
+            for value in dictionary.values()
+        ):
+            return dictionary
+
+        resolved = {}
+        for macros in reversed(list(dictionary)):
+            value = dictionary[macros]
+            if isinstance(value, str) and '{{' in value:
+                value = Template(value).substitute(resolved)
+            resolved[macros] = value
 
-        return text
+        return {macros: resolved[macros] for macros in dictionary}
@@ -0,0 +1,142 @@
+import hashlib
+import json
+import os
+import threading
+import uuid
+from typing import Optional
+
+
+class Manifest:
+    """
+    Built config files manifest
+
+    Keeps hashes of sources, options and outputs by output path,
+    file stats let unchanged files skip hashing
+    """
+
+    # Files are hashed by blocks of this size
+    BLOCK_SIZE: int = 1024 * 1024
+
+    def __init__(self, path: str):
+        self.path = path
+        self.sources = {}
+        self.files = {}
+        self.changed = False
+        self.lock = threading.Lock()
+
+        if os.path.isfile(path):
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+            self.sources = data.get('sources', {})
+            self.files = data.get('files', {})
+
+    def hash_file(path: str) -> str:
+        """ File content hash """
+
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(Manifest.BLOCK_SIZE), b''):
+                digest.update(block)
+
+        return digest.hexdigest()
+
+    def hash_options(options: dict) -> str:
+        """ Options hash """
+
+        data = json.dumps(options, sort_keys=True, default=str)
+
+        return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+    def source_hash(self, src: str) -> str:
+        """ Source file hash, recalculated only if file stat changed """
+
+        stat = Manifest.__stat(src)
+        with self.lock:
+            source = self.sources.get(src)
+        if source and source['stat'] == stat:
+            return source['hash']
+
+        source_hash = Manifest.hash_file(src)
+        with self.lock:
+            self.sources[src] = {'stat': stat, 'hash': source_hash}
+            self.changed = True
+
+        return source_hash
+
+    def output_hash(self, dest: str) -> Optional[str]:
+        """ Current output file hash, None if it doesn't exist """
+
+        if not os.path.isfile(dest):
+            return None
+
+        with self.lock:
+            file = self.files.get(dest)
+        if file and file['stat'] == Manifest.__stat(dest):
+            return file['output']
+
+        return Manifest.hash_file(dest)
+
+    def is_fresh(self, dest: str, source_hash: str, options_hash: str) -> bool:
+        """ Is output built from the same source and options, unchanged """
+
+        with self.lock:
+            file = self.files.get(dest)
+
+        return bool(file) \
+            and file['source'] == source_hash \
+            and file['options'] == options_hash \
+            and os.path.isfile(dest) \
+            and file['stat'] == Manifest.__stat(dest)
+
+    def update(
+        self,
+        dest: str,
+        source_hash: str,
+        options_hash: str,
+        output_hash: str
+    ) -> None:
+        """ Save output file hashes """
+
+        file = {
+            'source': source_hash,
+            'options': options_hash,
+            'output': output_hash,
+            'stat': Manifest.__stat(dest),
+        }
+        with self.lock:
+            self.files[dest] = file
+            self.changed = True
+
+    def save(self) -> None:
+        """ Save manifest file atomically, if it's changed """
+
+        with self.lock:
+            if not self.changed:
+                return
+            self.changed = False
+            data = json.dumps(
+                {'sources': self.sources, 'files': self.files},
+                indent=1,
+                sort_keys=True
+            )
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        temp = Manifest.temp_path(self.path)
+        with open(temp, 'x', encoding='utf-8') as f:
+            f.write(data)
+        os.replace(temp, self.path)
+
+    def temp_path(path: str) -> str:
+        """ Unique temp file path next to path """
+
+        return f'{path}.{uuid.uuid4().hex}.tmp'
+
+    def __stat(path: str) -> list:
+        """ File size and modification time """
+
+        stat = os.stat(path)
+
+        return [stat.st_size, stat.st_mtime_ns]
@@ -0,0 +1,101 @@
+import re
+
+
+class SqlDeferred:
+    """
+    Index and constraint statements deferred until data is loaded
+    """
+
+    # Table or index name, optionally schema qualified and quoted
+    NAME = r'(?:"(?:[^"]|"")*"|[^\s."(]+)(?:\.(?:"(?:[^"]|"")*"|[^\s."(]+))?'
+
+    INDEX = re.compile(
+        r'CREATE\s+(?:UNIQUE\s+)?INDEX\b.*?\bON\s+(?:ONLY\s+)?(' + NAME + ')',
+        re.I | re.S
+    )
+    CONSTRAINT = re.compile(
+        r'ALTER\s+TABLE\s+(?:IF\s+EXISTS\s+)?(?:ONLY\s+)?(' + NAME + r')'
+        r'\s+ADD\s+CONSTRAINT\b',
+        re.I
+    )
+    FOREIGN_KEY = re.compile(
+        r'\bFOREIGN\s+KEY\b.*?\bREFERENCES\s+(?:ONLY\s+)?(' + NAME + ')',
+        re.I | re.S
+    )
+
+    # Statements using deferred indexes and constraints
+    DEPENDENT = re.compile(
+        r'ALTER\s+INDEX\b'
+        r'|COMMENT\s+ON\s+(?:INDEX|CONSTRAINT)\b'
+        r'|ALTER\s+TABLE\b.*\b(?:CLUSTER\s+ON|REPLICA\s+IDENTITY\s+USING)\b',
+        re.I | re.S
+    )
+
+    def __init__(self):
+        self.indexes = []
+        self.foreign_keys = []
+        self.dependent = []
+
+    def add(self, statement: str) -> bool:
+        """ Defer statement if it builds an index or a constraint """
+
+        index = SqlDeferred.INDEX.match(statement)
+        constraint = SqlDeferred.CONSTRAINT.match(statement)
+
+        if constraint:
+            foreign_key = SqlDeferred.FOREIGN_KEY.search(
+                statement,
+                constraint.end()
+            )
+            if foreign_key:
+                tables = {constraint.group(1), foreign_key.group(1)}
+                self.foreign_keys.append((statement, tables))
+                return True
+
+        if index or constraint:
+            self.indexes.append(statement)
+            return True
+
+        if len(self) and SqlDeferred.DEPENDENT.match(statement):
+            self.dependent.append(statement)
+            return True
+
+        return False
+
+    def stages(self) -> list:
+        """
+        Deferred statements by stages
+
+        Statements of one stage can be executed at the same time.
+        Indexes, primary and unique keys go before foreign keys,
+        foreign keys of one stage don't share tables to avoid deadlocks
+        """
+
+        stages = []
+        if self.indexes:
+            stages.append(self.indexes)
+
+        foreign_keys = self.foreign_keys
+        while foreign_keys:
+            stage = []
+            tables = set()
+            pending = []
+            for statement, statement_tables in foreign_keys:
+                if tables & statement_tables:
+                    pending.append((statement, statement_tables))
+                    continue
+                stage.append(statement)
+                tables |= statement_tables
+            stages.append(stage)
+            foreign_keys = pending
+
+        for statement in self.dependent:
+            stages.append([statement])
+
+        return stages
+
+    def __len__(self) -> int:
+        """ Deferred statements count """
+
+        return len(self.indexes) + len(self.foreign_keys) \
+            + len(self.dependent)
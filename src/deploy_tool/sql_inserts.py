@@ -0,0 +1,133 @@
+import re
+from typing import Iterable, Iterator, Optional
+from .sql_deferred import SqlDeferred
+
+
+class InsertBlock:
+    """
+    Coalesced single-row INSERT statements
+
+    query is 'INSERT INTO ... VALUES', rows are their '(...)' values
+    """
+
+    def __init__(self, query: str, rows: list):
+        self.query = query
+        self.rows = rows
+
+
+class SqlInserts:
+    """
+    Consecutive single-row INSERT statements coalescer
+
+    Runs of INSERTs into the same table with the same columns
+    are joined into blocks of up to page_size rows,
+    other statements (and single INSERTs) are passed through in order
+    """
+
+    INSERT = re.compile(
+        r'INSERT\s+INTO\s+' + SqlDeferred.NAME
+        + r'\s*(?:\((?:[^()"]|"(?:[^"]|"")*")*\)\s*)?VALUES\s*(?=\()',
+        re.I
+    )
+
+    # Chars which can change the row values scanner state
+    SPECIAL = re.compile(r'[()\'"$]')
+    QUOTE_END = re.compile(r"'")
+    ESCAPE_QUOTE_END = re.compile(r"['\\]")
+    IDENTIFIER_END = re.compile(r'"')
+
+    def __init__(self, page_size: int):
+        self.page_size = page_size
+
+    def coalesce(self, statements: Iterable) -> Iterator:
+        """ Yield statements, coalescing single-row INSERTs """
+
+        query = None
+        rows = []
+        first = None
+
+        for statement in statements:
+            insert = None
+            if isinstance(statement, str):
+                insert = SqlInserts.__parse(statement)
+
+            if insert and insert[0] == query and len(rows) < self.page_size:
+                rows.append(insert[1])
+                continue
+
+            if rows:
+                yield InsertBlock(query, rows) if len(rows) > 1 else first
+
+            if insert:
+                query, rows, first = insert[0], [insert[1]], statement
+            else:
+                query, rows, first = None, [], None
+                yield statement
+
+        if rows:
+            yield InsertBlock(query, rows) if len(rows) > 1 else first
+
+    def __parse(statement: str) -> Optional[tuple]:
+        """ (query, row values) of single-row INSERT, or None """
+
+        insert = SqlInserts.INSERT.match(statement)
+        if not insert:
+            return None
+
+        end = SqlInserts.__row_end(statement, insert.end())
+        if end is None or statement[end:].strip():
+            return None
+
+        return insert.group(0).rstrip(), statement[insert.end():end]
+
+    def __row_end(text: str, position: int) -> Optional[int]:
+        """ Position after the row values starting at position """
+
+        depth = 0
+        while True:
+            match = SqlInserts.SPECIAL.search(text, position)
+            if not match:
+                return None
+
+            char = match.group(0)
+            position = match.end()
+
+            if char == '(':
+                depth += 1
+            elif char == ')':
+                depth -= 1
+                if not depth:
+                    return position
+            elif char == '"':
+                end = SqlInserts.IDENTIFIER_END.search(text, position)
+                if not end:
+                    return None
+                position = end.end()
+            elif char == "'":
+                escape = match.start() > 0 \
+                    and text[match.start() - 1] in 'eE' \
+                    and not text[match.start() - 2:match.start() - 1].isalnum()
+                position = SqlInserts.__quote_end(text, position, escape)
+                if position is None:
+                    return None
+            else:
+                # Dollar quotes aren't coalesced
+                return None
+
+    def __quote_end(text: str, position: int, escape: bool) -> Optional[int]:
+        """ Position after the string literal started before position """
+
+        pattern = SqlInserts.ESCAPE_QUOTE_END if escape \
+            else SqlInserts.QUOTE_END
+
+        while True:
+            match = pattern.search(text, position)
+            if not match:
+                return None
+
+            if match.group(0) == '\\':
+                position = match.end() + 1
+            elif text[match.end():match.end() + 1] == "'":
+                position = match.end() + 1
+            else:
+                return match.end()
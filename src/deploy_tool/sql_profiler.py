@@ -0,0 +1,141 @@
+import collections
+import heapq
+import itertools
+import psycopg2
+import re
+import threading
+from typing import Iterable, Iterator, Optional
+from .sql_inserts import InsertBlock
+from .sql_splitter import CopyBlock, SqlSplitter
+
+
+class SqlProfiler:
+    """
+    Slow statements profiler
+
+    Executed statements (batches, COPY and INSERT blocks) are timed,
+    the top slowest are kept with their dump text offsets and excerpts.
+    EXPLAIN plans can be captured for the slowest single DML statements
+    """
+
+    # Statement excerpt length in the report
+    EXCERPT_SIZE: int = 120
+
+    # Statements which can be explained without side effects
+    DML = re.compile(r'(?:INSERT|UPDATE|DELETE|MERGE)\b', re.I)
+    SPACES = re.compile(r'\s+')
+
+    def __init__(self, top: int):
+        self.top = top
+        self.slowest = []
+        self.plans = {}
+        self.offsets = collections.deque()
+        self.deferred = {}
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+
+    def track(
+        self,
+        statements: Iterable,
+        splitter: SqlSplitter
+    ) -> Iterator:
+        """ Pass split statements through, recording their offsets """
+
+        for statement in statements:
+            self.offsets.append(splitter.offset)
+            yield statement
+
+    def offset(self, statement: object) -> Optional[int]:
+        """ Offset of the statement taken from the tracked statements """
+
+        count = len(statement.rows) if isinstance(statement, InsertBlock) \
+            else 1
+        offsets = [
+            self.offsets.popleft()
+            for _ in range(min(count, len(self.offsets)))
+        ]
+
+        return offsets[0] if offsets else None
+
+    def defer(self, statement: str, offset: Optional[int]) -> None:
+        """ Keep offset of the deferred statement """
+
+        self.deferred[statement] = offset
+
+    def deferred_offset(self, statement: str) -> Optional[int]:
+        """ Offset of the deferred statement """
+
+        return self.deferred.get(statement)
+
+    def add(
+        self,
+        duration: float,
+        statement: object,
+        offset: Optional[int],
+        statements: int = 1
+    ) -> None:
+        """ Record executed statement (or batch of statements) duration """
+
+        with self.lock:
+            if len(self.slowest) >= self.top \
+                    and duration <= self.slowest[0][0]:
+                return
+
+            entry = (duration, next(self.counter), offset, statement,
+                     statements)
+            if len(self.slowest) < self.top:
+                heapq.heappush(self.slowest, entry)
+            else:
+                heapq.heappushpop(self.slowest, entry)
+
+    def capture_plans(self, cursor: psycopg2.extensions.cursor) -> None:
+        """ Capture EXPLAIN plans of the slowest single DML statements """
+
+        for _, number, _, statement, statements \
+                in sorted(self.slowest, reverse=True):
+            if statements != 1 or not isinstance(statement, str) \
+                    or not SqlProfiler.DML.match(statement):
+                continue
+
+            try:
+                cursor.execute('EXPLAIN ' + statement)
+                plan = '\n'.join(row[0] for row in cursor.fetchall())
+            except psycopg2.Error as e:
+                plan = 'EXPLAIN failed: ' + str(e).strip()
+
+            self.plans[number] = plan
+
+    def report(self) -> list:
+        """ Slowest statements, from the slowest:
+            [{duration, offset, statements, excerpt, plan}]
+        """
+
+        return [
+            {
+                'duration': duration,
+                'offset': offset,
+                'statements': statements,
+                'excerpt': SqlProfiler.__excerpt(statement),
+                'plan': self.plans.get(number),
+            }
+            for duration, number, offset, statement, statements
+            in sorted(self.slowest, reverse=True)
+        ]
+
+    def __excerpt(statement: object) -> str:
+        """ Statement text excerpt in one line """
+
+        if isinstance(statement, CopyBlock):
+            text = statement.query
+        elif isinstance(statement, InsertBlock):
+            text = f'{statement.query} {statement.rows[0]}, ... ' \
+                f'({len(statement.rows)} rows)'
+        else:
+            text = statement
+
+        size = SqlProfiler.EXCERPT_SIZE
+        text = SqlProfiler.SPACES.sub(' ', text[:size * 2]).strip()
+        if len(text) > size:
+            text = text[:size - 3] + '...'
+
+        return text
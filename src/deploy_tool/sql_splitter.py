@@ -0,0 +1,454 @@
+import re
+import tempfile
+from typing import IO, Callable, Iterable, Iterator
+
+
+class CopyBlock:
+    """
+    COPY ... FROM stdin statement with its data
+    """
+
+    def __init__(self, query: str, data: IO):
+        self.query = query
+        self.data = data
+
+
+class CopyStream:
+    """
+    COPY data read straight from the split text stream
+
+    Data is read by fill calls of the splitter, it must be read
+    before the next statement is split, the rest is skipped
+    """
+
+    def __init__(self, fill: Callable[[], None]):
+        self.fill = fill
+        self.buffer = ''
+        self.done = False
+        self.size = 0
+
+    def __enter__(self) -> 'CopyStream':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        pass
+
+    def write(self, data: str) -> None:
+        """ Add split data """
+
+        self.buffer += data
+
+    def read(self, size: int = -1) -> str:
+        """ Read up to size chars, all the rest if size < 0 """
+
+        while not self.done and (size < 0 or len(self.buffer) < size):
+            self.fill()
+
+        if size < 0 or size > len(self.buffer):
+            size = len(self.buffer)
+
+        data = self.buffer[:size]
+        self.buffer = self.buffer[size:]
+        self.size += size
+
+        return data
+
+    def tell(self) -> int:
+        """ Read chars count """
+
+        return self.size
+
+    def skip(self) -> None:
+        """ Skip unread data """
+
+        while not self.done:
+            self.buffer = ''
+            self.fill()
+
+        self.buffer = ''
+
+
+class SqlSplitter:
+    """
+    Streaming SQL statements splitter
+
+    Understands quotes, dollar-quoting, comments
+    and COPY ... FROM stdin data blocks. Harmless psql meta-commands
+    (\\restrict, \\set ON_ERROR_STOP) are skipped, others raise ValueError.
+    With stream_copy COPY data isn't spooled, it's read
+    from the text stream by CopyStream before the next statement.
+    offset is the text offset of the last split statement start
+    """
+
+    # Lexer states
+    NORMAL: int = 0
+    QUOTE: int = 1
+    IDENTIFIER: int = 2
+    LINE_COMMENT: int = 3
+    BLOCK_COMMENT: int = 4
+    DOLLAR_QUOTE: int = 5
+    COPY_DATA: int = 6
+    META_COMMAND: int = 7
+
+    # Chars which can change the lexer state
+    SPECIAL = re.compile(r'[;\'"$\-/\\]')
+    QUOTE_END = re.compile(r"'")
+    IDENTIFIER_END = re.compile(r'"')
+    ESCAPE_QUOTE_END = re.compile(r"['\\]")
+    BLOCK_COMMENT_BOUND = re.compile(r'/\*|\*/')
+    DOLLAR_TAG = re.compile(r'\$(?:[^\W\d]\w*)?\$')
+    DOLLAR_TAG_PREFIX = re.compile(r'\$(?:[^\W\d]\w*)?$')
+    COPY_STDIN = re.compile(r'COPY\b.*\bFROM\s+stdin\b', re.I | re.S)
+
+    # psql meta-commands skipped in dumps, others can't be executed
+    # (e.g. \connect of pg_dump --create changes the target DB)
+    SKIPPED_META_COMMANDS = re.compile(
+        r'\\(?:restrict|unrestrict)\b|\\set\s+ON_ERROR_STOP\b'
+    )
+
+    # COPY data is kept in memory up to this size, then in a temp file
+    SPOOL_SIZE: int = 16 * 1024 * 1024
+
+    def __init__(self, stream_copy: bool = False):
+        self.stream_copy = stream_copy
+
+    def split(self, chunks: Iterable[str]) -> Iterator:
+        """ Split stream of SQL text chunks to statements
+
+            Yields statements as strings and COPY blocks as CopyBlock
+        """
+
+        self.text = ''
+        self.start = 0
+        self.pos = 0
+        self.parts = []
+        self.state = SqlSplitter.NORMAL
+        self.escape = False
+        self.depth = 0
+        self.tag = ''
+        self.line_start = True
+        self.copy = None
+        self.offset = 0
+        self.statement_offset = None
+        self.consumed = 0
+        self.chunks = iter(chunks)
+        self.final = False
+
+        # Streamed COPY data can read chunks too
+        for chunk in self.chunks:
+            self.__compact()
+            self.text += chunk
+            yield from self.__scan_text(False)
+
+        self.final = True
+        yield from self.__scan_text(True)
+
+        if self.state == SqlSplitter.COPY_DATA:
+            yield self.__flush_copy(len(self.text))
+            return
+
+        statement = self.__flush(len(self.text))
+        if statement:
+            yield statement
+
+    def __compact(self) -> None:
+        """ Drop already processed text """
+
+        if self.state == SqlSplitter.COPY_DATA:
+            self.copy.data.write(self.text[self.start:self.pos])
+            self.start = self.pos
+
+        self.consumed += self.start
+        self.text = self.text[self.start:]
+        self.pos -= self.start
+        self.start = 0
+
+    def __flush(self, end: int) -> str:
+        """ Get current statement """
+
+        self.__add_part(end)
+        statement = ''.join(self.parts).strip()
+        self.parts = []
+
+        if self.statement_offset is not None:
+            self.offset = self.statement_offset
+            self.statement_offset = None
+
+        return statement
+
+    def __flush_copy(self, end: int) -> CopyBlock:
+        """ Get current COPY block """
+
+        block = self.copy
+        block.data.write(self.text[self.start:end])
+        if isinstance(block.data, CopyStream):
+            block.data.done = True
+        else:
+            block.data.seek(0)
+        self.copy = None
+
+        return block
+
+    def __fill_copy(self) -> None:
+        """ Split streamed COPY data further, reading the next chunk """
+
+        final = self.final
+        for _ in self.__scan(final):
+            pass
+
+        if self.state != SqlSplitter.COPY_DATA:
+            return
+
+        if final:
+            # Data isn't terminated
+            self.__flush_copy(len(self.text))
+            self.state = SqlSplitter.NORMAL
+            self.start = self.pos = len(self.text)
+            return
+
+        self.__compact()
+        chunk = next(self.chunks, None)
+        if chunk is None:
+            self.final = True
+        else:
+            self.text += chunk
+
+    def __scan_text(self, final: bool) -> Iterator:
+        """ Scan text, rescanning it after a streamed COPY block """
+
+        while (yield from self.__scan(final)):
+            pass
+
+    def __scan(self, final: bool) -> Iterator[str]:
+        """ Scan text from current position
+
+            Returns True after a streamed COPY block,
+            text can be changed by its reading
+        """
+
+        text = self.text
+
+        while self.pos < len(text):
+            state = self.state
+
+            if state == SqlSplitter.NORMAL:
+                match = SqlSplitter.SPECIAL.search(text, self.pos)
+                if not match:
+                    self.pos = len(text)
+                    return
+
+                i = match.start()
+                char = text[i]
+
+                if char == ';':
+                    statement = self.__flush(i)
+                    self.start = self.pos = i + 1
+                    if SqlSplitter.COPY_STDIN.match(statement):
+                        # Data follows the COPY statement line
+                        self.state = SqlSplitter.COPY_DATA
+                        self.line_start = False
+                        if self.stream_copy:
+                            block = CopyBlock(
+                                statement,
+                                CopyStream(self.__fill_copy)
+                            )
+                            self.copy = block
+                            yield block
+                            block.data.skip()
+                            return True
+
+                        self.copy = CopyBlock(
+                            statement,
+                            tempfile.SpooledTemporaryFile(
+                                self.SPOOL_SIZE,
+                                'w+',
+                                encoding='utf-8'
+                            )
+                        )
+                    elif statement:
+                        yield statement
+                elif char == "'":
+                    self.state = SqlSplitter.QUOTE
+                    self.escape = i > 0 and text[i - 1] in 'eE' \
+                        and not (i > 1 and SqlSplitter.__word(text[i - 2]))
+                    self.pos = i + 1
+                elif char == '"':
+                    self.state = SqlSplitter.IDENTIFIER
+                    self.pos = i + 1
+                elif char in '-/':
+                    if i + 1 >= len(text) and not final:
+                        self.pos = i
+                        return
+                    pair = text[i:i + 2]
+                    if pair == '--':
+                        self.__comment_start(i)
+                        self.state = SqlSplitter.LINE_COMMENT
+                        self.pos = i + 2
+                    elif pair == '/*':
+                        self.__comment_start(i)
+                        self.state = SqlSplitter.BLOCK_COMMENT
+                        self.depth = 1
+                        self.pos = i + 2
+                    else:
+                        self.pos = i + 1
+                elif char == '$':
+                    if i > 0 and SqlSplitter.__word(text[i - 1]):
+                        # Part of an identifier
+                        self.pos = i + 1
+                        continue
+                    tag = SqlSplitter.DOLLAR_TAG.match(text, i)
+                    if tag:
+                        self.state = SqlSplitter.DOLLAR_QUOTE
+                        self.tag = tag.group()
+                        self.pos = tag.end()
+                    elif not final \
+                            and SqlSplitter.DOLLAR_TAG_PREFIX.match(text, i):
+                        # Tag can be continued in the next chunk
+                        self.pos = i
+                        return
+                    else:
+                        self.pos = i + 1
+                elif char == '\\':
+                    if self.__is_empty(i):
+                        # psql meta-command, it's read up to the line end
+                        self.__comment_start(i)
+                        self.state = SqlSplitter.META_COMMAND
+                    self.pos = i + 1
+
+            elif state == SqlSplitter.QUOTE or state == SqlSplitter.IDENTIFIER:
+                if state == SqlSplitter.IDENTIFIER:
+                    quote = '"'
+                    pattern = SqlSplitter.IDENTIFIER_END
+                elif self.escape:
+                    quote = "'"
+                    pattern = SqlSplitter.ESCAPE_QUOTE_END
+                else:
+                    quote = "'"
+                    pattern = SqlSplitter.QUOTE_END
+
+                match = pattern.search(text, self.pos)
+                if not match:
+                    self.pos = len(text)
+                    return
+
+                i = match.start()
+                if i + 1 >= len(text) and not final:
+                    # Escaped or doubled quote can be in the next chunk
+                    self.pos = i
+                    return
+                if text[i] == '\\' or text[i + 1:i + 2] == quote:
+                    self.pos = i + 2
+                else:
+                    self.state = SqlSplitter.NORMAL
+                    self.pos = i + 1
+
+            elif state == SqlSplitter.LINE_COMMENT:
+                i = text.find('\n', self.pos)
+                if i == -1:
+                    self.pos = self.start = len(text)
+                    return
+
+                self.state = SqlSplitter.NORMAL
+                self.start = self.pos = i
+
+            elif state == SqlSplitter.META_COMMAND:
+                i = text.find('\n', self.pos)
+                if i == -1 and not final:
+                    # Last char is rescanned with the final text
+                    self.pos = max(self.pos, len(text) - 1)
+                    return
+                if i == -1:
+                    i = len(text)
+
+                command = text[self.start:i].strip()
+                if not SqlSplitter.SKIPPED_META_COMMANDS.match(command):
+                    raise ValueError(
+                        f'psql meta-command isn\'t supported: {command}'
+                    )
+
+                self.state = SqlSplitter.NORMAL
+                self.start = self.pos = i
+
+            elif state == SqlSplitter.BLOCK_COMMENT:
+                match = SqlSplitter.BLOCK_COMMENT_BOUND.search(text, self.pos)
+                if not match:
+                    self.pos = self.start = max(self.pos, len(text) - 1)
+                    return
+
+                self.depth += 1 if match.group() == '/*' else -1
+                self.pos = match.end()
+                if not self.depth:
+                    self.state = SqlSplitter.NORMAL
+                    self.parts.append(' ')
+                self.start = self.pos
+
+            elif state == SqlSplitter.DOLLAR_QUOTE:
+                i = text.find(self.tag, self.pos)
+                if i == -1:
+                    self.pos = max(self.pos, len(text) - len(self.tag) + 1)
+                    return
+
+                self.state = SqlSplitter.NORMAL
+                self.pos = i + len(self.tag)
+
+            elif state == SqlSplitter.COPY_DATA:
+                if not self.line_start:
+                    i = text.find('\n', self.pos)
+                    if i == -1:
+                        self.pos = len(text)
+                        return
+                    self.start = self.pos = i + 1
+                    self.line_start = True
+                    continue
+
+                # Position is always at a line start here
+                if len(text) - self.pos < 2 and not final:
+                    return
+                if text.startswith('\\.', self.pos):
+                    block = self.__flush_copy(self.pos)
+                    self.state = SqlSplitter.NORMAL
+                    self.start = self.pos = self.pos + 2
+                    if isinstance(block.data, CopyStream):
+                        return True
+                    yield block
+                    continue
+
+                i = text.find('\n\\.', self.pos)
+                if i != -1:
+                    self.pos = i + 1
+                    continue
+
+                i = text.rfind('\n', self.pos)
+                if i != -1:
+                    self.pos = i + 1
+                if final:
+                    self.pos = len(text)
+                return
+
+    def __comment_start(self, i: int) -> None:
+        """ Keep statement text before a comment """
+
+        self.__add_part(i)
+        self.start = i
+
+    def __add_part(self, end: int) -> None:
+        """ Add statement text before end, noting the statement offset """
+
+        part = self.text[self.start:end]
+        self.parts.append(part)
+
+        if self.statement_offset is None:
+            space = len(part) - len(part.lstrip())
+            if space < len(part):
+                self.statement_offset = self.consumed + self.start + space
+
+    def __is_empty(self, i: int) -> bool:
+        """ Is current statement empty before position """
+
+        return not self.text[self.start:i].strip() \
+            and not ''.join(self.parts).strip()
+
+    def __word(char: str) -> bool:
+        """ Is char a part of an identifier """
+
+        return char.isalnum() or char == '_'
@@ -0,0 +1,100 @@
+from src.deploy_tool.async_deploy_tool import AsyncDeployTool
+from src.deploy_tool.db_postgres_async import AsyncDbPostgres
+import asyncio
+from typing import Coroutine
+
+
+def run(coroutine: Coroutine) -> object:
+    """ Run coroutine in a new event loop (asyncio.run needs Python 3.7) """
+
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+class TestAsyncDeployTool():
+    """
+    Test AsyncDeployTool
+    """
+
+    def setup(self):
+        self.options = {
+            'db_type': 'test_db_type',
+            'db_name': 'test_name',
+            'db_host': 'test_host',
+            'db_port': 'test_port',
+            'db_user': 'test_user',
+            'db_password': 'test_db_password',
+            'mount_dir': 'test_mount_dir',
+        }
+        self.deploy_tool = AsyncDeployTool({'options': self.options})
+
+    def test_init_db(self, mocker) -> None:
+        """ Test DB initialisation """
+
+        deploy_tool = self.deploy_tool
+        mocker.patch.object(deploy_tool.logger, 'add')
+
+        # Unknown DB type
+        run(deploy_tool.init_db())
+        deploy_tool.logger.add.assert_called_with(
+            'Can\'t initialise DB: Unknown DB type: test_db_type'
+        )
+
+        # PostgreSQL type ('pgsql')
+        async def init_db():
+            return 1
+
+        self.options['db_type'] = 'pgsql'
+        mocker.patch.object(AsyncDbPostgres, 'init_db', side_effect=init_db)
+        run(deploy_tool.init_db())
+        assert deploy_tool.db == 1
+
+    def test_query_from_file(self, mocker) -> None:
+        """ Test DB query from file """
+
+        deploy_tool = self.deploy_tool
+        mocker.patch.object(deploy_tool.logger, 'add')
+
+        # Undefined DB
+        run(deploy_tool.query_from_file())
+        deploy_tool.logger.add.assert_called_with(
+            'DB isn\'t initialised, use init_db() before'
+        )
+
+        # Query error
+        async def query_from_file(path):
+            return 0/0
+
+        deploy_tool.db = mocker.Mock()
+        deploy_tool.db.query_from_file = query_from_file
+        run(deploy_tool.query_from_file())
+        deploy_tool.logger.add.assert_called_with(
+            'Can\'t execute query: division by zero'
+        )
+
+    def test_build_config(self, mocker, tmp_path) -> None:
+        """ Test build config files concurrently """
+
+        deploy_tool = self.deploy_tool
+        mocker.patch.object(deploy_tool.logger, 'add')
+
+        src = tmp_path / 'src.conf'
+        src.write_text('{{db_name}}')
+
+        async def build():
+            return await asyncio.gather(
+                deploy_tool.build_config(str(src), str(tmp_path / 'a.conf')),
+                deploy_tool.build_configs(
+                    [(str(src), str(tmp_path / 'b.conf'))]
+                ),
+            )
+
+        assert run(build()) == [
+            True,
+            {str(tmp_path / 'b.conf'): True},
+        ]
+        assert (tmp_path / 'a.conf').read_text() == 'test_name'
+        assert (tmp_path / 'b.conf').read_text() == 'test_name'
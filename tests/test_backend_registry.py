@@ -0,0 +1,44 @@
+from src.deploy_tool.backend_registry import BackendRegistry
+from src.deploy_tool.db_postgres import DbPostgres
+import collections
+import subprocess
+import sys
+
+
+class TestBackendRegistry():
+    """
+    Test DB backends registry
+    """
+
+    def test_load(self) -> None:
+        """ Test: Backends are loaded by db_type """
+
+        registry = BackendRegistry(
+            {'pgsql': '.db_postgres:DbPostgres'},
+            'deploy_tool.test_backends'
+        )
+        assert registry.load('pgsql') is DbPostgres
+
+        registry.register('custom', 'collections:OrderedDict')
+        assert registry.load('custom') is collections.OrderedDict
+
+        try:
+            registry.load('unknown')
+            assert False
+        except ValueError as e:
+            assert str(e) == 'Unknown DB type: unknown'
+
+    def test_lazy_import(self) -> None:
+        """ Test: DB drivers aren't imported with the deploy tool """
+
+        code = 'import sys, src.deploy_tool.deploy_tool, ' \
+            'src.deploy_tool.async_deploy_tool; ' \
+            'print("psycopg2" in sys.modules)'
+        result = subprocess.run(
+            [sys.executable, '-c', code],
+            stdout=subprocess.PIPE,
+            universal_newlines=True,
+            check=True
+        )
+
+        assert result.stdout.strip() == 'False'
@@ -0,0 +1,52 @@
+from src.deploy_tool.db_load_profile import LoadProfile
+from src.deploy_tool.sql_splitter import CopyBlock
+import pytest
+
+
+class TestLoadProfile():
+    """
+    Test bulk load session profile
+    """
+
+    def test_statement(self) -> None:
+        """ Test: Created tables are recorded and made unlogged """
+
+        profile = LoadProfile('fast_unlogged')
+
+        assert profile.statement('CREATE TABLE public.a (id int)') \
+            == 'CREATE UNLOGGED TABLE public.a (id int)'
+        assert profile.statement('create table if not exists "B" (id int)') \
+            == 'CREATE UNLOGGED table if not exists "B" (id int)'
+        assert profile.statement(
+            'CREATE TABLE p (id int) PARTITION BY RANGE (id)'
+        ) == 'CREATE TABLE p (id int) PARTITION BY RANGE (id)'
+        assert profile.statement('CREATE TEMP TABLE t (id int)') \
+            == 'CREATE TEMP TABLE t (id int)'
+        assert profile.statement('SELECT 1') == 'SELECT 1'
+        profile.copy(CopyBlock('COPY public.c (id) FROM stdin', None))
+        profile.copy(CopyBlock('COPY public.a (id) FROM stdin', None))
+
+        assert list(profile.tables) == ['public.a', '"B"', 'p', 'public.c']
+        assert profile.unlogged_tables == ['public.a', '"B"']
+
+        profile = LoadProfile('fast')
+        assert profile.statement('CREATE TABLE a (id int)') \
+            == 'CREATE TABLE a (id int)'
+        assert profile.unlogged_tables == []
+
+    def test_queries(self) -> None:
+        """ Test: Session settings queries """
+
+        profile = LoadProfile('fast')
+
+        assert profile.set_query() == (
+            "SET synchronous_commit = 'off';\n"
+            "SET maintenance_work_mem = '1GB'"
+        )
+        assert profile.reset_query() == (
+            'RESET synchronous_commit;\n'
+            'RESET maintenance_work_mem'
+        )
+
+        with pytest.raises(ValueError):
+            LoadProfile('none')
@@ -0,0 +1,106 @@
+from src.deploy_tool.db_pool import ConnectionPool
+
+
+class TestConnectionPool():
+    """
+    Test DB connections pool
+    """
+
+    def test_acquire(self, mocker) -> None:
+        """ Test: Reuse connections """
+
+        connect = mocker.Mock(side_effect=lambda: ConnectionMock())
+        pool = ConnectionPool(connect, 1)
+
+        connection1 = pool.acquire()
+        connection2 = pool.acquire()
+        assert connect.call_count == 2
+
+        pool.release(connection1)
+        pool.release(connection2)
+        assert connection2.closed
+
+        assert pool.acquire() is connection1
+        assert connect.call_count == 2
+
+    def test_health_check(self, mocker) -> None:
+        """ Test: Broken idle connections aren't reused """
+
+        connect = mocker.Mock(side_effect=lambda: ConnectionMock())
+        pool = ConnectionPool(connect, 2)
+        pool.CHECK_INTERVAL = 0
+
+        with pool.connection() as connection:
+            pass
+        assert pool.acquire() is connection
+        assert connection.queries == ['SELECT 1']
+
+        pool.release(connection)
+        connection.broken = True
+        assert pool.acquire() is not connection
+        assert connection.closed
+
+        # Closed connections aren't returned
+        connection = pool.acquire()
+        connection.closed = 1
+        pool.release(connection)
+        assert pool.idle == []
+
+    def test_close(self, mocker) -> None:
+        """ Test: Close pool """
+
+        pool = ConnectionPool(ConnectionMock, 2)
+        connection1 = pool.acquire()
+        connection2 = pool.acquire()
+
+        pool.release(connection1)
+        pool.close()
+        assert connection1.closed
+
+        # Connections in use are closed on release
+        pool.release(connection2)
+        assert connection2.closed
+
+
+class ConnectionMock():
+    """ DB connection mock """
+
+    def __init__(self):
+        self.closed = 0
+        self.broken = False
+        self.queries = []
+
+    def cursor(self):
+        """ Cursor mock """
+
+        return CursorMock(self)
+
+    def rollback(self):
+        """ Rollback mock """
+
+        pass
+
+    def close(self):
+        """ Close mock """
+
+        self.closed = 1
+
+
+class CursorMock():
+    """ DB cursor mock """
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def execute(self, query):
+        """ Execute mock """
+
+        if self.connection.broken:
+            raise Exception('Connection is broken')
+        self.connection.queries.append(query)
@@ -1,10 +1,18 @@
 from src.deploy_tool.db_postgres import DbPostgres
 from src.deploy_tool.logger import Logger
 from src.deploy_tool.macros import Macros
-from copy import deepcopy
+from src.deploy_tool.manifest import Manifest
+from src.deploy_tool.sql_splitter import CopyStream
+import bz2
+import gzip
+import lzma
 import os
+import tempfile
+import time
 import pytest
 import psycopg2
+import psycopg2.errors
+import psycopg2.extras
 
 
 class TestDbPostgres():
@@ -45,77 +53,861 @@ class TestDbPostgres():
 
         db_postgres = self.db_postgres
         mocker.patch.object(db_postgres, '_DbPostgres__check_options')
+        mocker.patch.object(db_postgres, '_DbPostgres__connect')
+        mocker.patch.object(db_postgres, '_DbPostgres__create')
+        mocker.patch.object(db_postgres.cursor, 'execute')
+        mocker.patch.object(db_postgres.cursor, 'fetchone', create=True)
 
-        # Good connection
-        db_postgres_good_connect = deepcopy(db_postgres)
-        mocker.patch.object(db_postgres_good_connect, '_DbPostgres__connect')
-        init = db_postgres_good_connect.init_db()
-        db_postgres_good_connect._DbPostgres__connect.assert_called()
-        assert init == db_postgres_good_connect
-
-        # Bad connection
-        db_postgres_bad_connect = deepcopy(db_postgres)
-        mocker.patch.object(
-            db_postgres_bad_connect.logger,
-            'add',
-            autospec=True
+        # Existing DB
+        db_postgres.cursor.fetchone.return_value = (1,)
+        assert db_postgres.init_db() == db_postgres
+        db_postgres.cursor.execute.assert_called_with(
+            'SELECT 1 FROM pg_database WHERE datname = %s',
+            (db_postgres.options['db_name'],)
         )
-        mocker.patch.object(db_postgres_bad_connect, '_DbPostgres__create')
+        assert db_postgres._DbPostgres__connect.call_args_list == [
+            mocker.call(False),
+            mocker.call(),
+        ]
+        db_postgres._DbPostgres__create.assert_not_called()
 
-        db_name = db_postgres_bad_connect.options["db_name"]
+        # New DB
+        db_postgres.cursor.fetchone.return_value = None
+        db_postgres.init_db()
+        db_postgres._DbPostgres__create.assert_called_once()
+
+        # Connection errors aren't taken for a missing DB
+        db_postgres._DbPostgres__connect.side_effect = \
+            psycopg2.OperationalError()
         with pytest.raises(psycopg2.OperationalError):
-            mocker.patch.object(
-                db_postgres_bad_connect,
-                '_DbPostgres__connect',
-                side_effect=psycopg2.OperationalError()
-            )
-            init = db_postgres_bad_connect.init_db()
-        db_postgres_bad_connect.logger.add.assert_called_with(
-            f'Can\'t connect to DB: {db_name}'
+            db_postgres.init_db()
+        db_postgres._DbPostgres__create.assert_called_once()
+
+    def test_init_db_snapshot(self, mocker, tmp_path):
+        """ Test DB initialisation from dump snapshot """
+
+        db_postgres = self.db_postgres
+        mocker.patch.object(db_postgres.logger, 'add')
+        mocker.patch.object(db_postgres, '_DbPostgres__connect')
+        mocker.patch.object(db_postgres, '_DbPostgres__create')
+        mocker.patch.object(db_postgres.cursor, 'execute')
+        mocker.patch.object(db_postgres.cursor, 'fetchone', create=True)
+
+        path = tmp_path / 'dump.sql'
+        path.write_text('SELECT {{db_name}};')
+        snapshot = db_postgres._DbPostgres__snapshot_name(
+            db_postgres._DbPostgres__hash_file(str(path))
         )
-        db_postgres_bad_connect._DbPostgres__create.assert_called()
-        db_postgres_bad_connect._DbPostgres__connect.assert_called()
+        assert snapshot.startswith('deploy_tool_snapshot_')
+        assert len(snapshot) < 64
+
+        # Saved snapshot
+        db_postgres.cursor.fetchone.side_effect = [None, (1,)]
+        db_postgres.init_db(str(path))
+        db_postgres.cursor.execute.assert_called_with(
+            'SELECT 1 FROM pg_database WHERE datname = %s',
+            (snapshot,)
+        )
+        db_postgres._DbPostgres__create.assert_called_with(
+            f'CREATE DATABASE {{{{db_name}}}} TEMPLATE {snapshot}'
+        )
+
+        # No snapshot
+        db_postgres.cursor.fetchone.side_effect = [None, None]
+        db_postgres.init_db(str(path))
+        db_postgres._DbPostgres__create.assert_called_with()
 
     def test_query_from_file(self, mocker) -> None:
         """ Test execute DB query from file """
 
         db_postgres = self.db_postgres
+        self.__mock_ledger(mocker)
         path = self.path
         query = self.query
 
-        def macros_replace_mock(*args, **kwargs):
-            return query if args[0] == query else path
-
         # Bad path
-        mocker.patch.object(db_postgres.logger, 'add', autospec=True)
+        mocker.patch.object(db_postgres.logger, 'add')
         mocker.patch('os.path.isfile', return_value=False)
-        mocker.patch.object(Macros, 'replace', side_effect=macros_replace_mock)
+        mocker.patch.object(Macros, 'replace', return_value=path)
         db_postgres.query_from_file(path)
 
-        os.path.isfile.assert_called_with(path)
+        os.path.isfile.assert_any_call(path)
         Macros.replace.assert_called_with(path, db_postgres.options)
         db_postgres.logger.add.assert_called_with(
             f'Dump file {path} isn\'t exists'
         )
 
         # Good path
-        mocker.patch.object(db_postgres.logger, 'add', autospec=True)
         mocker.patch('os.path.isfile', return_value=True)
         mocker.patch('builtins.open', mocker.mock_open(read_data=query))
-        mocker.patch.object(db_postgres.cursor, 'execute', autospec=True)
+        mocker.patch.object(db_postgres.cursor, 'execute')
         db_postgres.query_from_file(path)
 
-        Macros.replace.assert_called_with(query, db_postgres.options)
         db_postgres.logger.add.assert_called_with(
             f'Execute PostgreSQL query from {path}'
         )
         db_postgres.cursor.execute.assert_called_with(query)
 
         # Default path
+        Macros.replace.side_effect = lambda text, options: text
         path = db_postgres.DEFAULT_SQL_FILE
         db_postgres.query_from_file()
         open.assert_called_with(path)
 
+    def test_query_from_file_statements(self, mocker, tmp_path) -> None:
+        """ Test execute DB query from file statement by statement """
+
+        db_postgres = self.db_postgres
+        self.__mock_ledger(mocker)
+        db_postgres.CHUNK_SIZE = 5
+        mocker.patch.object(db_postgres.logger, 'add')
+        mocker.patch.object(db_postgres.cursor, 'execute')
+
+        path = tmp_path / 'dump.sql'
+        path.write_text(
+            "-- Dump\n"
+            "CREATE TABLE {{db_name}} (a text);\n"
+            "INSERT INTO {{db_name}} VALUES ('a;b');\n"
+            "SELECT $$;$$;\n"
+        )
+
+        db_postgres.query_from_file(str(path))
+        assert db_postgres.cursor.execute.call_args_list == [
+            mocker.call('CREATE TABLE test_name (a text)'),
+            mocker.call("INSERT INTO test_name VALUES ('a;b')"),
+            mocker.call('SELECT $$;$$'),
+        ]
+
+        # Batches
+        db_postgres.cursor.execute.reset_mock()
+        db_postgres.query_from_file(str(path), batch_size=2)
+        assert db_postgres.cursor.execute.call_args_list == [
+            mocker.call(
+                'CREATE TABLE test_name (a text);\n'
+                "INSERT INTO test_name VALUES ('a;b')"
+            ),
+            mocker.call('SELECT $$;$$'),
+        ]
+
+    def test_query_from_file_copy(self, mocker, tmp_path) -> None:
+        """ Test execute DB query from file with COPY data """
+
+        db_postgres = self.db_postgres
+        self.__mock_ledger(mocker)
+        mocker.patch.object(db_postgres.logger, 'add')
+        mocker.patch.object(db_postgres.cursor, 'execute')
+
+        copied = []
+        db_postgres.cursor.copy_expert = mocker.Mock(
+            side_effect=lambda query, data, size: copied.append(
+                (query, data.read())
+            )
+        )
+
+        path = tmp_path / 'dump.sql'
+        path.write_text(
+            'CREATE TABLE t (a text);\n'
+            'COPY public.t (a) FROM stdin;\n'
+            '{{db_name}}\n'
+            'b;c\n'
+            '\\.\n'
+            'SELECT 1;\n'
+        )
+
+        db_postgres.query_from_file(str(path), batch_size=10)
+        assert db_postgres.cursor.execute.call_args_list == [
+            mocker.call('CREATE TABLE t (a text)'),
+            mocker.call('SELECT 1'),
+        ]
+        assert copied == [
+            ('COPY public.t (a) FROM stdin', 'test_name\nb;c\n'),
+        ]
+
+    def test_query_from_file_transaction(self, mocker, tmp_path) -> None:
+        """ Test execute DB query from file in transactions """
+
+        db_postgres = self.db_postgres
+        self.__mock_ledger(mocker)
+        mocker.patch.object(db_postgres.logger, 'add')
+        mocker.patch.object(db_postgres.cursor, 'execute')
+        db_postgres.connection = mocker.MagicMock()
+
+        path = tmp_path / 'dump.sql'
+        path.write_text('SELECT 1;\nSELECT 2;\nSELECT 3;\n')
+
+        db_postgres.query_from_file(
+            str(path),
+            transaction='commit',
+            commit_every=2
+        )
+        assert db_postgres.connection.commit.call_count == 2
+        assert db_postgres.cursor.execute.call_count == 3
+        assert db_postgres.connection.autocommit is True
+        db_postgres._DbPostgres__set_applied.assert_called_once()
+
+        # Failed batch
+        db_postgres.cursor.execute.side_effect = psycopg2.ProgrammingError()
+        with pytest.raises(
+            RuntimeError,
+            match='is applied with 3 failed batches'
+        ):
+            db_postgres.query_from_file(str(path), transaction='savepoint')
+        db_postgres._DbPostgres__set_applied.assert_called_once()
+
+        with pytest.raises(ValueError):
+            db_postgres.query_from_file(
+                str(path),
+                transaction='file',
+                workers=2
+            )
+
+    def test_query_from_file_profile(self, mocker, tmp_path) -> None:
+        """ Test execute DB query from file with load profile """
+
+        db_postgres = self.db_postgres
+        self.__mock_ledger(mocker)
+        mocker.patch.object(db_postgres.logger, 'add')
+        mocker.patch.object(db_postgres.cursor, 'execute')
+        db_postgres.cursor.copy_expert = mocker.Mock()
+
+        path = tmp_path / 'dump.sql'
+        path.write_text(
+            'CREATE TABLE b (id int);\n'
+            'CREATE TABLE a (id int);\n'
+            'COPY a (id) FROM stdin;\n1\n\\.\n'
+        )
+
+        # b references a, it's set logged after a
+        def execute(query: str) -> None:
+            if query == 'ALTER TABLE b SET LOGGED' and \
+                    mocker.call('ALTER TABLE a SET LOGGED') \
+                    not in db_postgres.cursor.execute.call_args_list[:-1]:
+                raise psycopg2.ProgrammingError('references unlogged')
+
+        db_postgres.cursor.execute.side_effect = execute
+        db_postgres.query_from_file(str(path), profile='fast_unlogged')
+
+        calls = db_postgres.cursor.execute.call_args_list
+        assert calls == [
+            mocker.call(
+                "SET synchronous_commit = 'off';\n"
+                "SET maintenance_work_mem = '1GB'"
+            ),
+            mocker.call('CREATE UNLOGGED TABLE b (id int)'),
+            mocker.call('CREATE UNLOGGED TABLE a (id int)'),
+            mocker.call('ALTER TABLE b SET LOGGED'),
+            mocker.call('ALTER TABLE a SET LOGGED'),
+            mocker.call('ALTER TABLE b SET LOGGED'),
+            mocker.call('ANALYZE b'),
+            mocker.call('ANALYZE a'),
+            mocker.call(
+                'RESET synchronous_commit;\n'
+                'RESET maintenance_work_mem'
+            ),
+        ]
+        assert db_postgres.load_profile is None
+        assert db_postgres.logger.add.call_args[0][0].startswith(
+            'Load profile fast_unlogged phases: settings '
+        )
+
+    def test_query_from_file_profile_failed(self, mocker, tmp_path) -> None:
+        """ Test tables of a failed unlogged load are set logged """
+
+        db_postgres = self.db_postgres
+        self.__mock_ledger(mocker)
+        mocker.patch.object(db_postgres.logger, 'add')
+
+        def execute(query: str) -> None:
+            if query == 'SELECT 1/0':
+                raise psycopg2.DataError('division by zero')
+
+        mocker.patch.object(db_postgres.cursor, 'execute', side_effect=execute)
+
+        path = tmp_path / 'dump.sql'
+        path.write_text('CREATE TABLE a (id int);\nSELECT 1/0;\n')
+
+        with pytest.raises(psycopg2.DataError):
+            db_postgres.query_from_file(str(path), profile='fast_unlogged')
+
+        calls = db_postgres.cursor.execute.call_args_list
+        assert calls[-2:] == [
+            mocker.call('ALTER TABLE a SET LOGGED'),
+            mocker.call(
+                'RESET synchronous_commit;\n'
+                'RESET maintenance_work_mem'
+            ),
+        ]
+        assert mocker.call('ANALYZE a') not in calls
+
+    def test_query_from_file_profile_dropped(self, mocker, tmp_path) -> None:
+        """ Test analyze of tables dropped by the dump """
+
+        db_postgres = self.db_postgres
+        self.__mock_ledger(mocker)
+        mocker.patch.object(db_postgres.logger, 'add')
+
+        def execute(query: str) -> None:
+            if query == 'ANALYZE staging':
+                raise psycopg2.errors.UndefinedTable(
+                    'relation "staging" does not exist'
+                )
+
+        mocker.patch.object(db_postgres.cursor, 'execute', side_effect=execute)
+
+        path = tmp_path / 'dump.sql'
+        path.write_text(
+            'CREATE TABLE staging (id int);\n'
+            'CREATE TABLE a AS SELECT * FROM staging;\n'
+            'DROP TABLE staging;\n'
+        )
+
+        db_postgres.query_from_file(str(path), profile='fast')
+        db_postgres.logger.add.assert_any_call(
+            'Can\'t analyze table staging: relation "staging" does not exist'
+        )
+        db_postgres.cursor.execute.assert_any_call('ANALYZE a')
+        db_postgres._DbPostgres__set_applied.assert_called_once()
+
+    def test_query_from_file_inserts(self, mocker, tmp_path) -> None:
+        """ Test execute DB query from file with coalesced INSERTs """
+
+        db_postgres = self.db_postgres
+        self.__mock_ledger(mocker)
+        mocker.patch.object(db_postgres.logger, 'add')
+        mocker.patch.object(db_postgres.cursor, 'execute')
+        mocker.patch('psycopg2.extras.execute_values')
+
+        path = tmp_path / 'dump.sql'
+        path.write_text(
+            "INSERT INTO t (a) VALUES ('100%');\n" * 5
+            + 'SELECT 1;\n'
+        )
+
+        db_postgres.query_from_file(str(path), insert_page_size=3)
+        assert psycopg2.extras.execute_values.call_count == 2
+        args, kwargs = psycopg2.extras.execute_values.call_args_list[0]
+        assert args[1] == 'INSERT INTO t (a) VALUES %s'
+        assert [str(row[0]) for row in args[2]] == ["('100%')"] * 3
+        assert kwargs == {'template': '%s', 'page_size': 3}
+        db_postgres.cursor.execute.assert_called_once_with('SELECT 1')
+
+    def test_query_from_file_slowest(self, mocker, tmp_path) -> None:
+        """ Test execute DB query from file reporting slowest statements """
+
+        db_postgres = self.db_postgres
+        self.__mock_ledger(mocker)
+        mocker.patch.object(db_postgres.logger, 'add')
+        mocker.patch.object(db_postgres.cursor, 'fetchall', create=True)
+        db_postgres.cursor.fetchall.return_value = [('Update on t',)]
+
+        def execute(query: str) -> None:
+            if 'SET a = 1' in query or 'INDEX' in query:
+                time.sleep(0.02)
+
+        mocker.patch.object(db_postgres.cursor, 'execute', side_effect=execute)
+
+        sql = (
+            'CREATE TABLE t (a int);\n'
+            'CREATE INDEX i ON t (a);\n'
+            'UPDATE t SET a = 1;\n'
+            'SELECT 1;\n'
+        )
+        path = tmp_path / 'dump.sql'
+        path.write_text(sql)
+
+        db_postgres.query_from_file(
+            str(path),
+            defer_indexes=True,
+            slowest=2,
+            explain=True
+        )
+        db_postgres.cursor.execute.assert_any_call(
+            'EXPLAIN UPDATE t SET a = 1'
+        )
+        report = db_postgres.logger.add.call_args_list[-1][0][0]
+        lines = report.split('\n')
+        assert lines[0] == f'Slowest statements of {path}:'
+        assert len(lines) == 4
+        assert '    Update on t' in lines
+        assert any(
+            line.endswith(
+                f'at offset {sql.index("UPDATE")}: UPDATE t SET a = 1'
+            )
+            for line in lines
+        )
+        assert any(
+            line.endswith(
+                f'at offset {sql.index("CREATE INDEX")}: '
+                'CREATE INDEX i ON t (a)'
+            )
+            for line in lines
+        )
+
+    def test_query_from_file_compressed(self, mocker, tmp_path) -> None:
+        """ Test execute DB query from compressed files """
+
+        db_postgres = self.db_postgres
+        self.__mock_ledger(mocker)
+        db_postgres.CHUNK_SIZE = 5
+        mocker.patch.object(db_postgres.logger, 'add')
+        mocker.patch.object(db_postgres.cursor, 'execute')
+
+        data = b'CREATE TABLE {{db_name}} (a text);\nSELECT 1;\n'
+        plain = tmp_path / 'plain.sql'
+        plain.write_bytes(data)
+        hashes = db_postgres._DbPostgres__hash_file(str(plain))
+
+        for module, name in [
+            (gzip, 'dump.sql.gz'),
+            (bz2, 'dump.sql.bz2'),
+            (lzma, 'dump.sql.xz'),
+            (gzip, 'dump.sql.backup'),
+        ]:
+            path = tmp_path / name
+            path.write_bytes(module.compress(data))
+
+            db_postgres.cursor.execute.reset_mock()
+            db_postgres.query_from_file(str(path))
+            assert db_postgres.cursor.execute.call_args_list == [
+                mocker.call('CREATE TABLE test_name (a text)'),
+                mocker.call('SELECT 1'),
+            ]
+            # Rendered content is the same
+            assert db_postgres._DbPostgres__hash_file(str(path))[1] \
+                == hashes[1]
+            path.unlink()
+
+        # Compressed version of the path
+        path = tmp_path / 'dump.sql'
+        (tmp_path / 'dump.sql.xz').write_bytes(lzma.compress(data))
+        assert db_postgres.find_dump(str(path)) == f'{path}.xz'
+        db_postgres.cursor.execute.reset_mock()
+        db_postgres.query_from_file(str(path))
+        db_postgres.cursor.execute.assert_called_with('SELECT 1')
+
+    def test_query_from_file_copy_stream(self, mocker, tmp_path) -> None:
+        """ Test serial COPY data is read from the dump stream """
+
+        db_postgres = self.db_postgres
+        self.__mock_ledger(mocker)
+        db_postgres.CHUNK_SIZE = 4
+        mocker.patch.object(db_postgres.logger, 'add')
+        mocker.patch.object(db_postgres.cursor, 'execute')
+        mocker.patch('tempfile.SpooledTemporaryFile')
+        db_postgres.connection = mocker.MagicMock()
+
+        copied = []
+
+        def copy_expert(query, data, size):
+            assert isinstance(data, CopyStream)
+            copied.append(data.read())
+
+        db_postgres.cursor.copy_expert = copy_expert
+
+        path = tmp_path / 'dump.sql.gz'
+        path.write_bytes(gzip.compress(
+            b'COPY t (a) FROM stdin;\n1\n2\n\\.\nSELECT 1;\n'
+        ))
+
+        db_postgres.query_from_file(str(path), transaction='commit',
+                                    commit_bytes=3)
+        assert copied == ['1\n2\n']
+        db_postgres.cursor.execute.assert_called_with('SELECT 1')
+        tempfile.SpooledTemporaryFile.assert_not_called()
+
+        # Streamed data size is counted after the load:
+        # commits after COPY, SELECT and at the end
+        assert db_postgres.connection.commit.call_count == 3
+
+    def test_query_from_file_workers(self, mocker, tmp_path) -> None:
+        """ Test execute DB query from file with parallel data load """
+
+        db_postgres = self.db_postgres
+        self.__mock_ledger(mocker)
+        mocker.patch.object(db_postgres.logger, 'add')
+
+        events = []
+        db_postgres.cursor.execute = lambda query: events.append(query)
+
+        def copy_expert(query, data, size):
+            time.sleep(0.05)
+            events.append(query)
+
+        connection = mocker.MagicMock(closed=0)
+        cursor = connection.cursor.return_value.__enter__.return_value
+        cursor.copy_expert.side_effect = copy_expert
+        mocker.patch.object(
+            db_postgres,
+            '_DbPostgres__new_connection',
+            return_value=connection
+        )
+
+        path = tmp_path / 'dump.sql'
+        path.write_text(
+            'CREATE TABLE t1 (a int);\n'
+            'CREATE TABLE t2 (a int);\n'
+            'COPY t1 (a) FROM stdin;\n1\n\\.\n'
+            'COPY t2 (a) FROM stdin;\n2\n\\.\n'
+            'CREATE INDEX i ON t1 (a);\n'
+        )
+
+        db_postgres.query_from_file(str(path), workers=2)
+        assert events[:2] == [
+            'CREATE TABLE t1 (a int)',
+            'CREATE TABLE t2 (a int)',
+        ]
+        assert sorted(events[2:4]) == [
+            'COPY t1 (a) FROM stdin',
+            'COPY t2 (a) FROM stdin',
+        ]
+        assert events[4] == 'CREATE INDEX i ON t1 (a)'
+        assert db_postgres._DbPostgres__new_connection.call_count == 2
+        connection.close.assert_not_called()
+
+        # Worker connections are reused
+        db_postgres.query_from_file(str(path), workers=2)
+        assert db_postgres._DbPostgres__new_connection.call_count == 2
+
+    def test_query_from_file_workers_session(self, mocker, tmp_path) -> None:
+        """ Test session settings are replayed on worker connections """
+
+        db_postgres = self.db_postgres
+        self.__mock_ledger(mocker)
+        mocker.patch.object(db_postgres.logger, 'add')
+        mocker.patch.object(db_postgres.cursor, 'execute')
+
+        connection = mocker.MagicMock(closed=0)
+        cursor = connection.cursor.return_value.__enter__.return_value
+        mocker.patch.object(
+            db_postgres,
+            '_DbPostgres__new_connection',
+            return_value=connection
+        )
+
+        path = tmp_path / 'dump.sql'
+        path.write_text(
+            'SET statement_timeout = 0;\n'
+            "SELECT pg_catalog.set_config('search_path', '', false);\n"
+            'SET search_path = app;\n'
+            'SET LOCAL work_mem = 1;\n'
+            'COPY t (a) FROM stdin;\n1\n\\.\n'
+        )
+
+        db_postgres.query_from_file(str(path), workers=2)
+        assert cursor.execute.call_args_list == [
+            mocker.call('SET statement_timeout = 0;\nSET search_path = app'),
+            mocker.call('DISCARD ALL'),
+        ]
+        cursor.copy_expert.assert_called_once()
+
+    def test_query_from_file_defer_indexes(self, mocker, tmp_path) -> None:
+        """ Test execute DB query from file with deferred indexes """
+
+        db_postgres = self.db_postgres
+        self.__mock_ledger(mocker)
+        mocker.patch.object(db_postgres.logger, 'add')
+        mocker.patch.object(db_postgres.cursor, 'execute')
+        mocker.patch.object(db_postgres.cursor, 'copy_expert')
+
+        path = tmp_path / 'dump.sql'
+        path.write_text(
+            'CREATE TABLE t (a int);\n'
+            'CREATE INDEX t_a ON t (a);\n'
+            'ALTER TABLE t ADD CONSTRAINT t_pk PRIMARY KEY (a);\n'
+            'COPY t (a) FROM stdin;\n1\n\\.\n'
+            'SELECT 1;\n'
+        )
+
+        db_postgres.query_from_file(str(path), defer_indexes=True)
+        assert db_postgres.cursor.execute.call_args_list == [
+            mocker.call('CREATE TABLE t (a int)'),
+            mocker.call('SELECT 1'),
+            mocker.call('CREATE INDEX t_a ON t (a)'),
+            mocker.call('ALTER TABLE t ADD CONSTRAINT t_pk PRIMARY KEY (a)'),
+        ]
+        db_postgres.cursor.copy_expert.assert_called_once()
+        db_postgres.logger.add.assert_called_with(
+            'Build 2 deferred indexes and constraints'
+        )
+
+    def test_query_from_file_ledger(self, mocker, tmp_path) -> None:
+        """ Test applied dump files ledger """
+
+        db_postgres = self.db_postgres
+        mocker.patch.object(db_postgres.logger, 'add')
+        columns = ('content_hash', 'options_hash', 'rendered_hash')
+        ledger = []
+        found = []
+
+        def execute(query: str, params: tuple = ()) -> None:
+            found.clear()
+            if query.startswith('INSERT INTO public.deploy_tool_ledger '):
+                ledger.append(params[:3])
+            elif query.startswith('SELECT 1 FROM public.deploy_tool_ledger '):
+                keys = sorted(
+                    (i for i, column in enumerate(columns)
+                     if f'{column} = %s' in query),
+                    key=lambda i: query.index(columns[i])
+                )
+                found.extend(
+                    (1,) for row in ledger
+                    if all(row[i] == param for i, param in zip(keys, params))
+                )
+
+        mocker.patch.object(db_postgres.cursor, 'execute', side_effect=execute)
+        mocker.patch.object(
+            db_postgres.cursor,
+            'fetchone',
+            create=True,
+            side_effect=lambda: found[0] if found else None
+        )
+        open_dump = mocker.spy(db_postgres, 'open_dump')
+
+        def new_process() -> None:
+            db_postgres.content_hashes = {}
+            db_postgres.rendered_hashes = {}
+
+        path = tmp_path / 'dump.sql'
+        path.write_text('SELECT {{db_name}};')
+        content_hash = Manifest.hash_file(str(path))
+
+        # New file is read once, its rendered hash is saved by execution
+        db_postgres.query_from_file(str(path))
+        db_postgres.cursor.execute.assert_any_call('SELECT test_name')
+        assert open_dump.call_count == 1
+        hashes = db_postgres._DbPostgres__hash_file(str(path))
+        assert open_dump.call_count == 1
+        assert ledger == [(
+            content_hash,
+            Manifest.hash_options(db_postgres.options),
+            hashes[1]
+        )]
+
+        # Applied file, hashes are cached by file stat
+        mocker.patch.object(Manifest, 'hash_file')
+        db_postgres.cursor.execute.reset_mock()
+        db_postgres.query_from_file(str(path))
+        db_postgres.logger.add.assert_called_with(
+            f'Dump file {path} is already applied'
+        )
+        assert mocker.call('SELECT test_name') \
+            not in db_postgres.cursor.execute.call_args_list
+        Manifest.hash_file.assert_not_called()
+        assert open_dump.call_count == 1
+        mocker.stopall()
+        mocker.patch.object(db_postgres.logger, 'add')
+        mocker.patch.object(db_postgres.cursor, 'execute', side_effect=execute)
+        mocker.patch.object(
+            db_postgres.cursor,
+            'fetchone',
+            create=True,
+            side_effect=lambda: found[0] if found else None
+        )
+        open_dump = mocker.spy(db_postgres, 'open_dump')
+
+        # New process finds the file by options hash without rendering
+        new_process()
+        db_postgres.query_from_file(str(path))
+        db_postgres.logger.add.assert_called_with(
+            f'Dump file {path} is already applied'
+        )
+        open_dump.assert_not_called()
+
+        # Options changed, rendered dump is the same: it's rendered
+        # for the check once, then recorded for the new options
+        db_postgres.options['db_host'] = 'changed_host'
+        new_process()
+        db_postgres.query_from_file(str(path))
+        db_postgres.logger.add.assert_called_with(
+            f'Dump file {path} is already applied'
+        )
+        assert open_dump.call_count == 1
+        assert len(ledger) == 2
+        new_process()
+        db_postgres.query_from_file(str(path))
+        assert open_dump.call_count == 1
+
+        # Options changed, rendered dump too
+        db_postgres.options['db_name'] = 'changed_name'
+        db_postgres.query_from_file(str(path))
+        db_postgres.cursor.execute.assert_any_call('SELECT changed_name')
+        assert db_postgres._DbPostgres__hash_file(str(path))[0] \
+            == hashes[0]
+        assert db_postgres._DbPostgres__hash_file(str(path))[1] \
+            != hashes[1]
+
+        # Force
+        db_postgres.cursor.execute.reset_mock()
+        db_postgres.query_from_file(str(path), force=True)
+        db_postgres.cursor.execute.assert_any_call('SELECT changed_name')
+
+    def test_query_from_file_ledger_search_path(
+        self,
+        mocker,
+        tmp_path
+    ) -> None:
+        """ Test ledger after a dump clearing search_path """
+
+        db_postgres = self.db_postgres
+        mocker.patch.object(db_postgres.logger, 'add')
+        mocker.patch.object(db_postgres.cursor, 'fetchone', create=True)
+        db_postgres.cursor.fetchone.return_value = None
+        db_postgres.connection = mocker.MagicMock()
+        search_path = ['public']
+
+        def execute(query: str, *args) -> None:
+            if "set_config('search_path', ''" in query:
+                search_path.clear()
+            if 'deploy_tool_ledger ' in query and not search_path \
+                    and 'public.deploy_tool_ledger ' not in query:
+                raise psycopg2.errors.UndefinedTable(
+                    'relation "deploy_tool_ledger" does not exist'
+                )
+
+        mocker.patch.object(db_postgres.cursor, 'execute', side_effect=execute)
+
+        path = tmp_path / 'dump.sql'
+        path.write_text(
+            "SELECT pg_catalog.set_config('search_path', '', false);\n"
+            'CREATE TABLE public.t (a int);\n'
+        )
+
+        db_postgres.query_from_file(str(path))
+        db_postgres.query_from_file(str(path), transaction='file')
+        queries = [
+            call[0][0] for call in db_postgres.cursor.execute.call_args_list
+        ]
+        assert queries[-4] == 'SAVEPOINT deploy_tool_ledger_record'
+        assert queries[-2].startswith('INSERT INTO public.deploy_tool_ledger ')
+        assert queries[-1] == 'RELEASE SAVEPOINT deploy_tool_ledger_record'
+
+    def test_query_from_file_ledger_errors(self, mocker, tmp_path) -> None:
+        """ Test forced loads, disabled ledger and ledger errors """
+
+        db_postgres = self.db_postgres
+        mocker.patch.object(db_postgres.logger, 'add')
+        mocker.patch.object(db_postgres.cursor, 'execute')
+        mocker.patch.object(db_postgres.cursor, 'fetchone', create=True)
+        db_postgres.cursor.fetchone.return_value = None
+        db_postgres.connection = mocker.MagicMock()
+
+        path = tmp_path / 'dump.sql'
+        path.write_text('SELECT 1;')
+
+        def queries() -> list:
+            return [
+                call[0][0]
+                for call in db_postgres.cursor.execute.call_args_list
+            ]
+
+        # Forced load creates missing ledger before recording
+        db_postgres.query_from_file(str(path), force=True)
+        assert queries()[0] == 'SELECT 1'
+        assert queries()[1].startswith(
+            'CREATE TABLE IF NOT EXISTS public.deploy_tool_ledger '
+        )
+        assert queries()[2].startswith(
+            'INSERT INTO public.deploy_tool_ledger '
+        )
+
+        # Disabled ledger
+        db_postgres.cursor.execute.reset_mock()
+        db_postgres.query_from_file(str(path), ledger=False)
+        assert queries() == ['SELECT 1']
+
+        # Ledger errors are logged, the load isn't failed
+        def execute(query: str, *args) -> None:
+            if 'deploy_tool_ledger ' in query:
+                raise psycopg2.errors.InsufficientPrivilege(
+                    'permission denied for schema public'
+                )
+
+        db_postgres.cursor.execute.reset_mock()
+        db_postgres.cursor.execute.side_effect = execute
+        db_postgres.query_from_file(str(path))
+        db_postgres.logger.add.assert_any_call(
+            f'Can\'t check dump file {path} in the ledger: '
+            'permission denied for schema public'
+        )
+        db_postgres.logger.add.assert_called_with(
+            f'Can\'t record dump file {path} in the ledger: '
+            'permission denied for schema public'
+        )
+        assert 'SELECT 1' in queries()
+
+        # Transaction is rolled back to the ledger savepoint only
+        db_postgres.cursor.execute.reset_mock()
+        db_postgres.query_from_file(str(path), transaction='file')
+        assert queries()[-3:] == [
+            'SAVEPOINT deploy_tool_ledger_record',
+            queries()[-2],
+            'ROLLBACK TO SAVEPOINT deploy_tool_ledger_record',
+        ]
+        db_postgres.connection.commit.assert_called_once()
+        db_postgres.connection.rollback.assert_not_called()
+
+    def test_query_from_file_snapshot(self, mocker, tmp_path) -> None:
+        """ Test save loaded DB snapshot """
+
+        db_postgres = self.db_postgres
+        cursor = db_postgres.cursor
+        self.__mock_ledger(mocker)
+        mocker.patch.object(db_postgres.logger, 'add')
+        mocker.patch.object(
+            db_postgres,
+            '_DbPostgres__connect',
+            side_effect=lambda *args: setattr(db_postgres, 'cursor', cursor)
+        )
+        mocker.patch.object(cursor, 'execute')
+        mocker.patch.object(cursor, 'fetchone', create=True)
+        pool = mocker.Mock()
+        db_postgres.pools = {True: pool}
+
+        path = tmp_path / 'dump.sql'
+        path.write_text('SELECT 1;')
+        snapshot = db_postgres._DbPostgres__snapshot_name(
+            db_postgres._DbPostgres__hash_file(str(path))
+        )
+
+        # New snapshot
+        db_postgres.cursor.fetchone.return_value = None
+        db_postgres.query_from_file(str(path), snapshot=True)
+        pool.close.assert_called_once()
+        assert db_postgres.pools == {}
+        db_postgres.cursor.execute.assert_called_with(
+            f'CREATE DATABASE {snapshot} TEMPLATE test_name IS_TEMPLATE true'
+        )
+        assert db_postgres._DbPostgres__connect.call_args_list == [
+            mocker.call(False),
+            mocker.call(),
+        ]
+
+        # Existing snapshot
+        db_postgres.cursor.fetchone.return_value = (1,)
+        db_postgres.query_from_file(str(path), snapshot=True)
+        db_postgres.cursor.execute.assert_called_with(
+            'SELECT 1 FROM pg_database WHERE datname = %s',
+            (snapshot,)
+        )
+
+        # Failed snapshot is logged, DB connection is restored
+        db_postgres._DbPostgres__connect.reset_mock()
+        db_postgres.cursor.fetchone.return_value = None
+
+        def execute(query: str, *args) -> None:
+            if query.startswith('CREATE DATABASE'):
+                raise psycopg2.errors.ObjectInUse('database is being accessed')
+
+        db_postgres.cursor.execute.side_effect = execute
+        db_postgres.query_from_file(str(path), snapshot=True)
+        db_postgres.logger.add.assert_called_with(
+            f'Can\'t save DB snapshot {snapshot}: database is being accessed'
+        )
+        assert db_postgres._DbPostgres__connect.call_args_list == [
+            mocker.call(False),
+            mocker.call(),
+        ]
+
     def test_create(self, mocker) -> None:
         """ Test connect """
 
@@ -136,7 +928,7 @@ class TestDbPostgres():
         db_postgres.logger.add.assert_called_with(
             f'Creating new Postgres DB: {db_postgres.options["db_name"]}'
         )
-        db_postgres._DbPostgres__connect.assert_called_with(False)
+        db_postgres._DbPostgres__connect.assert_not_called()
         Macros.replace.assert_called_with(query, db_postgres.options)
         db_postgres.cursor.execute.assert_called_with(query)
 
@@ -161,17 +953,62 @@ class TestDbPostgres():
             f'host={db_postgres.options["db_host"]} '
             f'port={db_postgres.options["db_port"]}'
         )
-        psycopg2.connect.assert_called_with(dsn)
+        psycopg2.connect.assert_called_with(dsn + ' dbname=postgres')
 
         # Connect to DB
         db_postgres._DbPostgres__connect(True)
-        dsn += f' dbname={db_postgres.options["db_name"]}'
-        psycopg2.connect.assert_called_with(dsn)
+        psycopg2.connect.assert_called_with(
+            dsn + f' dbname={db_postgres.options["db_name"]}'
+        )
 
         assert db_postgres.cursor == 'test_cursor'
         assert db_postgres.connection == connect_mock
         assert db_postgres.connection.autocommit is True
 
+        # Reuse pooled connection
+        psycopg2.connect.reset_mock()
+        db_postgres._DbPostgres__connect(False)
+        db_postgres._DbPostgres__connect(True)
+        psycopg2.connect.assert_not_called()
+        assert db_postgres.connection == connect_mock
+
+        # Maintenance DB option
+        db_postgres.options['db_maintenance_name'] = 'template1'
+        assert db_postgres.dsn(False) == dsn + ' dbname=template1'
+
+    def test_close(self, mocker) -> None:
+        """ Test close connections """
+
+        db_postgres = self.db_postgres
+        connect_mock = ConnectMock()
+        mocker.patch('psycopg2.connect', return_value=connect_mock)
+        mocker.patch.dict(db_postgres.options, {'db_pool_size': '1'})
+
+        db_postgres._DbPostgres__connect(True)
+        assert db_postgres._DbPostgres__pool(True).size == 1
+
+        db_postgres.close()
+        assert connect_mock.closed
+        assert db_postgres.connection is None
+        assert db_postgres.cursor is None
+        assert db_postgres.pools == {}
+
+    def __mock_ledger(self, mocker) -> None:
+        """ Mock applied dump files ledger """
+
+        db_postgres = self.db_postgres
+        mocker.patch.object(
+            db_postgres,
+            '_DbPostgres__is_applied',
+            return_value=False
+        )
+        mocker.patch.object(db_postgres, '_DbPostgres__set_applied')
+        mocker.patch.object(
+            db_postgres,
+            '_DbPostgres__content_hash',
+            return_value='content_hash'
+        )
+
     def test_check_options(self) -> None:
         """ Test check options """
 
@@ -189,13 +1026,31 @@ class ConnectMock():
 
     def __init__(self):
         self.autocommit = False
+        self.closed = 0
         self.cursor = lambda: 'test_cursor'
 
+    def rollback(self):
+        """ Psycopg2 connect mock rollback """
+
+        pass
+
+    def close(self):
+        """ Psycopg2 connect mock close """
+
+        self.closed = 1
+
 
 class CursorMock():
     """ Psycopg2 cursor mock"""
 
+    rowcount = -1
+
     def execute(self, query):
         """ Psycopg2 cursor mock execute """
 
         pass
+
+    def copy_expert(self, query, data, size):
+        """ Psycopg2 cursor mock copy_expert """
+
+        pass
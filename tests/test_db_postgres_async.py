@@ -0,0 +1,162 @@
+from src.deploy_tool import db_postgres_async
+from src.deploy_tool.db_postgres_async import AsyncDbPostgres, wait
+from src.deploy_tool.logger import Logger
+import asyncio
+import psycopg2
+import pytest
+import socket
+from typing import Coroutine
+
+
+def run(coroutine: Coroutine) -> object:
+    """ Run coroutine in a new event loop (asyncio.run needs Python 3.7) """
+
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def patch_async(mocker, target: object, name: str, **kwargs) -> object:
+    """ Patch coroutine function with a mock recording its calls
+
+        (patched coroutines are AsyncMock only since Python 3.8)
+    """
+
+    mock = mocker.Mock(**kwargs)
+
+    async def coroutine(*args, **kwargs) -> object:
+        return mock(*args, **kwargs)
+
+    mocker.patch.object(target, name, new=coroutine)
+
+    return mock
+
+
+class TestAsyncDbPostgres():
+    """
+    Test PostgreSQL DB over async connections
+    """
+
+    def setup(self):
+        options = {
+            'db_name': 'test_name',
+            'db_host': 'test_host',
+            'db_port': 'test_port',
+            'db_user': 'test_user',
+            'db_password': 'test_db_password',
+        }
+        self.db_postgres = AsyncDbPostgres(options, Logger())
+
+    def test_wait(self) -> None:
+        """ Test wait for async connection """
+
+        connection = ConnectionMock([
+            psycopg2.extensions.POLL_WRITE,
+            psycopg2.extensions.POLL_READ,
+            psycopg2.extensions.POLL_OK,
+        ])
+        run(wait(connection))
+        assert connection.states == []
+
+        connection = ConnectionMock([-1])
+        with pytest.raises(psycopg2.OperationalError):
+            run(wait(connection))
+
+    def test_init_db(self, mocker) -> None:
+        """ Test DB initialisation """
+
+        db_postgres = self.db_postgres
+        mocker.patch.object(db_postgres.logger, 'add')
+        create = patch_async(mocker, db_postgres, '_AsyncDbPostgres__create')
+        patch_async(mocker, db_postgres_async, 'wait')
+
+        # Existing DB
+        server = mocker.MagicMock()
+        server.cursor().fetchone.return_value = (1,)
+        connect = patch_async(
+            mocker,
+            db_postgres,
+            '_AsyncDbPostgres__connect',
+            side_effect=[server, 'test_connection']
+        )
+        assert run(db_postgres.init_db()) == db_postgres
+        assert db_postgres.connection == 'test_connection'
+        server.cursor().execute.assert_called_with(
+            'SELECT 1 FROM pg_database WHERE datname = %s',
+            ('test_name',)
+        )
+        server.close.assert_called_once()
+        create.assert_not_called()
+
+        # New DB
+        server.cursor().fetchone.return_value = None
+        connect.side_effect = [
+            server,
+            'test_connection',
+        ]
+        run(db_postgres.init_db())
+        create.assert_called_once_with(server)
+        assert db_postgres.connection == 'test_connection'
+
+    def test_query_from_file(self, mocker, tmp_path) -> None:
+        """ Test execute DB query from file """
+
+        db_postgres = self.db_postgres
+        mocker.patch.object(db_postgres.logger, 'add')
+        execute = patch_async(mocker, db_postgres, '_AsyncDbPostgres__execute')
+
+        copied = []
+        mocker.patch.object(
+            db_postgres,
+            '_AsyncDbPostgres__copy',
+            side_effect=lambda block, session: copied.append(
+                (block.data.read(), session)
+            )
+        )
+
+        path = tmp_path / 'dump.sql'
+        path.write_text(
+            'CREATE TABLE {{db_name}} (a int);\n'
+            'COPY {{db_name}} (a) FROM stdin;\n1\n\\.\n'
+            'SELECT 1;\n'
+            'SELECT 2;\n'
+            'SELECT 3;\n'
+            'SET search_path = app;\n'
+            'COPY t (a) FROM stdin;\n2\n\\.\n'
+        )
+
+        run(db_postgres.query_from_file(str(path), batch_size=2))
+        assert execute.call_args_list == [
+            mocker.call('CREATE TABLE test_name (a int)'),
+            mocker.call('SELECT 1;\nSELECT 2'),
+            mocker.call('SELECT 3;\nSET search_path = app'),
+            mocker.call(''),
+        ]
+        assert copied == [('1\n', []), ('2\n', ['SET search_path = app'])]
+
+        # Bad path
+        run(db_postgres.query_from_file(str(tmp_path / 'none.sql')))
+        db_postgres.logger.add.assert_called_with(
+            f'Dump file {tmp_path / "none.sql"} isn\'t exists'
+        )
+
+
+class ConnectionMock():
+    """ Psycopg2 async connection mock """
+
+    def __init__(self, states: list):
+        self.states = states
+        self.sockets = socket.socketpair()
+        self.sockets[1].send(b'x')
+
+    def poll(self):
+        """ Poll mock """
+
+        return self.states.pop(0)
+
+    def fileno(self):
+        """ Fileno mock, socket is always ready """
+
+        return self.sockets[0].fileno()
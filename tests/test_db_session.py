@@ -0,0 +1,37 @@
+from src.deploy_tool.db_session import SessionState
+
+
+class TestSessionState():
+    """
+    Test session settings recorder
+    """
+
+    def test_add(self) -> None:
+        """ Test: Session settings are recorded, the last one is kept """
+
+        session = SessionState()
+        statements = {
+            'SET search_path = app': True,
+            'SET LOCAL work_mem = 1': False,
+            'SET CONSTRAINTS ALL DEFERRED': False,
+            'SET TRANSACTION ISOLATION LEVEL SERIALIZABLE': False,
+            "SELECT pg_catalog.set_config('search_path', '', false)": True,
+            "SELECT pg_catalog.set_config('work_mem', '1MB', true)": False,
+            'SET SESSION AUTHORIZATION app': True,
+            'SET session_replication_role = replica': True,
+            'SET TIME ZONE UTC': True,
+            'RESET session_replication_role': True,
+            'SETTLE': False,
+        }
+        for statement, result in statements.items():
+            assert session.add(statement) is result
+
+        assert session.queries() == [
+            "SELECT pg_catalog.set_config('search_path', '', false)",
+            'SET SESSION AUTHORIZATION app',
+            'SET TIME ZONE UTC',
+        ]
+
+        # Role is kept by RESET ALL
+        assert session.add('RESET ALL')
+        assert session.queries() == ['SET SESSION AUTHORIZATION app']
@@ -0,0 +1,89 @@
+from src.deploy_tool.db_transaction import Transaction
+import psycopg2
+import pytest
+
+
+class TestTransaction():
+    """
+    Test dump execution transaction
+    """
+
+    def test_file(self, mocker) -> None:
+        """ Test: One transaction, rolled back on errors """
+
+        connection = mocker.MagicMock(autocommit=True)
+        method = mocker.Mock()
+
+        with Transaction(connection, 'file', mocker.Mock()) as transaction:
+            assert connection.autocommit is False
+            for _ in range(5):
+                transaction.run(method, 'query')
+            connection.commit.assert_not_called()
+
+        connection.commit.assert_called_once()
+        assert connection.autocommit is True
+        assert method.call_count == 5
+
+        with pytest.raises(ZeroDivisionError):
+            with Transaction(connection, 'file', mocker.Mock()) as transaction:
+                transaction.run(lambda: 0/0)
+        connection.rollback.assert_called_once()
+        connection.commit.assert_called_once()
+        assert connection.autocommit is True
+
+    def test_commit(self, mocker) -> None:
+        """ Test: Commits every N statements or bytes """
+
+        connection = mocker.MagicMock()
+        method = mocker.Mock()
+
+        transaction = Transaction(connection, 'commit', mocker.Mock(), 3)
+        with transaction:
+            for _ in range(7):
+                transaction.run(method, statements=1)
+            assert connection.commit.call_count == 2
+        assert connection.commit.call_count == 3
+
+        connection.reset_mock()
+        with Transaction(connection, 'commit', mocker.Mock(), 0, 100) \
+                as transaction:
+            transaction.run(method, size=60)
+            connection.commit.assert_not_called()
+            transaction.run(method, size=60)
+            connection.commit.assert_called_once()
+
+        assert Transaction(connection, 'commit', mocker.Mock()).commit_every \
+            == Transaction.DEFAULT_COMMIT_EVERY
+
+    def test_savepoint(self, mocker) -> None:
+        """ Test: Failed batches are rolled back to savepoint """
+
+        connection = mocker.MagicMock()
+        cursor = connection.cursor().__enter__()
+        logger = mocker.Mock()
+
+        def method(query: str) -> None:
+            if query == 'bad':
+                raise psycopg2.ProgrammingError('syntax error')
+
+        with Transaction(connection, 'savepoint', logger) as transaction:
+            for query in ['good', 'bad', 'good']:
+                transaction.run(method, query)
+
+        assert transaction.failed == 1
+        assert cursor.execute.call_args_list == [
+            mocker.call('SAVEPOINT deploy_tool_batch'),
+            mocker.call('RELEASE SAVEPOINT deploy_tool_batch'),
+            mocker.call('SAVEPOINT deploy_tool_batch'),
+            mocker.call('ROLLBACK TO SAVEPOINT deploy_tool_batch'),
+            mocker.call('SAVEPOINT deploy_tool_batch'),
+            mocker.call('RELEASE SAVEPOINT deploy_tool_batch'),
+        ]
+        logger.add.assert_called_with('Batch is rolled back: syntax error')
+        connection.commit.assert_called_once()
+
+    def test_mode(self, mocker) -> None:
+        """ Test: Unknown mode """
+
+        with pytest.raises(ValueError):
+            Transaction(mocker.Mock(), 'none', mocker.Mock())
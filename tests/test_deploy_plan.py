@@ -0,0 +1,142 @@
+from src.deploy_tool.deploy_plan import DeployPlan
+from src.deploy_tool.deploy_tool import DeployTool
+import json
+import time
+
+
+class DeployToolMock():
+    """
+    DeployTool mock, records called steps
+    """
+
+    def __init__(self, mocker):
+        self.logger = mocker.Mock()
+        self.logger.span = mocker.MagicMock()
+        self.called = []
+
+    def init_db(self) -> bool:
+        self.called.append('init_db')
+        return True
+
+    def query_from_file(self, path: str = '') -> bool:
+        self.called.append(path)
+        return path != 'fail.sql'
+
+    def build_config(self, src: str, dest: str) -> bool:
+        time.sleep(0.2)
+        self.called.append(dest)
+        return True
+
+
+class TestDeployPlan():
+    """
+    Test deploy plan
+    """
+
+    def test_run(self, mocker) -> None:
+        """ Test: Independent steps run concurrently """
+
+        deploy_tool = DeployToolMock(mocker)
+        plan = DeployPlan([
+            {'name': 'db', 'action': 'init_db'},
+            {'name': 'schema', 'action': 'query_from_file',
+             'path': 'schema.sql', 'after': ['db']},
+            {'name': 'a', 'action': 'build_config', 'src': 's', 'dest': 'a'},
+            {'name': 'b', 'action': 'build_config', 'src': 's', 'dest': 'b'},
+            {'name': 'c', 'action': 'build_config', 'src': 's', 'dest': 'c',
+             'after': ['a']},
+        ])
+
+        start = time.perf_counter()
+        result = plan.run(deploy_tool, 4)
+
+        assert time.perf_counter() - start < 0.55
+        assert result == {
+            'db': 'ok', 'schema': 'ok', 'a': 'ok', 'b': 'ok', 'c': 'ok'
+        }
+        assert deploy_tool.called.index('init_db') \
+            < deploy_tool.called.index('schema.sql')
+        assert deploy_tool.called.index('a') < deploy_tool.called.index('c')
+        assert plan.critical_path == ['a', 'c']
+
+    def test_run_failed(self, mocker) -> None:
+        """ Test: Steps after a failed step are skipped """
+
+        deploy_tool = DeployToolMock(mocker)
+        plan = DeployPlan([
+            {'name': 'c', 'action': 'build_config', 'src': 's', 'dest': 'c',
+             'after': ['b']},
+            {'name': 'b', 'action': 'build_config', 'src': 's', 'dest': 'b',
+             'after': ['a']},
+            {'name': 'a', 'action': 'query_from_file', 'path': 'fail.sql'},
+            {'name': 'd', 'action': 'init_db'},
+        ])
+
+        result = plan.run(deploy_tool)
+
+        assert result == {'c': 'skipped', 'b': 'skipped', 'a': 'failed',
+                          'd': 'ok'}
+        assert deploy_tool.called == ['fail.sql', 'init_db'] \
+            or deploy_tool.called == ['init_db', 'fail.sql']
+        deploy_tool.logger.add.assert_any_call('Plan step a failed')
+
+    def test_check(self) -> None:
+        """ Test: Bad plans """
+
+        for steps, message in [
+            (
+                [{'name': 'a', 'action': 'init_db', 'after': ['b']},
+                 {'name': 'b', 'action': 'init_db', 'after': ['a']}],
+                'Plan steps cycle at a'
+            ),
+            (
+                [{'name': 'a', 'action': 'init_db', 'after': ['x']}],
+                'Unknown plan step x in a'
+            ),
+            (
+                [{'name': 'a', 'action': 'close'}],
+                'Unknown plan step action: close'
+            ),
+            (
+                [{'name': 'a', 'action': 'init_db'},
+                 {'name': 'a', 'action': 'init_db'}],
+                'Plan steps must have unique names'
+            ),
+        ]:
+            try:
+                DeployPlan(steps)
+                assert False
+            except ValueError as e:
+                assert str(e) == message
+
+    def test_load(self, tmp_path) -> None:
+        """ Test: Load JSON and TOML plans """
+
+        path = tmp_path / 'plan.toml'
+        path.write_text(
+            'workers = 2\n'
+            '[[steps]]\nname = "db"\naction = "init_db"\n'
+            '[[steps]]\nname = "dump"\naction = "query_from_file"\n'
+            'path = "dump.sql"\nafter = ["db"]\n'
+        )
+        plan = DeployPlan.load(str(path))
+        assert plan.workers == 2
+        assert plan.order == ['db', 'dump']
+
+        path = tmp_path / 'plan.json'
+        path.write_text(json.dumps({'steps': plan.steps}))
+        assert DeployPlan.load(str(path)).steps == plan.steps
+
+    def test_run_plan(self, mocker, tmp_path) -> None:
+        """ Test: DeployTool runs plan file """
+
+        path = tmp_path / 'plan.json'
+        path.write_text(json.dumps({'steps': [
+            {'name': 'db', 'action': 'init_db'},
+        ]}))
+        deploy_tool = DeployTool({'options': {'mount_dir': str(tmp_path)}})
+        mocker.patch.object(deploy_tool.logger, 'add')
+        mocker.patch.object(deploy_tool, 'init_db', return_value=True)
+
+        assert deploy_tool.run_plan('{{mount_dir}}/plan.json') == {'db': 'ok'}
+        deploy_tool.init_db.assert_called_once()
@@ -1,8 +1,11 @@
 from src.deploy_tool.db_postgres import DbPostgres
 from src.deploy_tool.deploy_tool import DeployTool
 from src.deploy_tool.macros import Macros
+from src.deploy_tool.manifest import Manifest
 import argparse
+import json
 import os
+import pytest
 
 
 class TestDeployTool():
@@ -45,7 +48,7 @@ class TestDeployTool():
         mocker.patch.object(deploy_tool.logger, 'add', autospec=True)
 
         # Unknown DB type
-        deploy_tool.init_db()
+        assert not deploy_tool.init_db()
         deploy_tool.logger.add.assert_called_with(
             f'Can\'t initialise DB: Unknown DB type: {options["db_type"]}'
         )
@@ -53,7 +56,7 @@ class TestDeployTool():
         # PostgreSQL type ('pgsql')
         deploy_tool.options['db_type'] = 'pgsql'
         mocker.patch.object(DbPostgres, 'init_db', side_effect=lambda: 1)
-        deploy_tool.init_db()
+        assert deploy_tool.init_db()
         deploy_tool._DeployTool__get_options.assert_called()
         assert deploy_tool.db == 1
 
@@ -83,16 +86,29 @@ class TestDeployTool():
         # Defined DB
         deploy_tool.db = mocker.Mock()
         deploy_tool.db.query_from_file = mocker.Mock()
-        deploy_tool.query_from_file()
+        assert deploy_tool.query_from_file()
         deploy_tool.db.query_from_file.assert_called()
 
         # Query error
         deploy_tool.db.query_from_file = lambda x: 0/0
-        deploy_tool.query_from_file()
+        assert not deploy_tool.query_from_file()
         deploy_tool.logger.add.assert_called_with(
             'Can\'t execute query: division by zero'
         )
 
+    def test_close(self, mocker) -> None:
+        """ Test close DB connections """
+
+        deploy_tool = self.deploy_tool
+
+        # Undefined DB
+        deploy_tool.close()
+
+        # Defined DB
+        deploy_tool.db = mocker.Mock()
+        deploy_tool.close()
+        deploy_tool.db.close.assert_called_once()
+
     def test_build_config(self, mocker) -> None:
         """ Build config file """
 
@@ -126,16 +142,243 @@ class TestDeployTool():
         deploy_tool.logger.add.assert_called_with(f'Build file: {dest}')
         Macros.replace.assert_any_call(src, deploy_tool.options)
         Macros.replace.assert_any_call(dest, deploy_tool.options)
-        deploy_tool._DeployTool__make_config_file.assert_called_with(src, dest)
+        deploy_tool._DeployTool__make_config_file.assert_called_with(
+            src,
+            dest,
+            mocker.ANY,
+            True
+        )
 
         # Fail build
         deploy_tool._DeployTool__get_options.assert_called()
-        deploy_tool._DeployTool__make_config_file = lambda x, y: 0/0
+        deploy_tool._DeployTool__make_config_file = lambda *args: 0/0
         deploy_tool.build_config(src, dest)
         deploy_tool.logger.add.assert_called_with(
             f'Can\'t build config {dest}: division by zero'
         )
 
+    def test_build_configs(self, mocker, tmp_path) -> None:
+        """ Build config files in parallel """
+
+        deploy_tool = self.deploy_tool
+        mocker.patch.object(deploy_tool.logger, 'add')
+
+        src_dir = tmp_path / 'src'
+        src_dir.mkdir()
+        for name in ['a.conf', 'b.conf', 'c.txt']:
+            (src_dir / name).write_text(name + ' {{db_name}}')
+
+        results = deploy_tool.build_configs([
+            (str(src_dir / '*.conf'), str(tmp_path / '{{mount_dir}}')),
+            (str(src_dir / 'c.txt'), str(tmp_path / 'c' / 'c.txt')),
+            (str(src_dir / 'none.txt'), str(tmp_path / 'none.txt')),
+        ], workers=2)
+
+        dest_dir = tmp_path / 'test_mount_dir'
+        assert results == {
+            str(dest_dir / 'a.conf'): True,
+            str(dest_dir / 'b.conf'): True,
+            str(tmp_path / 'c' / 'c.txt'): True,
+            str(tmp_path / 'none.txt'): False,
+        }
+        assert (dest_dir / 'a.conf').read_text() == 'a.conf test_name'
+        assert (tmp_path / 'c' / 'c.txt').read_text() == 'c.txt test_name'
+        deploy_tool.logger.add.assert_any_call(
+            f'Build file: {dest_dir / "b.conf"}'
+        )
+        deploy_tool.logger.add.assert_called_with(
+            'Built 3 of 4 config files'
+        )
+
+    def test_build_config_tree(self, mocker, tmp_path) -> None:
+        """ Build config files tree """
+
+        deploy_tool = self.deploy_tool
+        mocker.patch.object(deploy_tool.logger, 'add')
+
+        src_dir = tmp_path / 'src'
+        for name in [
+            'a.conf',
+            'skip.txt',
+            'nginx/{{db_name}}.conf',
+            'nginx/sites/b.conf',
+            'cache/c.conf',
+        ]:
+            (src_dir / name).parent.mkdir(parents=True, exist_ok=True)
+            (src_dir / name).write_text(name + ' {{db_host}}')
+
+        makedirs = mocker.spy(os, 'makedirs')
+        results = deploy_tool.build_config_tree(
+            str(src_dir),
+            str(tmp_path / '{{mount_dir}}'),
+            include=['*.conf'],
+            exclude=['cache'],
+            workers=2
+        )
+
+        dest_dir = tmp_path / 'test_mount_dir'
+        assert results == {
+            str(dest_dir / 'a.conf'): True,
+            str(dest_dir / 'nginx' / 'test_name.conf'): True,
+            str(dest_dir / 'nginx' / 'sites' / 'b.conf'): True,
+        }
+        assert (dest_dir / 'nginx' / 'test_name.conf').read_text() \
+            == 'nginx/test_name.conf test_host'
+        assert not (dest_dir / 'cache').exists()
+        assert makedirs.call_count == 3
+        deploy_tool.logger.add.assert_called_with(
+            'Built 3 of 3 config files'
+        )
+
+        # Missing source directory
+        missing = tmp_path / 'missing'
+        assert deploy_tool.build_config_tree(str(missing), str(dest_dir)) \
+            == {}
+        args = deploy_tool.logger.add.call_args[0]
+        assert args[0].startswith(f'Can\'t build config tree {missing}: ')
+
+    def test_build_config_tree_symlinks(self, mocker, tmp_path) -> None:
+        """ Build config files tree with directory symlinks """
+
+        deploy_tool = self.deploy_tool
+        mocker.patch.object(deploy_tool.logger, 'add')
+
+        src_dir = tmp_path / 'src'
+        shared = tmp_path / 'shared'
+        (src_dir / 'nginx').mkdir(parents=True)
+        shared.mkdir()
+        (src_dir / 'nginx' / 'a.conf').write_text('{{db_name}}')
+        (shared / 'b.conf').write_text('{{db_name}}')
+        (src_dir / 'nginx' / 'loop').symlink_to(src_dir)
+        (src_dir / 'shared').symlink_to(shared)
+
+        dest_dir = tmp_path / 'dest'
+        results = deploy_tool.build_config_tree(str(src_dir), str(dest_dir))
+        assert results == {
+            str(dest_dir / 'nginx' / 'a.conf'): True,
+            str(dest_dir / 'shared' / 'b.conf'): True,
+        }
+
+    def test_build_config_variants(self, mocker, tmp_path) -> None:
+        """ Build config file variants from one template """
+
+        manifest = tmp_path / 'manifest.json'
+        deploy_tool = DeployTool({
+            'options': self.options,
+            'manifest': str(manifest),
+        })
+        mocker.patch.object(deploy_tool.logger, 'add')
+
+        src = tmp_path / 'app.conf'
+        src.write_text('tenant={{tenant}} db={{db_name}}\n')
+        dest = str(tmp_path / '{{tenant}}' / 'app.conf')
+        variants = [{'tenant': f'tenant_{i}'} for i in range(5)]
+
+        for workers in [1, 3]:
+            results = deploy_tool.build_config_variants(
+                str(src),
+                dest,
+                variants,
+                workers
+            )
+            assert list(results) == [
+                str(tmp_path / f'tenant_{i}' / 'app.conf') for i in range(5)
+            ]
+            assert all(results.values())
+            assert (tmp_path / 'tenant_3' / 'app.conf').read_text() \
+                == 'tenant=tenant_3 db=test_name\n'
+        deploy_tool.logger.add.assert_called_with('Built 5 of 5 config files')
+
+        # Bad template
+        results = deploy_tool.build_config_variants(
+            str(tmp_path / 'none.conf'),
+            dest,
+            variants[:1]
+        )
+        assert results == {str(tmp_path / 'tenant_0' / 'app.conf'): False}
+
+        # Directory can't be created, other variants are built
+        (tmp_path / 'blocked').write_text('file in the way')
+        results = deploy_tool.build_config_variants(
+            str(src),
+            dest,
+            [{'tenant': 'blocked'}, {'tenant': 'tenant_5'}]
+        )
+        assert results == {
+            str(tmp_path / 'blocked' / 'app.conf'): False,
+            str(tmp_path / 'tenant_5' / 'app.conf'): True,
+        }
+        assert any(
+            call[0][0].startswith(
+                f'Can\'t create config directory {tmp_path / "blocked"}: '
+            )
+            for call in deploy_tool.logger.add.call_args_list
+        )
+
+    def test_build_config_incremental(self, mocker, tmp_path) -> None:
+        """ Build config files with manifest """
+
+        manifest = tmp_path / 'manifest.json'
+        deploy_tool = DeployTool({
+            'options': self.options,
+            'manifest': str(manifest),
+        })
+        mocker.patch.object(deploy_tool.logger, 'add')
+
+        src = tmp_path / 'src.conf'
+        dest = tmp_path / 'conf' / 'dest.conf'
+        src.write_text('name={{db_name}}')
+
+        assert deploy_tool.build_config(str(src), str(dest))
+        assert dest.read_text() == 'name=test_name'
+        assert manifest.exists()
+        assert os.listdir(dest.parent) == ['dest.conf']
+
+        # Nothing changed
+        mtime = dest.stat().st_mtime_ns
+        mocker.patch('builtins.open', side_effect=AssertionError)
+        assert deploy_tool.build_config(str(src), str(dest))
+        deploy_tool.logger.add.assert_called_with(
+            f'Config {dest} is up to date'
+        )
+        mocker.stopall()
+
+        # Options changed, output is the same
+        mocker.patch.object(deploy_tool.logger, 'add')
+        deploy_tool.options['db_host'] = 'changed_host'
+        mocker.patch('os.replace', side_effect=AssertionError)
+        assert deploy_tool.build_config(str(src), str(dest))
+        assert dest.stat().st_mtime_ns == mtime
+        mocker.stopall()
+
+        # Options changed, output too
+        deploy_tool.options['db_name'] = 'changed_name'
+        assert deploy_tool.build_config(str(src), str(dest))
+        assert dest.read_text() == 'name=changed_name'
+
+    def test_build_config_timing(self, mocker, tmp_path) -> None:
+        """ Build config file with timing log """
+
+        timing = tmp_path / 'timing.jsonl'
+        deploy_tool = DeployTool({
+            'options': self.options,
+            'timing_log': str(timing),
+        })
+        mocker.patch.object(deploy_tool.logger, 'add')
+
+        src = tmp_path / 'src.conf'
+        dest = tmp_path / 'dest.conf'
+        src.write_text('{{db_name}}')
+        deploy_tool.build_config(str(src), str(dest))
+
+        record = json.loads(timing.read_text())
+        assert record['span'] == 'build_config'
+        assert record['status'] == 'ok'
+        assert record['src'] == str(src)
+        assert record['dest'] == str(dest)
+        assert record['bytes_read'] == 11
+        assert record['bytes_written'] == 9
+
     def test_init_options(self) -> None:
         """ Test options initialisation """
 
@@ -209,20 +452,141 @@ class TestDeployTool():
 
         mocker.patch('os.path.dirname', return_value=dest)
         mocker.patch('os.makedirs', autospec=True)
+        mocker.patch('os.replace', autospec=True)
+        mocker.patch('os.path.isfile', return_value=False)
+        mocker.patch.object(Manifest, 'temp_path', return_value='dst.tmp')
         mocker.patch('builtins.open', mocker.mock_open(read_data=src_data))
+        mocker.patch.object(
+            deploy_tool,
+            '_DeployTool__is_plain',
+            return_value=False
+        )
         mocker.patch.object(
             Macros,
-            'replace',
+            'replace_stream',
             autospec=True,
-            return_value=src_data
+            side_effect=lambda chunks, options: chunks
         )
 
         deploy_tool._DeployTool__make_config_file(src, dest)
-        Macros.replace.assert_called_with(src_data, deploy_tool.options)
+        Macros.replace_stream.assert_called_once()
         os.path.dirname.assert_called_with(dest)
         os.makedirs.assert_called_with(dest, exist_ok=True)
         open.assert_any_call(src, encoding=deploy_tool.ENCODING)
-        open.assert_any_call(dest, 'w', encoding=deploy_tool.ENCODING)
+        open.assert_any_call('dst.tmp', 'x', encoding=deploy_tool.ENCODING)
+        open().write.assert_called_with(src_data)
+        os.replace.assert_called_once_with('dst.tmp', os.path.realpath(dest))
+
+    def test_make_config_file_failed(self, mocker, tmp_path) -> None:
+        """ Test failed build leaves dest config intact """
+
+        deploy_tool = self.deploy_tool
+
+        src = tmp_path / 'src.conf'
+        dest = tmp_path / 'dest.conf'
+        dest.write_text('live config')
+
+        # Bad UTF-8 byte in rendered source
+        src.write_bytes(b'name={{db_name}}\xff')
+        with pytest.raises(UnicodeDecodeError):
+            deploy_tool._DeployTool__make_config_file(str(src), str(dest))
+        assert dest.read_text() == 'live config'
+        assert sorted(os.listdir(tmp_path)) == ['dest.conf', 'src.conf']
+
+        # Failed plain copy
+        src.write_bytes(b'name=value')
+        mocker.patch.object(
+            deploy_tool,
+            '_DeployTool__copy_file',
+            side_effect=OSError('No space left on device')
+        )
+        with pytest.raises(OSError):
+            deploy_tool._DeployTool__make_config_file(str(src), str(dest))
+        assert dest.read_text() == 'live config'
+        assert sorted(os.listdir(tmp_path)) == ['dest.conf', 'src.conf']
+
+    def test_make_config_file_symlink(self, mocker, tmp_path) -> None:
+        """ Test make config file through symlinked dest """
+
+        deploy_tool = self.deploy_tool
+
+        src = tmp_path / 'src.conf'
+        real = tmp_path / 'real.conf'
+        dest = tmp_path / 'dest.conf'
+        src.write_text('name={{db_name}}')
+        real.write_text('old')
+        real.chmod(0o640)
+        dest.symlink_to(real)
+
+        deploy_tool._DeployTool__make_config_file(str(src), str(dest))
+        assert dest.is_symlink()
+        assert real.read_text() == 'name=test_name'
+        assert real.stat().st_mode & 0o777 == 0o640
+
+        # Owner is kept
+        stat = os.stat
+
+        def owned_stat(path: str, *args, **kwargs) -> os.stat_result:
+            result = stat(path, *args, **kwargs)
+            if path != str(real):
+                return result
+            return os.stat_result(tuple(result)[:4] + (4242, 4243)
+                                  + tuple(result)[6:10])
+
+        chown = mocker.patch('os.chown')
+        mocker.patch('os.stat', side_effect=owned_stat)
+        deploy_tool._DeployTool__make_config_file(str(src), str(dest))
+        mocker.stopall()
+        chown.assert_called_once_with(mocker.ANY, 4242, 4243)
+        assert real.read_text() == 'name=test_name'
+
+    def test_make_config_file_stream(self, tmp_path) -> None:
+        """ Test make config file by small chunks """
+
+        deploy_tool = self.deploy_tool
+        deploy_tool.CHUNK_SIZE = 3
+
+        src = tmp_path / 'src.conf'
+        dest = tmp_path / 'conf' / 'dest.conf'
+        src.write_text('name={{db_name}}\nport={{db_port}}\n{{unknown}}')
+
+        deploy_tool._DeployTool__make_config_file(str(src), str(dest))
+        assert dest.read_text() == (
+            'name=test_name\nport=test_port\n{{unknown}}'
+        )
+
+    def test_make_config_file_copy(self, mocker, tmp_path) -> None:
+        """ Test make config file without macros by kernel copy """
+
+        deploy_tool = self.deploy_tool
+        mocker.patch.object(Macros, 'replace_stream')
+
+        src = tmp_path / 'src.conf'
+        dest = tmp_path / 'conf' / 'dest.conf'
+        data = b'name=value\n{single} braces\xff' * 1000
+        src.write_bytes(data)
+
+        deploy_tool._DeployTool__make_config_file(str(src), str(dest))
+        assert dest.read_bytes() == data
+        Macros.replace_stream.assert_not_called()
+
+        # Kernel copy isn't supported
+        mocker.patch('os.copy_file_range', side_effect=OSError, create=True)
+        mocker.patch('os.sendfile', side_effect=OSError, create=True)
+        dest.unlink()
+        deploy_tool._DeployTool__make_config_file(str(src), str(dest))
+        assert dest.read_bytes() == data
+
+        # Empty file
+        src.write_bytes(b'')
+        deploy_tool._DeployTool__make_config_file(str(src), str(dest))
+        assert dest.read_bytes() == b''
+
+        # CR newlines are translated by rendering
+        src.write_bytes(b'a\r\nb')
+        mocker.stopall()
+        deploy_tool._DeployTool__make_config_file(str(src), str(dest))
+        assert dest.read_bytes() == b'a\nb'
 
 
 class ArgumentParserMock():
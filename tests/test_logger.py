@@ -1,4 +1,6 @@
 from src.deploy_tool.logger import Logger
+import json
+import pytest
 
 
 class TestLogger():
@@ -15,3 +17,38 @@ class TestLogger():
         logger.add(messsage)
         captured = capsys.readouterr()
         assert captured.out == messsage + '\n'
+
+    def test_span(self, tmp_path) -> None:
+        """ Test: Timed spans """
+
+        path = tmp_path / 'timing.jsonl'
+        logger = Logger(str(path))
+
+        with logger.span('test_span', path='test_path') as span:
+            span.add('statements')
+            span.add('statements', 2)
+            span.set('bytes_read', 10)
+
+        with pytest.raises(ZeroDivisionError):
+            with logger.span('test_error'):
+                0/0
+
+        records = [json.loads(line) for line in path.read_text().splitlines()]
+        assert records[0]['span'] == 'test_span'
+        assert records[0]['status'] == 'ok'
+        assert records[0]['duration'] >= 0
+        assert records[0]['path'] == 'test_path'
+        assert records[0]['statements'] == 3
+        assert records[0]['bytes_read'] == 10
+        assert records[1]['span'] == 'test_error'
+        assert records[1]['status'] == 'error'
+        assert records[1]['error'] == 'division by zero'
+
+    def test_span_disabled(self, tmp_path) -> None:
+        """ Test: Spans without timing log """
+
+        logger = Logger()
+        with logger.span('test_span') as span:
+            span.add('statements')
+
+        assert span.fields == {'statements': 1}
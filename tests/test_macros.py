@@ -15,3 +15,48 @@ class TestLogger():
             'test_var2': 'var2',
         }
         assert Macros.replace(str, d) == 'var1 and var2'
+
+    def test_replace_unknown(self) -> None:
+        """ Test: Unknown macroses are kept """
+
+        str = '{{test_var1}} {{unknown}} {{{test_var1}}}'
+        d = {'test_var1': 'var1'}
+        assert Macros.replace(str, d) == 'var1 {{unknown}} {var1}'
+
+    def test_replace_nested(self) -> None:
+        """ Test: Macroses inside of values """
+
+        str = '{{test_var1}}/{{test_var2}}'
+        d = {
+            'test_var1': '{{test_var2}}/dir',
+            'test_var2': 'var2',
+        }
+        assert Macros.replace(str, d) == 'var2/dir/var2'
+
+        # Earlier macroses aren't replaced in later values
+        d = {
+            'test_var2': 'var2',
+            'test_var1': '{{test_var2}}/dir',
+        }
+        assert Macros.replace(str, d) == '{{test_var2}}/dir/var2'
+
+    def test_compile(self) -> None:
+        """ Test: Compile template """
+
+        template = Macros.compile('a {{test_var1}} b')
+        assert template.parts == ['a ', ' b']
+        assert template.names == ['test_var1']
+        assert Macros.compile('a {{test_var1}} b') is template
+        assert template.render({'test_var1': 'var1'}) == 'a var1 b'
+
+    def test_replace_stream(self) -> None:
+        """ Test: Replace macroses in chunks """
+
+        d = {
+            'test_var1': 'var1',
+            'test_var2': 'var2',
+        }
+        chunks = ['{', '{test_', 'var1}', '} {{te', 'st_var2}}{', '{x}}{{']
+        result = ''.join(Macros.replace_stream(chunks, d))
+        assert result == Macros.replace(''.join(chunks), d)
+        assert result == 'var1 var2{{x}}{{'
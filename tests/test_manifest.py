@@ -0,0 +1,59 @@
+from src.deploy_tool.manifest import Manifest
+import os
+
+
+class TestManifest():
+    """
+    Test built config files manifest
+    """
+
+    def test_source_hash(self, mocker, tmp_path) -> None:
+        """ Test: Source hash is cached by file stat """
+
+        src = tmp_path / 'src.conf'
+        src.write_text('source')
+        manifest = Manifest(str(tmp_path / 'manifest.json'))
+
+        source_hash = manifest.source_hash(str(src))
+        assert source_hash == Manifest.hash_file(str(src))
+
+        mocker.patch.object(Manifest, 'hash_file')
+        assert manifest.source_hash(str(src)) == source_hash
+        Manifest.hash_file.assert_not_called()
+
+    def test_is_fresh(self, tmp_path) -> None:
+        """ Test: Output freshness """
+
+        dest = tmp_path / 'dest.conf'
+        dest.write_text('output')
+        path = str(tmp_path / 'manifest.json')
+
+        manifest = Manifest(path)
+        assert not manifest.is_fresh(str(dest), 'source', 'options')
+
+        output_hash = Manifest.hash_file(str(dest))
+        manifest.update(str(dest), 'source', 'options', output_hash)
+        manifest.save()
+
+        # Loaded manifest
+        manifest = Manifest(path)
+        assert manifest.is_fresh(str(dest), 'source', 'options')
+        assert not manifest.is_fresh(str(dest), 'source', 'changed')
+        assert manifest.output_hash(str(dest)) == output_hash
+
+        # Changed output
+        dest.write_text('changed output')
+        assert not manifest.is_fresh(str(dest), 'source', 'options')
+        assert manifest.output_hash(str(dest)) \
+            == Manifest.hash_file(str(dest))
+
+        os.remove(dest)
+        assert manifest.output_hash(str(dest)) is None
+
+    def test_hash_options(self) -> None:
+        """ Test: Options hash doesn't depend on order """
+
+        assert Manifest.hash_options({'a': '1', 'b': '2'}) \
+            == Manifest.hash_options({'b': '2', 'a': '1'})
+        assert Manifest.hash_options({'a': '1'}) \
+            != Manifest.hash_options({'a': '2'})
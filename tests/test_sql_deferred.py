@@ -0,0 +1,50 @@
+from src.deploy_tool.sql_deferred import SqlDeferred
+
+
+class TestSqlDeferred():
+    """
+    Test deferred index and constraint statements
+    """
+
+    def test_add(self) -> None:
+        """ Test: Defer statements """
+
+        deferred = SqlDeferred()
+
+        assert not deferred.add('ALTER INDEX i ATTACH PARTITION j')
+        assert not deferred.add('CREATE TABLE t (a int)')
+        assert not deferred.add('ALTER TABLE t ADD COLUMN b int')
+        assert deferred.add('CREATE UNIQUE INDEX i ON public.t (a)')
+        assert deferred.add(
+            'ALTER TABLE ONLY public.t\n'
+            '    ADD CONSTRAINT t_pkey PRIMARY KEY (a)'
+        )
+        assert deferred.add(
+            'ALTER TABLE ONLY public.c\n'
+            '    ADD CONSTRAINT c_fk FOREIGN KEY (t_id)'
+            ' REFERENCES public.t(a)'
+        )
+        assert deferred.add('ALTER INDEX i ATTACH PARTITION j')
+        assert len(deferred) == 4
+
+    def test_stages(self) -> None:
+        """ Test: Deferred statements stages """
+
+        deferred = SqlDeferred()
+        statements = [
+            'ALTER TABLE a ADD CONSTRAINT a_b FOREIGN KEY (x) REFERENCES b(x)',
+            'ALTER TABLE b ADD CONSTRAINT b_a FOREIGN KEY (x) REFERENCES a(x)',
+            'ALTER TABLE c ADD CONSTRAINT c_d FOREIGN KEY (x) REFERENCES d(x)',
+            'CREATE INDEX a_x ON a (x)',
+            'ALTER TABLE a ADD CONSTRAINT a_pkey PRIMARY KEY (x)',
+            'COMMENT ON INDEX a_x IS \'x\'',
+        ]
+        for statement in statements:
+            deferred.add(statement)
+
+        assert deferred.stages() == [
+            [statements[3], statements[4]],
+            [statements[0], statements[2]],
+            [statements[1]],
+            [statements[5]],
+        ]
@@ -0,0 +1,43 @@
+from src.deploy_tool.sql_inserts import InsertBlock, SqlInserts
+
+
+class TestSqlInserts():
+    """
+    Test single-row INSERT statements coalescer
+    """
+
+    def test_coalesce(self) -> None:
+        """ Test: Coalesce consecutive INSERTs by table and columns """
+
+        statements = [
+            "INSERT INTO t (a, b) VALUES (1, 'x''y')",
+            "INSERT INTO t (a, b) VALUES (2, E'a\\'b)')",
+            'INSERT INTO t (a, b) VALUES (3, now())',
+            'INSERT INTO t (a, b) VALUES (4, \'(\')',
+            'INSERT INTO t VALUES (5)',
+            'INSERT INTO "s"."t" ("a b") VALUES (6)',
+            'INSERT INTO "s"."t" ("a b") VALUES (7)',
+            'SELECT 1',
+            'INSERT INTO t (a, b) VALUES (1, 2), (3, 4)',
+            'INSERT INTO t (a, b) VALUES (5, 6) ON CONFLICT DO NOTHING',
+            'INSERT INTO t (a, b) VALUES (7, $$x$$)',
+            'INSERT INTO t (a, b) SELECT 1, 2',
+        ]
+
+        result = [
+            (statement.query, statement.rows)
+            if isinstance(statement, InsertBlock) else statement
+            for statement in SqlInserts(3).coalesce(statements)
+        ]
+
+        assert result == [
+            ('INSERT INTO t (a, b) VALUES', [
+                "(1, 'x''y')",
+                "(2, E'a\\'b)')",
+                '(3, now())',
+            ]),
+            "INSERT INTO t (a, b) VALUES (4, '(')",
+            'INSERT INTO t VALUES (5)',
+            ('INSERT INTO "s"."t" ("a b") VALUES', ['(6)', '(7)']),
+            'SELECT 1',
+        ] + statements[-4:]
@@ -0,0 +1,89 @@
+from src.deploy_tool.sql_inserts import InsertBlock
+from src.deploy_tool.sql_profiler import SqlProfiler
+from src.deploy_tool.sql_splitter import SqlSplitter
+import psycopg2
+
+
+class TestSqlProfiler():
+    """
+    Test slow statements profiler
+    """
+
+    def test_add(self) -> None:
+        """ Test: Keep the top slowest statements """
+
+        profiler = SqlProfiler(2)
+        profiler.add(0.1, 'SELECT 1', 0)
+        profiler.add(0.3, 'SELECT  3\n  FROM t', 10)
+        profiler.add(0.2, InsertBlock('INSERT INTO t VALUES', ['(1)', '(2)']),
+                     20, 2)
+        profiler.add(0.05, 'SELECT 4', 30)
+
+        report = profiler.report()
+        assert [
+            (entry['duration'], entry['offset'], entry['statements'],
+             entry['excerpt'])
+            for entry in report
+        ] == [
+            (0.3, 10, 1, 'SELECT 3 FROM t'),
+            (0.2, 20, 2, 'INSERT INTO t VALUES (1), ... (2 rows)'),
+        ]
+
+    def test_excerpt(self) -> None:
+        """ Test: Long statements are cut """
+
+        profiler = SqlProfiler(1)
+        profiler.add(1.0, 'SELECT ' + 'x' * 1000, 0)
+
+        excerpt = profiler.report()[0]['excerpt']
+        assert len(excerpt) == SqlProfiler.EXCERPT_SIZE
+        assert excerpt.endswith('...')
+
+    def test_offsets(self) -> None:
+        """ Test: Offsets of tracked statements """
+
+        sql = (
+            'SELECT 1;\n'
+            '  INSERT INTO t VALUES (1);\n'
+            'INSERT INTO t VALUES (2);'
+        )
+        splitter = SqlSplitter()
+        profiler = SqlProfiler(1)
+        statements = profiler.track(splitter.split([sql]), splitter)
+
+        assert next(statements) == 'SELECT 1'
+        assert profiler.offset('SELECT 1') == 0
+
+        # Insert block takes offsets of its rows
+        list(statements)
+        block = InsertBlock('INSERT INTO t VALUES', ['(1)', '(2)'])
+        assert profiler.offset(block) == sql.index('INSERT')
+        assert profiler.offset('SELECT 2') is None
+
+        profiler.defer('CREATE INDEX i ON t (a)', 5)
+        assert profiler.deferred_offset('CREATE INDEX i ON t (a)') == 5
+
+    def test_capture_plans(self, mocker) -> None:
+        """ Test: EXPLAIN only single DML statements """
+
+        profiler = SqlProfiler(4)
+        profiler.add(0.4, 'UPDATE t SET a = 1', 0)
+        profiler.add(0.3, 'UPDATE t SET a = 2;\nSELECT 1', 10, 2)
+        profiler.add(0.2, 'CREATE TABLE t (a int)', 20)
+        profiler.add(0.1, 'DELETE FROM u', 30)
+
+        cursor = mocker.Mock()
+        cursor.fetchall.return_value = [('Update on t',), ('  -> Seq Scan',)]
+        cursor.execute.side_effect = [None, psycopg2.Error('no table u')]
+        profiler.capture_plans(cursor)
+
+        assert cursor.execute.call_args_list == [
+            mocker.call('EXPLAIN UPDATE t SET a = 1'),
+            mocker.call('EXPLAIN DELETE FROM u'),
+        ]
+        assert [entry['plan'] for entry in profiler.report()] == [
+            'Update on t\n  -> Seq Scan',
+            None,
+            None,
+            'EXPLAIN failed: no table u',
+        ]
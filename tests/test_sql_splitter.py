@@ -0,0 +1,147 @@
+from src.deploy_tool.sql_splitter import CopyBlock, SqlSplitter
+import pytest
+
+
+class TestSqlSplitter():
+    """
+    Test SQL statements splitter
+    """
+
+    def setup(self):
+        self.sql = (
+            "-- Header; comment\n"
+            "\\restrict key\n"
+            "\\set ON_ERROR_STOP on\n"
+            "SET x = 'a;b''c';\n"
+            "CREATE FUNCTION f() RETURNS int\n"
+            "    AS $body$ SELECT 1; $$ ; $body$ LANGUAGE sql;\n"
+            "SELECT E'it\\'s; ok', \"we;ird\"\"id\" /* a; /* b; */ c */;\n"
+            "SELECT a$b$c FROM t WHERE x = $1;\n"
+            "COPY public.t (a, b) FROM stdin;\n"
+            "1\tx;y\n"
+            "2\t'q\n"
+            "\\.\n"
+            "SELECT 1 - -2 / 3\n"
+        )
+        self.statements = [
+            "SET x = 'a;b''c'",
+            "CREATE FUNCTION f() RETURNS int\n"
+            "    AS $body$ SELECT 1; $$ ; $body$ LANGUAGE sql",
+            "SELECT E'it\\'s; ok', \"we;ird\"\"id\"",
+            'SELECT a$b$c FROM t WHERE x = $1',
+            ('COPY public.t (a, b) FROM stdin', "1\tx;y\n2\t'q\n"),
+            'SELECT 1 - -2 / 3',
+        ]
+
+    def test_split(self) -> None:
+        """ Test: Split statements """
+
+        statements = self.__split([self.sql])
+        assert statements == self.statements
+
+    def test_split_chunks(self) -> None:
+        """ Test: Split statements from small chunks """
+
+        sql = self.sql
+        for size in range(1, 8):
+            chunks = [sql[i:i + size] for i in range(0, len(sql), size)]
+            statements = self.__split(chunks)
+            assert statements == self.statements
+
+    def test_split_meta_commands(self) -> None:
+        """ Test: Unsupported psql meta-commands aren't skipped """
+
+        for sql in [
+            'CREATE TABLE a (id int);\n\\connect other\nSELECT 1;',
+            '\\c other',
+            '\\i other.sql\n',
+            '\\setenv ON_ERROR_STOP x\n',
+        ]:
+            for size in [1, 3, len(sql)]:
+                chunks = [sql[i:i + size] for i in range(0, len(sql), size)]
+                with pytest.raises(ValueError) as exc_info:
+                    self.__split(chunks)
+                assert str(exc_info.value).startswith(
+                    'psql meta-command isn\'t supported: \\'
+                )
+
+        # Backslash inside a statement isn't a meta-command
+        assert self.__split(['SELECT 1 \\gset\n;']) == ['SELECT 1 \\gset']
+
+    def test_split_copy_stream(self) -> None:
+        """ Test: COPY data is read from the text stream """
+
+        sql = self.sql
+        for size in [1, 2, 3, 5, len(sql)]:
+            chunks = [sql[i:i + size] for i in range(0, len(sql), size)]
+            statements = self.__split(chunks, True)
+            assert statements == self.statements
+
+        # Unread data is skipped, unterminated data ends with the text
+        sql = (
+            'COPY t FROM stdin;\n1\n2\n\\.\n'
+            'SELECT 1;\n'
+            'COPY t FROM stdin;\n3\n'
+        )
+        for size in [1, 4, len(sql)]:
+            chunks = [sql[i:i + size] for i in range(0, len(sql), size)]
+            statements = SqlSplitter(True).split(chunks)
+            assert next(statements).query == 'COPY t FROM stdin'
+            assert next(statements) == 'SELECT 1'
+            block = next(statements)
+            assert block.data.read(1) == '3'
+            assert block.data.read() == '\n'
+            assert block.data.size == 2
+            assert list(statements) == []
+
+    def test_split_lazy(self) -> None:
+        """ Test: Statements are yielded before the stream end """
+
+        def chunks():
+            yield 'SELECT 1;'
+            raise AssertionError('Stream is read too far')
+
+        statements = SqlSplitter().split(chunks())
+        assert next(statements) == 'SELECT 1'
+
+    def test_split_offsets(self) -> None:
+        """ Test: Offsets of statements starts """
+
+        sql = self.sql
+        starts = [
+            sql.index(start) for start in [
+                'SET x', 'CREATE', "SELECT E'", 'SELECT a$', 'COPY',
+                'SELECT 1 -',
+            ]
+        ]
+        for size in (1, 3, len(sql)):
+            chunks = [sql[i:i + size] for i in range(0, len(sql), size)]
+            splitter = SqlSplitter()
+            offsets = [splitter.offset for _ in splitter.split(chunks)]
+            assert offsets == starts
+
+    def test_split_copy_spool(self) -> None:
+        """ Test: Big COPY data is kept in a temp file """
+
+        splitter = SqlSplitter()
+        splitter.SPOOL_SIZE = 10
+        data = ''.join([f'{i}\tvalue\n' for i in range(100)])
+        sql = f'COPY t FROM stdin;\n{data}\\.\nSELECT 1;'
+
+        statements = list(splitter.split([sql[:50], sql[50:]]))
+        assert statements[0].data._rolled
+        assert statements[0].data.read() == data
+        assert statements[1] == 'SELECT 1'
+
+    def __split(self, chunks, stream_copy: bool = False) -> list:
+        """ Split statements, COPY blocks as (query, data) """
+
+        statements = []
+        for statement in SqlSplitter(stream_copy).split(chunks):
+            if isinstance(statement, CopyBlock):
+                with statement.data:
+                    data = ''.join(iter(lambda: statement.data.read(2), ''))
+                statement = (statement.query, data)
+            statements.append(statement)
+
+        return statements